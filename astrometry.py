@@ -0,0 +1,194 @@
+""" This class holds the astrometric solver, which matches the stars measured on the four guide cameras to the catalog
+of the field and solves for the pointing and rotation of the telescope, so the fiber offsets can be corrected during
+the exposure sequence."""
+import math
+import numpy as np
+from config import Configuration
+from geometry import Geometry
+from metrics import Metrics
+
+
+class Astrometry:
+
+    def __init__(self, stars, cam_ra, cam_dec, cam_dist=None, plate_scale=None, mag_limit=None):
+        """ The solver projects the catalog stars which can fall on a camera onto the focal plane about camera 1, and
+        keeps them in a KD-tree, so a frame set is matched with a few nearest neighbour queries. Build it once per
+        field, when the cameras are placed.
+
+        :parameter stars - A dictionary (or data frame) with ra, dec and mag of the stars in the field.
+        :parameter cam_ra, cam_dec - The planned sky position of the center of camera 1 in degrees.
+        :parameter cam_dist - The distance between neighbouring cameras in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+        :parameter mag_limit - The faintest star the guide cameras can measure.
+        """
+
+        # scipy is slow to import, so only load it when a solver is built
+        from scipy.spatial import cKDTree
+
+        self.cam_ra, self.cam_dec = cam_ra, cam_dec
+        self.plate_scale = plate_scale if plate_scale is not None else Configuration.OTTO_STRUVE_PLATE_SCALE
+        mag_limit = mag_limit if mag_limit is not None else Configuration.GUIDE_STAR_MAG_LIMIT
+
+        # the center of every camera on the focal plane, relative to camera 1
+        self.cen_x, self.cen_y = Geometry.camera_offsets(1, cam_dist)
+
+        # only the stars a camera can see, allowing for the largest pointing error, are worth matching against
+        star_x, star_y = Geometry.sky_to_focal(np.asarray(stars['ra'], dtype=np.float64),
+                                               np.asarray(stars['dec'], dtype=np.float64),
+                                               cam_ra, cam_dec, self.plate_scale)
+        margin = Configuration.ASTROMETRY_SEARCH_MM
+        near = ((np.abs(star_x[:, None] - self.cen_x) <= Configuration.DFPS_GUIDE_CAMERA_SIZE_X_MM / 2. + margin) &
+                (np.abs(star_y[:, None] - self.cen_y) <= Configuration.DFPS_GUIDE_CAMERA_SIZE_Y_MM / 2. + margin))
+        keep = np.any(near, axis=1) & (np.asarray(stars['mag']) <= mag_limit)
+
+        self.star_x, self.star_y = star_x[keep], star_y[keep]
+        self.tree = cKDTree(np.column_stack([self.star_x, self.star_y])) if keep.any() else None
+
+    @staticmethod
+    def from_session(stars, session, cam_dist=None, plate_scale=None):
+        """ This function will build the solver for the cameras placed in a session.
+
+        :parameter stars - The stars of the field.
+        :parameter session - The session with the cameras placed.
+        :parameter cam_dist - The distance between neighbouring cameras in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return astrometry - The solver.
+        """
+
+        # the outline is closed, so the first four corners give the center of camera 1
+        return Astrometry(stars, float(np.mean(session.camera_x[0, :4])), float(np.mean(session.camera_y[0, :4])),
+                          cam_dist, plate_scale)
+
+    def measured_points(self, measurements):
+        """ This function will put the stars measured on every camera on the focal plane about camera 1.
+
+        :parameter measurements - A list of measurements from FrameStream.measure, one or more per camera.
+
+        :return points - An (N, 2) numpy array of the measured positions in mm.
+        """
+
+        points = [np.column_stack([self.cen_x[measurement['camera'] - 1] + np.asarray(measurement['x_mm']),
+                                   self.cen_y[measurement['camera'] - 1] + np.asarray(measurement['y_mm'])])
+                  for measurement in measurements if measurement['camera'] is not None]
+
+        return np.concatenate(points) if points else np.zeros((0, 2))
+
+    @staticmethod
+    def rigid_fit(source, target):
+        """ This function will find the rotation and shift which best move one set of points onto another in a least
+        squares sense.
+
+        :parameter source, target - (N, 2) numpy arrays of matched points.
+
+        :return rotation, shift - A (2, 2) rotation matrix and a (2,) shift, so target ~ source @ rotation.T + shift.
+        """
+
+        source_mean, target_mean = source.mean(axis=0), target.mean(axis=0)
+        covariance = (source - source_mean).T @ (target - target_mean)
+        angle = math.atan2(covariance[0, 1] - covariance[1, 0], covariance[0, 0] + covariance[1, 1])
+        rotation = np.array([[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]])
+
+        return rotation, target_mean - source_mean @ rotation.T
+
+    def coarse_shift(self, points):
+        """ This function will find the pointing error by letting every measured star vote for the shift to every
+        catalog star within the search radius, the true shift is the one most pairs agree on. The rotation is left to
+        the refinement, which copes with a few tenths of a degree across the cameras.
+
+        :parameter points - An (N, 2) numpy array of the measured positions in mm.
+
+        :return shift - The (2,) shift in mm.
+        """
+
+        search, bin_mm = Configuration.ASTROMETRY_SEARCH_MM, Configuration.ASTROMETRY_MATCH_MM
+        pairs = self.tree.query_ball_point(points, search)
+        shifts = np.concatenate([np.column_stack([self.star_x[idx] - point[0], self.star_y[idx] - point[1]])
+                                 for point, idx in zip(points, pairs) if len(idx) > 0] or [np.zeros((0, 2))])
+        if len(shifts) == 0:
+            return np.zeros(2)
+
+        n_bins = int(math.ceil(2. * search / bin_mm))
+        cells = np.clip(((shifts + search) / bin_mm).astype(np.int64), 0, n_bins - 1)
+        votes = np.bincount(cells[:, 0] * n_bins + cells[:, 1], minlength=n_bins * n_bins).reshape(n_bins, n_bins)
+
+        # the votes of the neighbouring bins are added in, so a shift on a bin edge is not split in two
+        padded = np.pad(votes, 1)
+        smoothed = sum(padded[1 + di:1 + di + n_bins, 1 + dj:1 + dj + n_bins] for di in (-1, 0, 1) for dj in (-1, 0, 1))
+        best = np.array(np.unravel_index(np.argmax(smoothed), smoothed.shape))
+        near = np.all(np.abs(cells - best) <= 1, axis=1)
+
+        return shifts[near].mean(axis=0)
+
+    def solve(self, measurements):
+        """ This function will solve for the pointing and rotation of the telescope from one frame set.
+
+        :parameter measurements - A list of measurements from FrameStream.measure.
+
+        :return solution - A dictionary with the rotation matrix, the shift in mm, the rotation in degrees, the
+        pointing error in arcsec east and north, the number of stars measured and matched and the rms of the match
+        in mm. solved is False if too few stars matched, and the solution then makes no correction.
+        """
+
+        with Metrics.timer('astrometry.solve'):
+            points = self.measured_points(measurements)
+            rotation, shift = np.eye(2), np.zeros(2)
+            matched = np.zeros(len(points), dtype=bool)
+            distance = np.full(len(points), np.inf)
+
+            if self.tree is not None and len(points) > 0:
+                shift = self.coarse_shift(points)
+
+                # refine the shift and add the rotation, matching each star to its nearest catalog star each time,
+                # the match radius starts wide enough for the rotation the coarse shift leaves out and then shrinks
+                radii = np.geomspace(Configuration.ASTROMETRY_SEARCH_MM / 4., Configuration.ASTROMETRY_MATCH_MM,
+                                     Configuration.ASTROMETRY_ITERATIONS)
+                for radius in radii:
+                    distance, idx = self.tree.query(points @ rotation.T + shift, distance_upper_bound=radius)
+                    matched = np.isfinite(distance)
+                    if matched.sum() < Configuration.ASTROMETRY_MIN_MATCHES:
+                        break
+                    catalog = np.column_stack([self.star_x[idx[matched]], self.star_y[idx[matched]]])
+                    rotation, shift = self.rigid_fit(points[matched], catalog)
+
+            solved = bool(matched.sum() >= Configuration.ASTROMETRY_MIN_MATCHES)
+            if not solved:
+                rotation, shift = np.eye(2), np.zeros(2)
+            Metrics.count('astrometry.solved' if solved else 'astrometry.failed')
+
+        return {'solved': solved,
+                'rotation': rotation,
+                'shift_mm': shift,
+                'rotation_deg': math.degrees(math.atan2(rotation[1, 0], rotation[0, 0])),
+                'pointing_arcsec': (shift * self.plate_scale).tolist(),
+                'n_measured': int(len(points)),
+                'n_matched': int(matched.sum()),
+                'rms_mm': float(np.sqrt(np.mean(distance[matched] ** 2))) if matched.any() else None}
+
+    def corrected_offsets(self, solution, target_ra, target_dec, offsets):
+        """ This function will correct the fiber moves for the solved pointing, so each fiber lands on its target
+        rather than where the telescope error would put it. Fibers which are not moved are corrected as well, as
+        the pointing error moves them off their position just the same.
+
+        :parameter solution - The solution from solve.
+        :parameter target_ra, target_dec - (4,) numpy arrays with the sky position each fiber should land on, such
+        as the session's move_x and move_y for the fibers moved and the fiber position for the others, nan for a
+        fiber which should be left alone.
+        :parameter offsets - A (4, 2) numpy array with the planned move of each fiber in mm, as from pick_n_plot,
+        nan for fibers not moved.
+
+        :return offsets - A (4, 2) numpy array with the corrected move of each fiber in mm. A fiber not moved gets
+        the correction alone, and only a fiber whose target is nan gets nan.
+        """
+
+        # a star measured at p is at p @ R.T + t in the catalog, so the fiber has to go to (f - t) @ R
+        target_x, target_y = Geometry.sky_to_focal(np.asarray(target_ra, dtype=np.float64),
+                                                   np.asarray(target_dec, dtype=np.float64),
+                                                   self.cam_ra, self.cam_dec, self.plate_scale)
+        targets = np.column_stack([target_x, target_y])
+        correction = (targets - solution['shift_mm']) @ solution['rotation'] - targets
+
+        # a fiber without a planned move starts from zero, a nan target leaves the correction, and the move, nan
+        offsets = np.asarray(offsets, dtype=np.float64)
+
+        return np.where(np.isnan(offsets), 0., offsets) + correction
@@ -0,0 +1,246 @@
+""" This file holds the catalog backends the catalog cache can query for stars, MAST or a local stand-in."""
+import glob
+import json
+import os
+import numpy as np
+from config import Configuration
+
+
+class MastBackend:
+
+    name = 'MAST'
+
+    # the only TIC columns the sky locator uses, in the order of ra, dec, mag and the proper motions
+    COLUMNS = ['ra', 'dec', 'GAIAmag', 'pmRA', 'pmDEC']
+
+    # the magnitude range sent to MAST starts here, brighter than any star
+    MAG_FLOOR = -5
+
+    def __init__(self, timeout=None):
+        """ This backend queries the TIC on MAST.
+
+        :parameter timeout - The time to wait for each page of a query in seconds, so a stalled query fails rather
+        than holding a prefetch thread forever.
+        """
+
+        self.timeout = timeout if timeout is not None else Configuration.CATALOG_TIMEOUT_S
+
+    @staticmethod
+    def to_columns(table, mag_cut):
+        """ This function will convert one page of a TIC query to numpy, reading only the needed columns. Masked
+        (missing) values become nan and are dropped with the magnitude cut, stars without a proper motion are
+        treated as not moving.
+
+        :parameter table - The astropy table of one page of the query.
+        :parameter mag_cut - The magnitude cutoff for the stars.
+
+        :return columns - A dictionary of ra, dec, mag, pmra, pmdec and epoch numpy arrays.
+        """
+
+        ra, dec, mag, pmra, pmdec = (np.ma.filled(np.ma.asarray(table[name], dtype=np.float64), np.nan)
+                                     for name in MastBackend.COLUMNS)
+        keep = mag < mag_cut
+
+        # the TIC positions are given at the catalog epoch, not the epoch of the Gaia observations
+        return catalog_columns(ra[keep], dec[keep], mag[keep], np.nan_to_num(pmra[keep]), np.nan_to_num(pmdec[keep]))
+
+    def query(self, ra_deg, dec_deg, radius_deg, mag_cut):
+        """ This function will query the TIC on MAST for all stars in a cone brighter than a magnitude cut-off.
+        The cut is applied by MAST, and the result is read a page at a time so only one page of the full table is
+        ever held in memory.
+
+        :parameter ra_deg - The right ascension of the cone center in degrees.
+        :parameter dec_deg - The declination of the cone center in degrees.
+        :parameter radius_deg - The radius of the cone in degrees.
+        :parameter mag_cut - The magnitude cutoff for the stars.
+
+        :return columns - A dictionary of ra, dec, mag, pmra, pmdec and epoch numpy arrays.
+        """
+
+        # astroquery is slow to import, so only load it when MAST is actually queried
+        from astroquery.mast import Catalogs
+
+        # the TIC is served through the MAST portal, whose connection reads its own timeout on each request
+        for connection in (Catalogs, getattr(Catalogs, '_portal_api_connection', None)):
+            if connection is not None:
+                connection.TIMEOUT = self.timeout
+
+        # make the search string
+        search_string = str(ra_deg) + " " + str(dec_deg)
+
+        # query the TIC for the stars in the given region and magnitude range based on the GAIA magnitudes
+        chunks = []
+        page = 1
+        while True:
+            table = Catalogs.query_criteria(coordinates=search_string, radius=radius_deg, catalog='Tic',
+                                            GAIAmag=[self.MAG_FLOOR, mag_cut],
+                                            pagesize=Configuration.MAST_PAGE_SIZE, page=page)
+            chunks.append(self.to_columns(table, mag_cut))
+
+            # a short page is the last one
+            if len(table) < Configuration.MAST_PAGE_SIZE:
+                break
+            page += 1
+
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+class DirectoryBackend:
+
+    name = 'fixture directory'
+
+    def __init__(self, directory):
+        """ This backend answers cone searches from a directory of csv files with ra, dec and GAIAmag (or mag)
+        columns, and optionally pmRA and pmDEC (or pmra and pmdec) in mas / yr and the epoch of the positions, so
+        tests and offline runs can stand in for MAST.
+
+        :parameter directory - The directory holding the csv files.
+        """
+
+        self.directory = directory
+        self.columns = None
+
+    def load(self):
+        """ This function will read every csv file in the directory once and keep the columns in memory.
+
+        :return columns - A dictionary of ra, dec, mag, pmra, pmdec and epoch numpy arrays.
+        """
+
+        if self.columns is None:
+            import pandas as pd
+
+            # only the needed columns are parsed, and each file is read in chunks so a full TIC dump fits in memory
+            wanted = ('ra', 'dec', 'GAIAmag', 'mag', 'pmRA', 'pmDEC', 'pmra', 'pmdec', 'epoch')
+            chunks = [catalog_columns([], [], [])]
+            for csv_file in sorted(glob.glob(os.path.join(self.directory, '*.csv'))):
+                for frame in pd.read_csv(csv_file, usecols=lambda name: name in wanted,
+                                         chunksize=Configuration.MAST_PAGE_SIZE):
+                    frame = frame.rename(columns={'GAIAmag': 'mag', 'pmRA': 'pmra', 'pmDEC': 'pmdec'})
+                    chunks.append(frame_columns(frame))
+
+            self.columns = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+        return self.columns
+
+    def query(self, ra_deg, dec_deg, radius_deg, mag_cut):
+        """ This function will return all stars in a cone brighter than a magnitude cut-off.
+
+        :parameter ra_deg - The right ascension of the cone center in degrees.
+        :parameter dec_deg - The declination of the cone center in degrees.
+        :parameter radius_deg - The radius of the cone in degrees.
+        :parameter mag_cut - The magnitude cutoff for the stars.
+
+        :return columns - A dictionary of ra, dec, mag, pmra, pmdec and epoch numpy arrays.
+        """
+
+        columns = self.load()
+        ra1, dec1, ra2, dec2 = map(np.radians, (ra_deg, dec_deg, columns['ra'], columns['dec']))
+        hav = np.sin((dec2 - dec1) / 2.) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2.) ** 2
+        dist = np.degrees(2. * np.arcsin(np.sqrt(np.clip(hav, 0., 1.))))
+        keep = (dist <= radius_deg) & (columns['mag'] < mag_cut)
+
+        return {name: values[keep] for name, values in columns.items()}
+
+
+class UrlBackend:
+
+    name = 'catalog server'
+
+    def __init__(self, url, timeout=None):
+        """ This backend answers cone searches from a catalog server, for example a local stand-in for MAST. The
+        server is sent the ra, dec, radius, mag_cut and the columns wanted as query parameters, and returns a json
+        object of those columns.
+
+        :parameter url - The url of the cone search end point.
+        :parameter timeout - The time to wait for the server in seconds.
+        """
+
+        self.url = url
+        self.timeout = timeout if timeout is not None else Configuration.CATALOG_TIMEOUT_S
+
+    def query(self, ra_deg, dec_deg, radius_deg, mag_cut):
+        """ This function will ask the server for all stars in a cone brighter than a magnitude cut-off.
+
+        :parameter ra_deg - The right ascension of the cone center in degrees.
+        :parameter dec_deg - The declination of the cone center in degrees.
+        :parameter radius_deg - The radius of the cone in degrees.
+        :parameter mag_cut - The magnitude cutoff for the stars.
+
+        :return columns - A dictionary of ra, dec, mag, pmra, pmdec and epoch numpy arrays.
+        """
+
+        import urllib.parse
+        import urllib.request
+
+        query = urllib.parse.urlencode({'ra': ra_deg, 'dec': dec_deg, 'radius': radius_deg, 'mag_cut': mag_cut,
+                                        'columns': 'ra,dec,mag,pmra,pmdec,epoch'})
+        with urllib.request.urlopen(self.url + '?' + query, timeout=self.timeout) as response:
+            result = json.loads(response.read())
+
+        # a server without proper motions is treated as a catalog of stars which do not move
+        return catalog_columns(*[result.get(name) for name in ['ra', 'dec', 'mag', 'pmra', 'pmdec', 'epoch']])
+
+
+def catalog_columns(ra, dec, mag, pmra=None, pmdec=None, epoch=None):
+    """ This function will return the columns every backend answers with, in the data types of the cache.
+
+    :parameter ra, dec - The position of the stars in degrees.
+    :parameter mag - The magnitude of the stars.
+    :parameter pmra, pmdec - The proper motion of the stars in mas / yr, with pmra including the cos(dec) term,
+    zero if not given.
+    :parameter epoch - The epoch of the positions in years, the catalog epoch if not given.
+
+    :return columns - A dictionary of ra, dec, mag, pmra, pmdec and epoch numpy arrays.
+    """
+
+    n_stars = len(ra)
+
+    return {'ra': np.asarray(ra, dtype=np.float64),
+            'dec': np.asarray(dec, dtype=np.float64),
+            'mag': np.asarray(mag, dtype=np.float32),
+            'pmra': np.asarray(pmra if pmra is not None else np.zeros(n_stars), dtype=np.float32),
+            'pmdec': np.asarray(pmdec if pmdec is not None else np.zeros(n_stars), dtype=np.float32),
+            'epoch': np.asarray(epoch if epoch is not None else np.full(n_stars, Configuration.CATALOG_EPOCH),
+                                dtype=np.float32)}
+
+
+def frame_columns(frame):
+    """ This function will return the catalog columns of a data frame read from a csv or parquet file. Rows without
+    a position or magnitude are dropped, as MAST drops them, stars without a proper motion are treated as not moving
+    and positions without an epoch are taken to be at the catalog epoch.
+
+    :parameter frame - A pandas data frame with ra, dec and mag columns, and optionally pmra, pmdec and epoch.
+
+    :return columns - A dictionary of ra, dec, mag, pmra, pmdec and epoch numpy arrays.
+    """
+
+    frame = frame.dropna(subset=['ra', 'dec', 'mag'])
+    fill = {'pmra': 0., 'pmdec': 0., 'epoch': Configuration.CATALOG_EPOCH}
+
+    return catalog_columns(frame['ra'].to_numpy(), frame['dec'].to_numpy(), frame['mag'].to_numpy(),
+                           *[frame[name].fillna(value).to_numpy() if name in frame else None
+                             for name, value in fill.items()])
+
+
+def get_backend(name=None, location=None):
+    """ This function will return the catalog backend named in the configuration.
+
+    :parameter name - The backend to use, one of mast, directory, url or local.
+    :parameter location - The directory or url the backend reads from, not needed for mast.
+
+    :return backend - An object with a query(ra_deg, dec_deg, radius_deg, mag_cut) function.
+    """
+
+    name = name if name is not None else Configuration.CATALOG_BACKEND
+    location = location if location is not None else Configuration.CATALOG_BACKEND_LOCATION
+
+    if name == 'directory':
+        return DirectoryBackend(location)
+    if name == 'url':
+        return UrlBackend(location)
+    if name == 'local':
+        # the local catalog imports the catalog cache, so it is imported here to keep the import order simple
+        from local_catalog import LocalCatalog
+        return LocalCatalog(location if location else None)
+
+    return MastBackend()
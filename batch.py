@@ -0,0 +1,29 @@
+""" This is the batch script to plan every field in a night's target list without the interactive picker."""
+import os
+import sys
+from utils import Utils
+from config import Configuration
+from metrics import Metrics
+from planner import Planner
+from prefetch import CatalogPrefetcher
+
+if __name__ == '__main__':
+    # do the necessary prep work such as making the directories
+    Utils.create_directories(Configuration.DIRECTORIES)
+
+    # the target list can be given on the command line, otherwise use the one in the configuration
+    target_file = sys.argv[1] if len(sys.argv) > 1 else Configuration.TARGET_LIST_FILE
+    targets = Planner.read_targets(target_file)
+
+    # run the night, under cProfile if profiling is turned on in the configuration
+    with Metrics.profile():
+        # fill the catalog cache for every field first, the queries are network bound so run them concurrently
+        CatalogPrefetcher().run(targets)
+
+        # plan all of the fields in parallel, writing one record per field
+        output_file = (Configuration.ANALYSIS_DIRECTORY + os.path.splitext(os.path.basename(target_file))[0] +
+                       '_plan.jsonl')
+        records = Planner.plan_night(targets, output_file)
+
+    # keep the stage timings of the night, including the ones from the batch workers
+    Metrics.write(os.path.basename(target_file))
\ No newline at end of file
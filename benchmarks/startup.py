@@ -0,0 +1,65 @@
+""" This script times how long the headless core takes to import, and checks it does not pull in the GUI or MAST.
+Run it from the repository directory with: python benchmarks/startup.py"""
+import json
+import os
+import subprocess
+import sys
+
+# the modules which make up the headless core
+CORE_MODULES = ['geometry', 'catalog_cache', 'camera_optimizer', 'fiber_assignment', 'planner']
+
+# the modules which must only be imported by the picker or when MAST is queried
+HEAVY_MODULES = ['matplotlib', 'astroquery', 'pandas', 'scipy', 'tkinter']
+
+# the import budget for the core in milliseconds, on top of numpy, which the core cannot do without and which alone
+# takes about 100 ms on a slow machine
+BUDGET_MS = 100
+
+# the number of fresh interpreters to time, the fastest is kept to remove noise from the machine
+N_RUNS = 7
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {modules}
+elapsed = (time.perf_counter() - start) * 1000.
+print(json.dumps({{'elapsed_ms': elapsed, 'heavy': sorted(m for m in {heavy} if m in sys.modules)}}))
+"""
+
+
+def time_import(modules, baseline=False):
+    """ This function will import the modules in a fresh interpreter and return the time it took.
+
+    :parameter modules - The list of modules to import.
+    :parameter baseline - If True, only numpy is imported, as every core module needs it anyway.
+
+    :return result - A dictionary with the import time in ms and any heavy modules which were loaded.
+    """
+
+    code = PROBE.format(modules='numpy' if baseline else ', '.join(modules), heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIRECTORY, capture_output=True, text=True,
+                            check=True)
+
+    return json.loads(output.stdout)
+
+
+if __name__ == '__main__':
+    runs = [time_import(CORE_MODULES) for idx in range(N_RUNS)]
+    numpy_ms = min(time_import(CORE_MODULES, baseline=True)['elapsed_ms'] for idx in range(N_RUNS))
+    core_ms = min(run['elapsed_ms'] for run in runs)
+    overhead_ms = core_ms - numpy_ms
+    heavy = runs[0]['heavy']
+
+    report = {'core_import_ms': round(core_ms, 1),
+              'numpy_import_ms': round(numpy_ms, 1),
+              'core_overhead_ms': round(overhead_ms, 1),
+              'budget_ms': BUDGET_MS,
+              'heavy_modules_loaded': heavy}
+    print(json.dumps(report, indent=2))
+
+    if overhead_ms > BUDGET_MS or heavy:
+        print("Startup regression: the core took " + str(round(overhead_ms, 1)) + " ms to import on top of numpy "
+              "and loaded " + (', '.join(heavy) or 'no heavy modules') + ".")
+        sys.exit(1)
@@ -0,0 +1,271 @@
+""" This script times the main stages of the sky locator on synthetic star fields served by a stand-in for MAST, and
+writes a json report which can be compared against a baseline. Run it from the repository directory with:
+python benchmarks/suite.py --sizes 1e3 1e4 1e5 1e6 --output report.json --baseline baseline.json"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+
+# the picker is rendered off screen, this must be set before matplotlib is imported
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import numpy as np
+from config import Configuration
+from backends import DirectoryBackend, catalog_columns
+from catalog_cache import CatalogCache
+from camera_optimizer import CameraOptimizer
+from fiber_assignment import FiberAssigner
+from geometry import Geometry
+from prefetch import CatalogPrefetcher
+from scripts import Scripts
+from utils import Utils
+
+# the catalog sizes to time by default, 1e7 can be given on the command line but needs a few GB of memory
+SIZES = [1e3, 1e4, 1e5, 1e6]
+
+# the stars are spread over a square this many search radii across, so the cone holds about a fifth of them
+SPREAD_RADII = 2
+
+# the magnitude range of the synthetic stars, faint stars are more common as on the real sky
+MAG_RANGE = [6., 17.]
+
+# the number of times each stage is timed, the fastest run is reported to remove noise from the machine
+REPEATS = 5
+COLD_REPEATS = 3
+
+# the most camera positions projected at once by the geometry case
+GEOMETRY_CENTERS = 100000
+
+# the fraction of the field shown when the picker is zoomed in
+ZOOM = 0.1
+
+# a stage is a regression if it is this much slower than the baseline, and slower by more than the noise floor
+TOLERANCE = 1.25
+NOISE_FLOOR_S = 0.001
+
+
+class SyntheticBackend(DirectoryBackend):
+
+    name = 'synthetic catalog'
+
+    def __init__(self, columns):
+        """ This backend stands in for MAST, answering cone searches from a synthetic catalog held in memory.
+
+        :parameter columns - A dictionary of the catalog columns, as made by synthetic_catalog.
+        """
+
+        super().__init__(None)
+        self.columns = columns
+
+
+def synthetic_catalog(n_stars, ra_deg, dec_deg, seed=0):
+    """ This function will make a synthetic star field about a position, with the number of stars rising towards
+    fainter magnitudes as dN/dm ~ 10^(0.3 m) and proper motions of a few mas / yr.
+
+    :parameter n_stars - The number of stars.
+    :parameter ra_deg, dec_deg - The center of the field in degrees.
+    :parameter seed - The seed of the random numbers, so every run times the same field.
+
+    :return columns - A dictionary of the catalog columns, as a backend returns them.
+    """
+
+    rng = np.random.default_rng(seed)
+    half_width = SPREAD_RADII * Configuration.SEARCH_RADIUS_DEG
+    low, high = 10 ** (0.3 * MAG_RANGE[0]), 10 ** (0.3 * MAG_RANGE[1])
+
+    return catalog_columns(ra_deg + rng.uniform(-half_width, half_width, n_stars) / np.cos(np.radians(dec_deg)),
+                           dec_deg + rng.uniform(-half_width, half_width, n_stars),
+                           np.log10(rng.uniform(low, high, n_stars)) / 0.3,
+                           rng.normal(0., 5., n_stars), rng.normal(0., 5., n_stars))
+
+
+def best_of(function, repeats, setup=None):
+    """ This function will time a function several times.
+
+    :parameter function - The function to time, called without arguments.
+    :parameter repeats - The number of times to time it.
+    :parameter setup - An optional function called before each run, which is not timed.
+
+    :return result - A dictionary with the fastest and mean time in seconds.
+    """
+
+    times = []
+    for idx in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return {'best_s': min(times), 'mean_s': sum(times) / len(times), 'repeats': repeats}
+
+
+def bench_size(n_stars, work_directory):
+    """ This function will time every stage on one synthetic catalog.
+
+    :parameter n_stars - The number of stars in the catalog.
+    :parameter work_directory - A scratch directory for the catalog cache.
+
+    :return results - A list of dictionaries with the stage, number of stars and timings.
+    """
+
+    ra, dec = Configuration.RA_DEG, Configuration.DEC_DEG
+    radius, mag_cut = Configuration.SEARCH_RADIUS_DEG, Configuration.MAGNITUDE_CUTOFF
+    backend = SyntheticBackend(synthetic_catalog(n_stars, ra, dec))
+    cache_directory = os.path.join(work_directory, 'cache')
+    prefetcher = {}
+
+    def empty_cache():
+        shutil.rmtree(cache_directory, ignore_errors=True)
+        os.makedirs(cache_directory)
+        prefetcher['cache'] = CatalogPrefetcher(cache=CatalogCache(directory=cache_directory, backend=backend))
+
+    def tic_search():
+        return Scripts.tic_search(ra, dec, radius, mag_cut, prefetcher['cache'])
+
+    results = {'tic_search.cold': best_of(tic_search, COLD_REPEATS, empty_cache),
+               'tic_search.warm': best_of(tic_search, REPEATS)}
+
+    # every later stage works on the stars of the field, as the picker and planner do
+    stars = tic_search()
+    star_ra, star_dec, star_mag = (stars[name].to_numpy() for name in ['ra', 'dec', 'mag'])
+
+    centers = slice(0, GEOMETRY_CENTERS)
+    results['geometry.plot_guide_cameras'] = best_of(
+        lambda: Scripts.plot_guide_cameras(star_ra[centers], star_dec[centers], 1), REPEATS)
+
+    star_x, star_y = Geometry.sky_to_focal(star_ra, star_dec, ra, dec)
+    cen_x, cen_y = CameraOptimizer.candidate_centers()
+    results['optimizer.count_in_boxes'] = best_of(
+        lambda: CameraOptimizer.score_layouts(star_x, star_y, star_mag, cen_x, cen_y), REPEATS)
+
+    # the fibers start from the center of each camera, as the planner does for cameras without a guide star
+    cam_ra, cam_dec = Geometry.camera_centers(ra, dec, 1)
+    fib_x, fib_y = np.array([Geometry.fiber_positions(cam_ra[idx], cam_dec[idx], idx + 1) for idx in range(4)]).T
+    results['fiber.assign'] = best_of(lambda: FiberAssigner.assign(fib_x, fib_y, star_ra, star_dec), REPEATS)
+
+    results.update(bench_render(stars))
+
+    return [dict(result, stage=stage, n_stars=int(n_stars), n_field_stars=len(star_ra))
+            for stage, result in results.items()]
+
+
+def bench_render(stars):
+    """ This function will time the picker drawing its figure off screen, zooming in, and redrawing after a click.
+
+    :parameter stars - The data frame of stars in the field.
+
+    :return results - A dictionary of timings keyed on the stage.
+    """
+
+    import matplotlib.pyplot as plt
+    from picker import Picker
+    from session import Session
+
+    def setup():
+        picker = Picker(stars, Session(Configuration.FIELD_NAME, Configuration.RA_DEG, Configuration.DEC_DEG))
+        picker.fig.canvas.draw()
+        plt.close(picker.fig)
+
+    # the click is timed on one figure, the draw caches the background the clicks are blitted onto
+    picker = Picker(stars, Session(Configuration.FIELD_NAME, Configuration.RA_DEG, Configuration.DEC_DEG))
+    picker.fig.canvas.draw()
+
+    def click():
+        picker.place_cameras(Configuration.RA_DEG, Configuration.DEC_DEG, 1)
+        picker.blit()
+
+    # zoom in on the field center and back out again, each is a full draw with the stars refined for the view
+    half_width = ZOOM * Configuration.SEARCH_RADIUS_DEG
+    full_xlim, full_ylim = picker.ax.get_xlim(), picker.ax.get_ylim()
+
+    def zoom():
+        picker.ax.set_xlim(Configuration.RA_DEG + half_width, Configuration.RA_DEG - half_width)
+        picker.ax.set_ylim(Configuration.DEC_DEG - half_width, Configuration.DEC_DEG + half_width)
+        picker.fig.canvas.draw()
+        picker.ax.set_xlim(full_xlim)
+        picker.ax.set_ylim(full_ylim)
+        picker.fig.canvas.draw()
+
+    results = {'render.setup': best_of(setup, COLD_REPEATS), 'render.click': best_of(click, REPEATS),
+               'render.zoom': best_of(zoom, REPEATS)}
+    plt.close(picker.fig)
+
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """ This function will compare the results against a baseline report.
+
+    :parameter results - The list of results from this run.
+    :parameter baseline - A report written by an earlier run.
+    :parameter tolerance - How much slower a stage can be before it counts as a regression.
+
+    :return regressions - A list of dictionaries with the stage, size and ratio of each regression.
+    """
+
+    previous = {(result['stage'], result['n_stars']): result for result in baseline['results']}
+
+    regressions = []
+    for result in results:
+        before = previous.get((result['stage'], result['n_stars']))
+        if before is None:
+            continue
+        result['baseline_s'] = before['best_s']
+        result['ratio'] = result['best_s'] / before['best_s']
+        if result['ratio'] > tolerance and result['best_s'] - before['best_s'] > NOISE_FLOOR_S:
+            regressions.append({'stage': result['stage'], 'n_stars': result['n_stars'], 'ratio': result['ratio']})
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', nargs='+', type=float, default=SIZES, help='catalog sizes to time')
+    parser.add_argument('--output', default='benchmark_report.json', help='the json report to write')
+    parser.add_argument('--baseline', help='an earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='the slow down counted as a regression')
+    args = parser.parse_args()
+
+    # the log lines of every search would otherwise be timed along with it
+    Utils.get_logger().setLevel(logging.WARNING)
+
+    work_directory = tempfile.mkdtemp(prefix='dfps_bench_')
+    try:
+        results = []
+        for size in args.sizes:
+            results.extend(bench_size(int(size), work_directory))
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    report = {'created': time.time(),
+              'host': platform.node(),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'results': results,
+              'regressions': regressions}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for result in results:
+        print(result['stage'].ljust(30) + str(result['n_stars']).rjust(10) +
+              (str(round(result['best_s'] * 1000., 2)) + ' ms').rjust(14) +
+              ('  x' + str(round(result['ratio'], 2)) if 'ratio' in result else ''))
+
+    if regressions:
+        print("Performance regression in " + ', '.join(regression['stage'] + ' (' + str(regression['n_stars']) + ')'
+                                                      for regression in regressions) + ".")
+        sys.exit(1)
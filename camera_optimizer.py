@@ -0,0 +1,147 @@
+""" This class holds the optimizer which suggests where to place the guide cameras in a star field."""
+import numpy as np
+from config import Configuration
+from geometry import Geometry
+from metrics import Metrics
+
+
+class CameraOptimizer:
+
+    @staticmethod
+    def candidate_centers(half_width=None, step=None, cam_dist=None, plate_scale=None):
+        """ This function will return a grid of candidate camera 1 centers across the telescope field of view, on the
+        focal plane relative to the field center.
+
+        :parameter half_width - How far the center of the layout can move from the field center in degrees.
+        :parameter step - The spacing of the candidate grid in degrees.
+        :parameter cam_dist - The distance between neighbouring cameras in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return cen_x, cen_y - Two numpy arrays with the camera 1 center of each candidate layout in mm.
+        """
+
+        half_width = Geometry.deg_to_mm(half_width if half_width is not None else
+                                        Configuration.CAMERA_SEARCH_HALF_WIDTH_DEG, plate_scale)
+        step = Geometry.deg_to_mm(step if step is not None else Configuration.CAMERA_SEARCH_STEP_DEG, plate_scale)
+        cam_dist = cam_dist if cam_dist is not None else Configuration.DFPS_GUIDE_CAMERA_DIST
+
+        # the candidates are the centers of the whole layout, so shift them to the position of camera 1
+        grid = np.arange(-half_width, half_width + step / 2., step)
+        lay_x, lay_y = np.meshgrid(grid, grid)
+        shift = np.mean(Geometry.CAMERA_LAYOUT, axis=0) * cam_dist
+
+        return lay_x.ravel() - shift[0], lay_y.ravel() - shift[1]
+
+    @staticmethod
+    def score_layouts(star_x, star_y, star_mag, cen_x, cen_y, mag_limit=None, cam_dist=None):
+        """ This function will count the guide stars and their total flux in all four cameras for every candidate
+        layout at once. The stars are binned once onto a fine grid and each box is summed from a summed area
+        table, so the cost per candidate does not depend on the size of the catalog. The box edges are snapped to
+        the grid, so the counts are close enough to rank layouts but not exact.
+
+        :parameter star_x, star_y - Numpy arrays with the focal plane position of the stars in mm.
+        :parameter star_mag - A numpy array with the magnitude of the stars.
+        :parameter cen_x, cen_y - (N,) or (..., N) numpy arrays with the camera 1 center of each candidate in mm.
+        :parameter mag_limit - The faintest star which can be used as a guide star.
+        :parameter cam_dist - The distance between neighbouring cameras in mm.
+
+        :return counts, flux - Two (..., N, 4) numpy arrays with the number and flux of guide stars in each camera.
+        """
+
+        mag_limit = mag_limit if mag_limit is not None else Configuration.GUIDE_STAR_MAG_LIMIT
+        cam_dist = cam_dist if cam_dist is not None else Configuration.DFPS_GUIDE_CAMERA_DIST
+        sz_x = Configuration.DFPS_GUIDE_CAMERA_SIZE_X_MM
+        sz_y = Configuration.DFPS_GUIDE_CAMERA_SIZE_Y_MM
+        res = min(sz_x, sz_y) / Configuration.CAMERA_SEARCH_BINS_PER_BOX
+
+        guide = np.asarray(star_mag) < mag_limit
+        x = np.asarray(star_x, dtype=np.float64)[guide]
+        y = np.asarray(star_y, dtype=np.float64)[guide]
+        mag = np.asarray(star_mag, dtype=np.float64)[guide]
+
+        # the center of every camera box for every candidate, (..., N, 4)
+        box_x = np.asarray(cen_x)[..., None] + Geometry.CAMERA_LAYOUT[:, 0] * cam_dist
+        box_y = np.asarray(cen_y)[..., None] + Geometry.CAMERA_LAYOUT[:, 1] * cam_dist
+        x0 = min(np.min(box_x) - sz_x, np.min(x, initial=np.inf))
+        y0 = min(np.min(box_y) - sz_y, np.min(y, initial=np.inf))
+        n_x = int(np.ceil((max(np.max(box_x) + sz_x, np.max(x, initial=-np.inf)) - x0) / res)) + 1
+        n_y = int(np.ceil((max(np.max(box_y) + sz_y, np.max(y, initial=-np.inf)) - y0) / res)) + 1
+
+        # bin the guide stars and build the summed area tables, padded so index 0 is an empty row and column
+        ix = ((x - x0) / res).astype(np.int64)
+        iy = ((y - y0) / res).astype(np.int64)
+        count_sat = np.zeros((n_x + 1, n_y + 1))
+        flux_sat = np.zeros((n_x + 1, n_y + 1))
+        np.add.at(count_sat, (ix + 1, iy + 1), 1.)
+        np.add.at(flux_sat, (ix + 1, iy + 1), 10 ** (-0.4 * (mag - mag_limit)))
+        count_sat = count_sat.cumsum(axis=0).cumsum(axis=1)
+        flux_sat = flux_sat.cumsum(axis=0).cumsum(axis=1)
+
+        # the box edges rounded to the nearest bin edge
+        x1 = np.clip(np.rint((box_x - sz_x / 2. - x0) / res).astype(np.int64), 0, n_x)
+        x2 = np.clip(np.rint((box_x + sz_x / 2. - x0) / res).astype(np.int64), 0, n_x)
+        y1 = np.clip(np.rint((box_y - sz_y / 2. - y0) / res).astype(np.int64), 0, n_y)
+        y2 = np.clip(np.rint((box_y + sz_y / 2. - y0) / res).astype(np.int64), 0, n_y)
+
+        counts = count_sat[x2, y2] - count_sat[x1, y2] - count_sat[x2, y1] + count_sat[x1, y1]
+        flux = flux_sat[x2, y2] - flux_sat[x1, y2] - flux_sat[x2, y1] + flux_sat[x1, y1]
+
+        return np.rint(counts).astype(np.int64), flux
+
+    @staticmethod
+    def rank_layouts(counts, flux):
+        """ This function will score the candidate layouts. Layouts are ranked first by the number of cameras with a
+        guide star, then by the flux of the faintest camera so all four cameras get a usable star.
+
+        :parameter counts - An (..., N, 4) numpy array with the number of guide stars in each camera.
+        :parameter flux - An (..., N, 4) numpy array with the flux of guide stars in each camera.
+
+        :return score - An (..., N) numpy array where a higher score is a better layout.
+        """
+
+        n_cameras = np.sum(counts > 0, axis=-1)
+
+        return n_cameras + np.log10(1. + np.min(flux, axis=-1)) / (1. + np.log10(1. + np.max(flux)))
+
+    @staticmethod
+    def optimize(stars, ra_deg, dec_deg, n_best=5, mag_limit=None, cam_dist=None, plate_scale=None):
+        """ This function will scan candidate layouts across the field and return the best ones.
+
+        :parameter stars - A data frame or dictionary with the ra, dec and mag of the stars in the field.
+        :parameter ra_deg - The right ascension of the field in degrees.
+        :parameter dec_deg - The declination of the field in degrees.
+        :parameter n_best - The number of layouts to return.
+        :parameter mag_limit - The faintest star which can be used as a guide star.
+        :parameter cam_dist - The distance between neighbouring cameras in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return layouts - A list of dictionaries with the camera 1 center on the sky, guide star counts, flux and score.
+        """
+
+        with Metrics.timer('geometry.sky_to_focal'):
+            star_x, star_y = Geometry.sky_to_focal(np.asarray(stars['ra']), np.asarray(stars['dec']),
+                                                   ra_deg, dec_deg, plate_scale)
+        cen_x, cen_y = CameraOptimizer.candidate_centers(cam_dist=cam_dist, plate_scale=plate_scale)
+        with Metrics.timer('optimizer.score'):
+            counts, flux = CameraOptimizer.score_layouts(star_x, star_y, np.asarray(stars['mag']), cen_x, cen_y,
+                                                         mag_limit, cam_dist)
+        score = CameraOptimizer.rank_layouts(counts, flux)
+        order = np.argsort(-score, kind='stable')
+
+        # skip candidates which are the same layout shifted by less than a camera box
+        chosen = []
+        for idx in order:
+            if len(chosen) == n_best:
+                break
+            if any(abs(cen_x[idx] - cen_x[best]) < Configuration.DFPS_GUIDE_CAMERA_SIZE_X_MM and
+                   abs(cen_y[idx] - cen_y[best]) < Configuration.DFPS_GUIDE_CAMERA_SIZE_Y_MM for best in chosen):
+                continue
+            chosen.append(idx)
+
+        chosen = np.array(chosen, dtype=np.int64)
+        cen_ra, cen_dec = Geometry.focal_to_sky(cen_x[chosen], cen_y[chosen], ra_deg, dec_deg, plate_scale)
+
+        return [{'center': [float(cen_ra[idx]), float(cen_dec[idx])],
+                 'counts': counts[best].tolist(),
+                 'flux': flux[best].tolist(),
+                 'score': float(score[best])} for idx, best in enumerate(chosen)]
@@ -0,0 +1,508 @@
+""" This class holds the on-disk tile cache used to answer TIC cone searches without re-querying the catalog."""
+import json
+import math
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from backends import frame_columns, get_backend
+from config import Configuration
+from geometry import Geometry
+from metrics import Metrics
+from utils import Utils
+
+
+class CatalogCache:
+
+    # the columns stored for each tile and their data types, the proper motions are in mas / yr and the epoch of
+    # the positions in years
+    COLUMNS = {'ra': np.float64, 'dec': np.float64, 'mag': np.float32,
+               'pmra': np.float32, 'pmdec': np.float32, 'epoch': np.float32}
+
+    def __init__(self, directory=None, tile_deg=None, max_mb=None, mag_limit=None, backend=None):
+        """ The cache splits the sky into declination zones of height tile_deg, and each zone into right ascension
+        cells that are roughly tile_deg wide on the sky. Each tile is stored as its own file so overlapping fields
+        only query the tiles they are missing.
+
+        :parameter directory - The directory to hold the tiles and the index, defaults to the configuration.
+        :parameter tile_deg - The size of a tile in degrees.
+        :parameter max_mb - The maximum size of the cache in MB before tiles are evicted.
+        :parameter mag_limit - The faintest magnitude stored in a tile, so different cut-offs can share tiles.
+        :parameter backend - The catalog backend used for missing tiles, defaults to the one in the configuration.
+        """
+
+        self.directory = directory if directory is not None else Configuration.CACHE_DIRECTORY
+        self.tile_deg = tile_deg if tile_deg is not None else Configuration.CACHE_TILE_DEG
+        self.max_bytes = (max_mb if max_mb is not None else Configuration.CACHE_MAX_MB) * 1024 * 1024
+        self.mag_limit = mag_limit if mag_limit is not None else Configuration.CACHE_MAGNITUDE_LIMIT
+        self.n_zones = int(math.ceil(180. / self.tile_deg))
+        self.index_file = os.path.join(self.directory, 'index.json')
+        self.index = self.read_index()
+        self.evicted = set()
+        self.backend = backend if backend is not None else get_backend()
+
+        # the cache can be shared by several threads, such as the prefetcher, so guard the index and each tile
+        self.lock = threading.RLock()
+        self.tile_locks = {}
+
+    @staticmethod
+    def angular_distance(ra1, dec1, ra2, dec2):
+        """ This function will return the angular distance between two positions using the haversine formula.
+
+        :parameter ra1, dec1 - The first position(s) in degrees.
+        :parameter ra2, dec2 - The second position(s) in degrees.
+
+        :return The angular distance in degrees.
+        """
+
+        ra1, dec1, ra2, dec2 = map(np.radians, (ra1, dec1, ra2, dec2))
+        hav = np.sin((dec2 - dec1) / 2.) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2.) ** 2
+
+        return np.degrees(2. * np.arcsin(np.sqrt(np.clip(hav, 0., 1.))))
+
+    def zone_bounds(self, zone):
+        """ This function will return the declination limits of a zone.
+
+        :parameter zone - The zone number, starting at the south pole.
+
+        :return dec_lo, dec_hi - The lower and upper declination of the zone in degrees.
+        """
+
+        dec_lo = -90. + zone * self.tile_deg
+        dec_hi = min(dec_lo + self.tile_deg, 90.)
+
+        return dec_lo, dec_hi
+
+    def n_cells(self, zone):
+        """ This function will return the number of right ascension cells in a zone.
+
+        :parameter zone - The zone number.
+
+        :return The number of cells, at least 1 near the poles.
+        """
+
+        dec_lo, dec_hi = self.zone_bounds(zone)
+        dec_cen = math.radians((dec_lo + dec_hi) / 2.)
+
+        return max(1, int(360. * math.cos(dec_cen) / self.tile_deg))
+
+    def tile_bounds(self, zone, cell):
+        """ This function will return the ra/dec limits of a tile.
+
+        :parameter zone - The zone number.
+        :parameter cell - The right ascension cell in the zone.
+
+        :return ra_lo, ra_hi, dec_lo, dec_hi - The tile limits in degrees.
+        """
+
+        width = 360. / self.n_cells(zone)
+        dec_lo, dec_hi = self.zone_bounds(zone)
+
+        return cell * width, (cell + 1) * width, dec_lo, dec_hi
+
+    def tiles_for_cone(self, ra_deg, dec_deg, radius_deg):
+        """ This function will return the tiles which overlap a cone on the sky.
+
+        :parameter ra_deg - The right ascension of the cone center in degrees.
+        :parameter dec_deg - The declination of the cone center in degrees.
+        :parameter radius_deg - The radius of the cone in degrees.
+
+        :return tiles - A list of (zone, cell) tuples.
+        """
+
+        dec_lo = max(dec_deg - radius_deg, -90.)
+        dec_hi = min(dec_deg + radius_deg, 90.)
+        zone_lo = int((dec_lo + 90.) // self.tile_deg)
+        zone_hi = min(int((dec_hi + 90.) // self.tile_deg), self.n_zones - 1)
+
+        # the ra half width of a small circle, every cell is needed if the cone covers the pole
+        if abs(dec_deg) + radius_deg >= 90.:
+            ra_half = 180.
+        else:
+            ra_half = math.degrees(math.asin(min(1., math.sin(math.radians(radius_deg)) /
+                                                 math.cos(math.radians(dec_deg)))))
+
+        tiles = []
+        for zone in range(zone_lo, zone_hi + 1):
+            n_cells = self.n_cells(zone)
+            if ra_half >= 180.:
+                cells = range(n_cells)
+            else:
+                width = 360. / n_cells
+                cell_lo = int(math.floor((ra_deg - ra_half) / width))
+                cell_hi = int(math.floor((ra_deg + ra_half) / width))
+                cells = sorted(set(cell % n_cells for cell in range(cell_lo, cell_hi + 1)))
+            tiles.extend((zone, cell) for cell in cells)
+
+        return tiles
+
+    @staticmethod
+    def tile_key(zone, cell):
+        """ This function will return the name used to store a tile.
+
+        :parameter zone - The zone number.
+        :parameter cell - The right ascension cell in the zone.
+
+        :return The tile name as a string.
+        """
+
+        return 'tile_' + str(zone) + '_' + str(cell)
+
+    def read_index(self):
+        """ This function will read the cache index holding the size, magnitude limit and last access of each tile.
+
+        :return index - A dictionary keyed on the tile name.
+        """
+
+        if os.path.isfile(self.index_file) is False:
+            return {}
+
+        with open(self.index_file, 'r') as f:
+            return json.load(f)
+
+    def write_index(self):
+        """ This function will write the cache index to disk. The index on disk is merged first, so several
+        processes sharing the cache (for example a batch run) do not lose each other's tiles.
+
+        :return - Nothing is returned, but the index file is updated.
+        """
+
+        index = self.read_index()
+        for key in self.evicted:
+            index.pop(key, None)
+        index.update(self.index)
+        self.index = index
+
+        tmp_file = self.index_file + '.tmp.' + str(os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_file, self.index_file)
+
+    def query_tile(self, zone, cell, mag_cut):
+        """ This function will query the catalog backend for every star in a tile down to the given magnitude.
+
+        :parameter zone - The zone number.
+        :parameter cell - The right ascension cell in the zone.
+        :parameter mag_cut - The magnitude cutoff for the tile.
+
+        :return columns, header - A dictionary of column arrays (see COLUMNS) and the query parameters of the tile.
+        """
+
+        ra_lo, ra_hi, dec_lo, dec_hi = self.tile_bounds(zone, cell)
+        ra_cen = (ra_lo + ra_hi) / 2.
+        dec_cen = (dec_lo + dec_hi) / 2.
+
+        # query the circle which circumscribes the tile
+        radius = float(np.max(self.angular_distance(ra_cen, dec_cen,
+                                                    np.array([ra_lo, ra_lo, ra_hi, ra_hi]),
+                                                    np.array([dec_lo, dec_hi, dec_lo, dec_hi]))))
+        stars = self.backend.query(ra_cen, dec_cen, radius, mag_cut)
+
+        # clip to the tile itself so neighbouring tiles never share a star
+        in_tile = ((stars['ra'] >= ra_lo) & (stars['ra'] < ra_hi) &
+                   (stars['dec'] >= dec_lo) & (stars['dec'] < dec_hi))
+        columns = {name: np.asarray(stars[name][in_tile], dtype=dtype) for name, dtype in self.COLUMNS.items()}
+
+        header = {'catalog_version': Configuration.CATALOG_VERSION,
+                  'ra_deg': ra_cen,
+                  'dec_deg': dec_cen,
+                  'radius_deg': radius,
+                  'mag_limit': mag_cut,
+                  'bounds': [ra_lo, ra_hi, dec_lo, dec_hi],
+                  'n_stars': int(len(columns['ra'])),
+                  'columns': {name: np.dtype(dtype).str for name, dtype in self.COLUMNS.items()},
+                  'created': time.time()}
+
+        return columns, header
+
+    def write_tile(self, key, columns, header):
+        """ This function will write a tile as one binary .npy file per column with a small json header.
+
+        :parameter key - The tile name.
+        :parameter columns - A dictionary of column arrays.
+        :parameter header - A dictionary with the query parameters and catalog version of the tile.
+
+        :return n_bytes - The size of the tile on disk.
+        """
+
+        tile_dir = os.path.join(self.directory, key)
+        os.makedirs(tile_dir, exist_ok=True)
+
+        n_bytes = 0
+        for name, values in columns.items():
+            column_file = os.path.join(tile_dir, name + '.npy')
+            np.save(column_file, values)
+            n_bytes += os.path.getsize(column_file)
+
+        # the header goes last, so a tile is only valid once all of its columns are on disk
+        header_file = os.path.join(tile_dir, 'header.json')
+        with open(header_file + '.tmp', 'w') as f:
+            json.dump(header, f)
+        os.replace(header_file + '.tmp', header_file)
+
+        # remove the legacy csv version of the tile if it exists
+        if os.path.isfile(os.path.join(self.directory, key + '.csv')):
+            os.remove(os.path.join(self.directory, key + '.csv'))
+
+        return n_bytes + os.path.getsize(header_file)
+
+    @staticmethod
+    def read_csv(csv_file):
+        """ This function will read a catalog csv written by an earlier version, either a legacy tile or a region
+        file of the old tic_search. Only the named columns are read, so it does not matter if the index was written.
+
+        :parameter csv_file - The csv file with ra, dec and mag (or GAIAmag) columns.
+
+        :return columns - A dictionary of the COLUMNS arrays, the stars are treated as not moving if the file has no
+        proper motions.
+        """
+
+        import pandas as pd
+
+        wanted = set(CatalogCache.COLUMNS) | {'GAIAmag'}
+        frame = pd.read_csv(csv_file, usecols=lambda name: name in wanted).rename(columns={'GAIAmag': 'mag'})
+
+        return frame_columns(frame)
+
+    def read_tile(self, key):
+        """ This function will read a tile from disk. The binary columns are memory mapped, legacy csv tiles are
+        read and converted to the binary format.
+
+        :parameter key - The tile name.
+
+        :return columns, header - A dictionary of column arrays and the tile header, or None, None if the tile
+        is not on disk or was made from a different catalog version.
+        """
+
+        tile_dir = os.path.join(self.directory, key)
+        header_file = os.path.join(tile_dir, 'header.json')
+        csv_file = os.path.join(self.directory, key + '.csv')
+
+        if os.path.isfile(header_file):
+            with open(header_file, 'r') as f:
+                header = json.load(f)
+            if header['catalog_version'] != Configuration.CATALOG_VERSION:
+                Utils.log("Tile " + key + " is from " + header['catalog_version'] + ", it will be re-queried.", "info")
+                return None, None
+            # empty tiles are read normally as there is nothing to map
+            mmap_mode = 'r' if header['n_stars'] > 0 else None
+            columns = {name: np.load(os.path.join(tile_dir, name + '.npy'), mmap_mode=mmap_mode)
+                       for name in header['columns']}
+            return columns, header
+
+        if os.path.isfile(csv_file):
+            columns = self.read_csv(csv_file)
+            header = {'catalog_version': Configuration.CATALOG_VERSION,
+                      'mag_limit': self.index.get(key, {}).get('mag_limit', self.mag_limit),
+                      'n_stars': int(len(columns['ra'])),
+                      'columns': {name: np.dtype(dtype).str for name, dtype in self.COLUMNS.items()},
+                      'created': os.path.getmtime(csv_file)}
+            Utils.log("Converting legacy csv tile " + key + " to the binary format.", "debug")
+            n_bytes = self.write_tile(key, columns, header)
+            with self.lock:
+                if key in self.index:
+                    self.index[key]['bytes'] = n_bytes
+            return columns, header
+
+        return None, None
+
+    def remove_tile(self, key):
+        """ This function will remove a tile from disk in either the binary or legacy csv format.
+
+        :parameter key - The tile name.
+
+        :return - Nothing is returned, but the tile files are deleted.
+        """
+
+        tile_dir = os.path.join(self.directory, key)
+        if os.path.isdir(tile_dir):
+            shutil.rmtree(tile_dir)
+        if os.path.isfile(os.path.join(self.directory, key + '.csv')):
+            os.remove(os.path.join(self.directory, key + '.csv'))
+
+    def evict(self, keep):
+        """ This function will remove the least recently used tiles until the cache is below its size limit.
+
+        :parameter keep - A set of tile names which should not be evicted, generally the ones currently in use.
+
+        :return - Nothing is returned, but tiles are deleted and the index is updated.
+        """
+
+        total = sum(entry['bytes'] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            self.remove_tile(key)
+            total -= self.index[key]['bytes']
+            del self.index[key]
+            self.evicted.add(key)
+            Utils.log("Evicted " + key + " from the catalog cache.", "debug")
+
+    def cone_search_columns(self, ra_deg, dec_deg, radius_deg, mag_cut):
+        """ This function will return all stars in a cone as column arrays, reading cached tiles and querying the
+        catalog backend for missing ones.
+
+        :parameter ra_deg - The right ascension of the target in degrees.
+        :parameter dec_deg - The declination of the target in degrees.
+        :parameter radius_deg - The radius of the search area.
+        :parameter mag_cut - The magnitude cutoff for the given star field.
+
+        :return columns - A dictionary of the COLUMNS arrays for the stars in the cone, at the catalog epoch.
+        """
+
+        tiles = self.tiles_for_cone(ra_deg, dec_deg, radius_deg)
+        tile_mag = max(self.mag_limit, mag_cut)
+        now = time.time()
+
+        hits = 0
+        tile_columns = []
+        for zone, cell in tiles:
+            key = self.tile_key(zone, cell)
+            with self.lock:
+                tile_lock = self.tile_locks.setdefault(key, threading.Lock())
+
+            # only one thread reads or queries a given tile at a time, so a tile is never fetched twice
+            with tile_lock:
+                with self.lock:
+                    entry = self.index.get(key)
+
+                columns = None
+                if entry is not None and entry['mag_limit'] >= mag_cut:
+                    with Metrics.timer('catalog.read_tile'):
+                        columns, header = self.read_tile(key)
+
+                if columns is not None:
+                    hits += 1
+                else:
+                    with Metrics.timer('catalog.query'):
+                        columns, header = self.query_tile(zone, cell, tile_mag)
+                    with Metrics.timer('catalog.write_tile'):
+                        entry = {'mag_limit': tile_mag, 'bytes': self.write_tile(key, columns, header)}
+
+                with self.lock:
+                    entry['last_access'] = now
+                    self.index[key] = entry
+                    self.evicted.discard(key)
+            tile_columns.append(columns)
+
+        Utils.log("Catalog cache used " + str(hits) + " of " + str(len(tiles)) + " tiles from disk, queried the " +
+                  self.backend.name + " for " + str(len(tiles) - hits) + ".", "info")
+        Metrics.count('catalog.cache_hit', hits)
+        Metrics.count('catalog.cache_miss', len(tiles) - hits)
+
+        with self.lock:
+            self.evict(set(self.tile_key(zone, cell) for zone, cell in tiles))
+            self.write_index()
+
+        # only keep the stars in the cone and in the magnitude range, the selection is the only copy made
+        with Metrics.timer('catalog.filter'):
+            stars = {}
+            for columns in tile_columns:
+                dist = self.angular_distance(ra_deg, dec_deg, columns['ra'], columns['dec'])
+                keep = (dist <= radius_deg) & (columns['mag'] < mag_cut)
+                for name in self.COLUMNS:
+                    stars.setdefault(name, []).append(columns[name][keep])
+
+            return {name: np.concatenate(stars[name]) for name in self.COLUMNS}
+
+    @staticmethod
+    def field_key(ra_deg, dec_deg, radius_deg, mag_cut, date):
+        """ This function will return the name a field propagated to a night is stored under.
+
+        :parameter ra_deg, dec_deg - The center of the field in degrees.
+        :parameter radius_deg - The radius of the search area.
+        :parameter mag_cut - The magnitude cutoff for the field.
+        :parameter date - The night as a 'YYYY-MM-DD' string.
+
+        :return The field name as a string.
+        """
+
+        return ('field_' + '_'.join('%.6f' % value for value in (ra_deg, dec_deg, radius_deg)) + '_' +
+                '%.2f' % mag_cut + '_' + date)
+
+    def cone_search_epoch(self, ra_deg, dec_deg, radius_deg, mag_cut, date=None, legacy_file=None):
+        """ This function will return all stars in a cone moved to their position on the night observed. The
+        propagated field is stored in the cache like a tile, so a repeat visit or a batch run on the same night
+        reads it back rather than searching and propagating again. A region file from the old tic_search is used in
+        place of the tiles when given, as it was before, and is stored in the binary format on first use.
+
+        :parameter ra_deg - The right ascension of the target in degrees.
+        :parameter dec_deg - The declination of the target in degrees.
+        :parameter radius_deg - The radius of the search area.
+        :parameter mag_cut - The magnitude cutoff for the given star field.
+        :parameter date - The night observed, defaults to the configuration or today (UTC).
+        :parameter legacy_file - The csv region file the old tic_search wrote for the field, if any.
+
+        :return columns - A dictionary of the COLUMNS arrays, with ra, dec and epoch at the night observed.
+        """
+
+        date = Geometry.observation_date(date)
+        key = self.field_key(ra_deg, dec_deg, radius_deg, mag_cut, date)
+
+        with self.lock:
+            tile_lock = self.tile_locks.setdefault(key, threading.Lock())
+
+        with tile_lock:
+            with self.lock:
+                entry = self.index.get(key)
+
+            columns = None
+            if entry is not None:
+                columns, header = self.read_tile(key)
+
+            if columns is not None:
+                Metrics.count('catalog.epoch_hit')
+            else:
+                Metrics.count('catalog.epoch_miss')
+                if legacy_file is not None and os.path.isfile(legacy_file):
+                    Utils.log("Legacy region file " + os.path.basename(legacy_file) + " found, it will be used for "
+                              "this field. If this is not what you want, delete the file!", "info")
+                    columns = self.read_csv(legacy_file)
+                    keep = ((self.angular_distance(ra_deg, dec_deg, columns['ra'], columns['dec']) <= radius_deg) &
+                            (columns['mag'] < mag_cut))
+                    columns = {name: values[keep] for name, values in columns.items()}
+                else:
+                    columns = dict(self.cone_search_columns(ra_deg, dec_deg, radius_deg, mag_cut))
+                with Metrics.timer('catalog.propagate'):
+                    obs_epoch = Geometry.julian_epoch(date)
+                    columns['ra'], columns['dec'] = Geometry.propagate(columns['ra'], columns['dec'], columns['pmra'],
+                                                                       columns['pmdec'], columns['epoch'], obs_epoch)
+                    columns['epoch'] = np.full(len(columns['ra']), obs_epoch, dtype=self.COLUMNS['epoch'])
+
+                header = {'catalog_version': Configuration.CATALOG_VERSION,
+                          'ra_deg': ra_deg,
+                          'dec_deg': dec_deg,
+                          'radius_deg': radius_deg,
+                          'mag_limit': mag_cut,
+                          'date': date,
+                          'n_stars': int(len(columns['ra'])),
+                          'columns': {name: np.dtype(dtype).str for name, dtype in self.COLUMNS.items()},
+                          'created': time.time()}
+                entry = {'mag_limit': mag_cut, 'bytes': self.write_tile(key, columns, header)}
+
+            with self.lock:
+                entry['last_access'] = time.time()
+                self.index[key] = entry
+                self.evicted.discard(key)
+                self.evict({key})
+                self.write_index()
+
+        return columns
+
+    def cone_search(self, ra_deg, dec_deg, radius_deg, mag_cut):
+        """ This function will return all stars in a cone, reading cached tiles and querying the backend for the rest.
+
+        :parameter ra_deg - The right ascension of the target in degrees.
+        :parameter dec_deg - The declination of the target in degrees.
+        :parameter radius_deg - The radius of the search area.
+        :parameter mag_cut - The magnitude cutoff for the given star field.
+
+        :return stars - The dataframe of stars in the search area (ra, dec, mag)
+        """
+
+        import pandas as pd
+
+        return pd.DataFrame(self.cone_search_columns(ra_deg, dec_deg, radius_deg, mag_cut), copy=False)
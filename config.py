@@ -45,6 +45,8 @@ class Configuration:
     DFPS_GUIDE_CAMERA_Y = 700  # pixels
     DFPS_GUIDE_CAMERA_FOV_X = DFPS_GUIDE_CAMERA_X * DFPS_PIXEL_SCALE * UM_TO_MM * OTTO_STRUVE_PLATE_SCALE / 3600
     DFPS_GUIDE_CAMERA_FOV_Y = DFPS_GUIDE_CAMERA_X * DFPS_PIXEL_SCALE * UM_TO_MM * OTTO_STRUVE_PLATE_SCALE / 3600
+    DFPS_GUIDE_CAMERA_SIZE_X_MM = DFPS_GUIDE_CAMERA_FOV_X * 3600 / OTTO_STRUVE_PLATE_SCALE  # mm
+    DFPS_GUIDE_CAMERA_SIZE_Y_MM = DFPS_GUIDE_CAMERA_FOV_Y * 3600 / OTTO_STRUVE_PLATE_SCALE  # mm
     DFPS_GUIDE_CAMERA_DIST = 45  # mm
 
     # these are TIC search specific information
@@ -52,13 +54,92 @@ class Configuration:
     SEARCH_RADIUS_DEG = SEARCH_RADIUS_ARCMIN / 60. / 2.  # convert to degrees and divide by 2 to get the radius
     MAGNITUDE_CUTOFF = 16  # this is the lower limit of the magnitudes to keep
 
+    # these are guide camera optimizer specific information
+    GUIDE_STAR_MAG_LIMIT = 14  # the faintest star the guide cameras can use
+    CAMERA_SEARCH_HALF_WIDTH_DEG = OTTO_STRUVE_FIELD_OF_VIEW_DEG / 2.  # how far the layout can move from the field
+    CAMERA_SEARCH_STEP_DEG = DFPS_GUIDE_CAMERA_FOV_X / 4.  # the spacing of the candidate layouts
+    CAMERA_SEARCH_BINS_PER_BOX = 20  # the resolution of the star counting grid across one camera
+
+    # these are fiber assignment specific information
+    FIBER_TRAVEL_LIMITS_MM = [15, 15, 15, 15]  # the furthest each fiber can move from its starting position in mm
+
+    # these are picker specific information
+    PICKER_STAR_BLOCK_PX = 4  # only the brightest star in each block of this many pixels is drawn
+    PICKER_INDEX_CELLS = 64  # the grid of the spatial index along each side of the field
+
+    # these are session specific information
+    SESSION_FLUSH_S = 2  # changes are batched and written to the plan store at most this often
+
+    # these are instrumentation specific information
+    PROFILE = False  # run main.py and batch.py under cProfile, written to PROFILE_FILE
+
+    # these are frame stream specific information
+    FRAME_EXTENSION = ".fits"  # the guide camera frames
+    FRAME_POLL_S = 0.2  # the time between looks at the frame directory in seconds
+    FRAME_STALL_S = 10  # frames still empty or incomplete this long after they last grew are skipped
+    FRAME_MTIME_RESOLUTION_S = 2  # the coarsest modification time step of the frame file system (FAT, network shares)
+    FRAME_CAMERA_KEYWORD = "CAMERA"  # the fits header keyword with the camera number
+    FRAME_CAMERA_PATTERN = r"cam(\d)"  # or the camera number in the file name, when the header does not have it
+    FRAME_DETECT_SIGMA = 5  # the detection threshold in standard deviations of the background
+    FRAME_MIN_PIXELS = 3  # the fewest pixels above the threshold which count as a star
+    FRAME_MAX_STARS = 20  # the most stars measured on each frame, the brightest are kept
+
+    # these are astrometry specific information
+    ASTROMETRY_SEARCH_MM = 2.0  # the largest pointing error searched for, on the focal plane in mm
+    ASTROMETRY_MATCH_MM = 0.05  # the furthest a measured star can be from its catalog star and still match
+    ASTROMETRY_ITERATIONS = 6  # the number of times the matches are refined, with a shrinking match radius
+    ASTROMETRY_MIN_MATCHES = 3  # the fewest matched stars which give a solution
+
+    # these are sky service specific information
+    SERVICE_HOST = "127.0.0.1"  # the service only listens on this machine
+    SERVICE_PORT = 8765
+    SERVICE_WORKERS = 4  # the threads doing the numerical work of requests
+    SERVICE_MAX_FIELDS = 32  # the field catalogs kept in memory, the least recently used are dropped
+    SERVICE_MAX_PLANS = 256  # the field plans kept in memory
+    SERVICE_MAX_SOLVERS = 16  # the astrometric solvers kept in memory
+    SERVICE_MAX_REQUEST = 16 * 1024 * 1024  # the longest request line in bytes
+
+    # these are batch planning specific information
+    BATCH_WORKERS = 4  # the number of fields to plan in parallel
+
+    # these are sweep specific information
+    SWEEP_SHIFTS_MM = [-10, -5, 0, 5, 10]  # the shifts of every fiber tried by default, along each axis
+    SWEEP_CAMERA_DISTS = [DFPS_GUIDE_CAMERA_DIST]  # the camera spacings to try in mm
+    SWEEP_PLATE_SCALES = [OTTO_STRUVE_PLATE_SCALE]  # the plate scales to try in arcsec / mm
+    SWEEP_CHUNK = 32  # the offset layouts scored at once, bounds the memory of the cost arrays
+
     # this is the directory information
     WORKING_DIRECTORY = "/home/oelkerrj/Development/dfps_sky/"
     ANALYSIS_DIRECTORY = WORKING_DIRECTORY + 'analysis/'
     LOG_DIRECTORY = WORKING_DIRECTORY + 'logs/'
+    PLAN_STORE_FILE = ANALYSIS_DIRECTORY + 'plans.sqlite'  # every field's cameras, fibers and moves
+    METRICS_FILE = LOG_DIRECTORY + 'metrics.jsonl'  # one line of stage timings and counters per run
+    PROFILE_FILE = LOG_DIRECTORY + 'dfps.prof'  # read with python -m pstats
 
     # input paths for data etc
     DATA_DIRECTORY = WORKING_DIRECTORY + "data/"
+    CACHE_DIRECTORY = DATA_DIRECTORY + "cache/"
+    FRAME_DIRECTORY = DATA_DIRECTORY + "frames/"  # where the guide cameras write their frames
+    LOCAL_CATALOG_DIRECTORY = DATA_DIRECTORY + "local_catalog/"  # built by python local_catalog.py
+    TARGET_LIST_FILE = DATA_DIRECTORY + "targets.csv"  # columns of name, ra, dec and optionally mag_cut
+
+    # these are the catalog cache specific information
+    CACHE_TILE_DEG = 0.25  # the height of a declination zone and the approximate width of a tile in degrees
+    CACHE_MAGNITUDE_LIMIT = 17  # tiles are stored to this magnitude so different cut-offs can share them
+    CACHE_MAX_MB = 500  # the least recently used tiles are evicted above this size
+    CATALOG_VERSION = "TIC v8.2 pm"  # tiles from a different catalog version are re-queried
+    CATALOG_EPOCH = 2000.0  # the epoch of the TIC positions, the proper motions move them to the night observed
+    OBSERVATION_DATE = None  # the night to propagate the catalog to as 'YYYY-MM-DD', None for today (UTC)
+
+    # these are the catalog backend specific information
+    CATALOG_BACKEND = "mast"  # mast, directory (a folder of csv files), url (a local catalog server) or local
+    CATALOG_BACKEND_LOCATION = ""  # the folder or url for the directory and url backends
+    LOCAL_CATALOG_ZONE_DEG = 0.25  # the declination height of each zone of the local catalog
+    MAST_PAGE_SIZE = 50000  # the rows of each page of a MAST query, only one page is converted at a time
+    CATALOG_TIMEOUT_S = 120  # the time a catalog backend waits for one request before it fails
+    PREFETCH_CONCURRENCY = 4  # the number of fields queried at once
+    PREFETCH_RETRIES = 3  # the number of attempts for each field, a failed or timed out search is started again
+    PREFETCH_WAIT_S = 600  # the longest the prefetcher waits for a field, a search still running carries on alone
 
     # directory_list
-    DIRECTORIES = [ANALYSIS_DIRECTORY, DATA_DIRECTORY, LOG_DIRECTORY]
+    DIRECTORIES = [ANALYSIS_DIRECTORY, DATA_DIRECTORY, CACHE_DIRECTORY, LOG_DIRECTORY]
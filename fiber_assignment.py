@@ -0,0 +1,136 @@
+""" This class holds the solver which assigns the fibers to target stars with the least total movement."""
+import numpy as np
+from config import Configuration
+from geometry import Geometry
+
+
+class FiberAssigner:
+
+    @staticmethod
+    def offsets_mm(fib_x, fib_y, star_x, star_y, plate_scale=None):
+        """ This function will return the offset in mm from every fiber to every star, projected onto the focal
+        plane about each fiber the same way on_click_stars does. Any leading dimensions of the fiber arrays are kept,
+        so many configurations can be converted at once.
+
+        :parameter fib_x - An (..., F) numpy array with the x position of the fibers in degrees.
+        :parameter fib_y - An (..., F) numpy array with the y position of the fibers in degrees.
+        :parameter star_x - An (M,) numpy array with the x position of the stars in degrees.
+        :parameter star_y - An (M,) numpy array with the y position of the stars in degrees.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return offset_x, offset_y - Two (..., F, M) numpy arrays of offsets in mm.
+        """
+
+        return Geometry.sky_to_focal(np.asarray(star_x), np.asarray(star_y),
+                                     np.asarray(fib_x)[..., None], np.asarray(fib_y)[..., None], plate_scale)
+
+    @staticmethod
+    def cost_matrix(fib_x, fib_y, star_x, star_y, travel_limits=None, plate_scale=None):
+        """ This function will return the cost of moving every fiber to every star, which is the distance
+        travelled in mm. Moves beyond the travel limit of a fiber are given an infinite cost.
+
+        :parameter fib_x, fib_y - (..., F) numpy arrays with the fiber positions in degrees.
+        :parameter star_x, star_y - (M,) numpy arrays with the candidate star positions in degrees.
+        :parameter travel_limits - An (F,) array with the furthest each fiber can move in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return cost - An (..., F, M) numpy array of costs in mm.
+        """
+
+        offset_x, offset_y = FiberAssigner.offsets_mm(fib_x, fib_y, star_x, star_y, plate_scale)
+
+        return FiberAssigner.offsets_cost(offset_x, offset_y, travel_limits)
+
+    @staticmethod
+    def offsets_cost(offset_x, offset_y, travel_limits=None):
+        """ This function will return the cost of moves which have already been converted to mm, as cost_matrix
+        does.
+
+        :parameter offset_x, offset_y - (..., F, M) numpy arrays of offsets in mm, from offsets_mm.
+        :parameter travel_limits - An (F,) array with the furthest each fiber can move in mm.
+
+        :return cost - An (..., F, M) numpy array of costs in mm.
+        """
+
+        travel_limits = np.asarray(travel_limits if travel_limits is not None else Configuration.FIBER_TRAVEL_LIMITS_MM,
+                                   dtype=np.float64)
+
+        cost = np.hypot(offset_x, offset_y)
+        cost[cost > travel_limits[:, None]] = np.inf
+
+        return cost
+
+    @staticmethod
+    def solve(cost):
+        """ This function will solve a single assignment with the Hungarian method, each star is used at most once.
+
+        :parameter cost - An (F, M) numpy array of costs where infinite costs are not allowed.
+
+        :return stars - An (F,) numpy array with the star assigned to each fiber, or -1 if the fiber cannot reach
+        any free star.
+        """
+
+        # scipy is slow to import, so only load it when a solve is needed
+        from scipy.optimize import linear_sum_assignment
+
+        stars = np.full(cost.shape[0], -1, dtype=np.int64)
+
+        # only the stars some fiber can reach are worth solving for
+        reachable = np.flatnonzero(np.any(np.isfinite(cost), axis=0))
+        if len(reachable) == 0:
+            return stars
+
+        # unreachable pairs get a cost larger than any real solution so they are only used when forced
+        sub = cost[:, reachable]
+        big = np.max(sub[np.isfinite(sub)], initial=0.) * (cost.shape[0] + 1) + 1.
+        fiber_idx, star_idx = linear_sum_assignment(np.where(np.isfinite(sub), sub, big))
+
+        allowed = np.isfinite(sub[fiber_idx, star_idx])
+        stars[fiber_idx[allowed]] = reachable[star_idx[allowed]]
+
+        return stars
+
+    @staticmethod
+    def assign(fib_x, fib_y, star_x, star_y, travel_limits=None, plate_scale=None, return_cost=False):
+        """ This function will find the least total movement which puts the fibers on the candidate stars for one
+        or many fiber configurations. The costs for every configuration are built in one vectorized step.
+
+        :parameter fib_x, fib_y - (F,) or (C, F) numpy arrays with the fiber positions in degrees.
+        :parameter star_x, star_y - (M,) numpy arrays with the candidate star positions in degrees.
+        :parameter travel_limits - An (F,) array with the furthest each fiber can move in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+        :parameter return_cost - Also return the cost array, so callers scoring the moves do not build it again.
+
+        :return stars, offset_x, offset_y, total - The star assigned to each fiber (-1 if none), the offsets in mm
+        (nan if none), and the total movement of each configuration in mm, shaped like the fiber arrays. With
+        return_cost the (..., F, M) cost array from cost_matrix follows.
+        """
+
+        fib_x = np.asarray(fib_x, dtype=np.float64)
+        fib_y = np.asarray(fib_y, dtype=np.float64)
+        single = fib_x.ndim == 1
+        fib_x = np.atleast_2d(fib_x)
+        fib_y = np.atleast_2d(fib_y)
+
+        if len(star_x) == 0:
+            stars = np.full(fib_x.shape, -1, dtype=np.int64)
+            move_x = np.full(fib_x.shape, np.nan)
+            move_y = np.full(fib_x.shape, np.nan)
+            total = np.zeros(fib_x.shape[0])
+            cost = np.zeros(fib_x.shape + (0,))
+        else:
+            # the offsets are converted once, the cost is their length
+            offset_x, offset_y = FiberAssigner.offsets_mm(fib_x, fib_y, star_x, star_y, plate_scale)
+            cost = FiberAssigner.offsets_cost(offset_x, offset_y, travel_limits)
+
+            stars = np.stack([FiberAssigner.solve(config_cost) for config_cost in cost])
+
+            config_idx, fiber_idx = np.indices(stars.shape)
+            found = stars >= 0
+            move_x = np.where(found, offset_x[config_idx, fiber_idx, np.maximum(stars, 0)], np.nan)
+            move_y = np.where(found, offset_y[config_idx, fiber_idx, np.maximum(stars, 0)], np.nan)
+            total = np.nansum(np.hypot(move_x, move_y), axis=1)
+
+        result = (stars, move_x, move_y, total, cost) if return_cost else (stars, move_x, move_y, total)
+
+        return tuple(values[0] for values in result) if single else result
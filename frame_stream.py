@@ -0,0 +1,371 @@
+""" This class holds the frame stream, which watches the guide camera data directory and measures the stars of each new
+frame as it lands, so the fibers set up in pick_n_plot can be checked on the sky while observing. Run it with:
+python frame_stream.py [frame directory]"""
+import math
+import os
+import re
+import sys
+import time
+import numpy as np
+from config import Configuration
+from metrics import Metrics
+from utils import Utils
+
+
+class FrameStream:
+
+    def __init__(self, directory=None, file_ext=None, poll_s=None):
+        """ The stream remembers the frames it has already seen. New files are learnt from a watchdog (inotify)
+        watch of the directory where watchdog is installed, or else by listing the directory again only when its
+        modification time has changed, so a poll of a quiet directory costs one stat call. Files not yet finished
+        are checked with one stat call each, and their fits headers are read when they grow, until they are.
+
+        :parameter directory - The directory the guide cameras write their frames to, defaults to the configuration.
+        :parameter file_ext - The extension of the frames, defaults to the configuration.
+        :parameter poll_s - The time to wait between looks at the directory in seconds.
+        """
+
+        self.directory = directory if directory is not None else Configuration.FRAME_DIRECTORY
+        self.file_ext = file_ext if file_ext is not None else Configuration.FRAME_EXTENSION
+        self.poll_s = poll_s if poll_s is not None else Configuration.FRAME_POLL_S
+        self.seen = set()
+        self.pending = {}
+        self.mtime_ns = None
+        self.listed_ns = 0
+        self.observer = None
+        self.created = []
+
+    def watch(self):
+        """ This function will start a watchdog watch of the directory, so new files are reported by the operating
+        system rather than found by listing the directory.
+
+        :return watching - True if the watch started, False if watchdog is not installed.
+        """
+
+        try:
+            # watchdog is optional, without it the directory is listed when it changes
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return False
+
+        created = self.created
+
+        class Handler(FileSystemEventHandler):
+
+            def on_created(self, event):
+                created.append(event.src_path)
+
+            def on_moved(self, event):
+                created.append(event.dest_path)
+
+        self.observer = Observer()
+        self.observer.schedule(Handler(), self.directory, recursive=False)
+        self.observer.start()
+
+        return True
+
+    def stop(self):
+        """ This function will stop the watchdog watch, if there is one.
+
+        :return - Nothing is returned.
+        """
+
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+
+    def new_names(self):
+        """ This function will return the names of the files added to the directory since the last call, listing
+        the directory only the first time and, without a watch, when its modification time has changed. A file
+        made in the same time step as the last listing leaves the modification time as it was, so the directory is
+        also listed until the last listing is more than FRAME_MTIME_RESOLUTION_S after the last change.
+
+        :return names - A list of file names, some may have been seen before.
+        """
+
+        if self.observer is not None and self.mtime_ns is not None:
+            # list.pop is atomic, so the names added by the watch thread meanwhile are kept for the next call
+            return [os.path.basename(self.created.pop(0)) for idx in range(len(self.created))]
+
+        mtime_ns = os.stat(self.directory).st_mtime_ns
+        if mtime_ns == self.mtime_ns and self.listed_ns - mtime_ns > Configuration.FRAME_MTIME_RESOLUTION_S * 1e9:
+            return []
+        self.mtime_ns = mtime_ns
+        self.listed_ns = time.time_ns()
+
+        with os.scandir(self.directory) as entries:
+            return [entry.name for entry in entries]
+
+    @staticmethod
+    def read_header(f):
+        """ This function will read one fits header from the current position of a file, a block at a time.
+
+        :parameter f - The file, opened in binary mode at the start of a header.
+
+        :return cards, n_bytes - A dictionary of the header values as strings and the length of the header in bytes,
+        or None, 0 if the header is not all there yet.
+        """
+
+        cards = {}
+        n_bytes = 0
+        while True:
+            block = f.read(2880)
+            if len(block) < 2880:
+                return None, 0
+            n_bytes += 2880
+            for idx in range(0, 2880, 80):
+                keyword = block[idx:idx + 8].decode('ascii', 'replace').strip()
+                if keyword == 'END':
+                    return cards, n_bytes
+                if block[idx + 8:idx + 10] == b'= ':
+                    cards[keyword] = block[idx + 10:idx + 80].decode('ascii', 'replace').split('/')[0].strip()
+
+    @staticmethod
+    def is_complete(frame_file, size):
+        """ This function will check a frame has been written in full, by walking its fits headers and checking the
+        file ends where the data of the last one does. Only the headers are read.
+
+        :parameter frame_file - The fits file of the frame.
+        :parameter size - The size of the file in bytes.
+
+        :return complete - True if the file ends with a data unit of the size its header gives.
+        """
+
+        end = 0
+        data_bytes = 0
+        try:
+            with open(frame_file, 'rb') as f:
+                while end < size:
+                    f.seek(end)
+                    cards, n_bytes = FrameStream.read_header(f)
+                    if cards is None or ('SIMPLE' not in cards and 'XTENSION' not in cards):
+                        return False
+
+                    # the data is bitpix x gcount x (pcount + naxis1 x ... x naxisn), padded to whole blocks
+                    n_axis = int(cards.get('NAXIS', 0))
+                    n_values = math.prod(int(cards['NAXIS' + str(axis)]) for axis in range(1, n_axis + 1))
+                    data_bytes = (abs(int(cards['BITPIX'])) // 8 * int(cards.get('GCOUNT', 1)) *
+                                  (int(cards.get('PCOUNT', 0)) + (n_values if n_axis > 0 else 0)))
+                    end += n_bytes + int(math.ceil(data_bytes / 2880.)) * 2880
+        except (OSError, KeyError, ValueError):
+            return False
+
+        return end == size and data_bytes > 0
+
+    def new_frames(self):
+        """ This function will return the frames written since the last call, in the order they were taken. A frame
+        is only returned once its fits headers show it is complete, so half written frames are not read even if the
+        writer pauses, and files which stay empty or incomplete are dropped.
+
+        :return frames - A list of the new frame paths.
+        """
+
+        now = time.monotonic()
+        for name in self.new_names():
+            if name.endswith(self.file_ext) and name not in self.seen and name not in self.pending:
+                self.pending[name] = (-1, now)
+
+        ready = []
+        for name, (last_size, last_grew) in list(self.pending.items()):
+            frame_file = os.path.join(self.directory, name)
+            try:
+                size = os.stat(frame_file).st_size
+            except FileNotFoundError:
+                del self.pending[name]
+                continue
+
+            # a frame can only have been finished since the last poll if it has grown
+            if size != last_size:
+                if size > 0 and self.is_complete(frame_file, size):
+                    ready.append(name)
+                else:
+                    self.pending[name] = (size, now)
+            elif now - last_grew > Configuration.FRAME_STALL_S:
+                Utils.log("Frame " + name + " is still " + ("empty" if size == 0 else "incomplete") +
+                          ", it will be skipped.", "warning")
+                self.seen.add(name)
+                del self.pending[name]
+
+        for name in ready:
+            self.seen.add(name)
+            del self.pending[name]
+
+        return [os.path.join(self.directory, name) for name in sorted(ready, key=Utils.natural_key)]
+
+    @staticmethod
+    def load_frame(frame_file):
+        """ This function will read a frame through a memory map, so only the pixels are copied out of the file.
+
+        :parameter frame_file - The fits file of the frame.
+
+        :return image, header - The image as a float32 numpy array and the fits header.
+        """
+
+        # astropy is slow to import, so only load it when frames are read
+        from astropy.io import fits
+
+        with fits.open(frame_file, memmap=True) as hdul:
+            hdu = next(hdu for hdu in hdul if hdu.data is not None)
+            image = np.array(hdu.data, dtype=np.float32)
+            header = hdu.header.copy()
+
+        return image, header
+
+    @staticmethod
+    def camera_of(frame_file, header):
+        """ This function will return the guide camera a frame was taken with, from the header or else the file name.
+
+        :parameter frame_file - The path of the frame.
+        :parameter header - The fits header of the frame.
+
+        :return cam_num - The camera number from 1 to 4, or None if it is not known.
+        """
+
+        if Configuration.FRAME_CAMERA_KEYWORD in header:
+            return int(header[Configuration.FRAME_CAMERA_KEYWORD])
+
+        match = re.search(Configuration.FRAME_CAMERA_PATTERN, os.path.basename(frame_file))
+
+        return int(match.group(1)) if match is not None else None
+
+    @staticmethod
+    def find_stars(image, sigma=None, min_pixels=None, max_stars=None):
+        """ This function will detect the stars of a frame and measure their flux weighted centroids.
+
+        :parameter image - The image as a numpy array.
+        :parameter sigma - The detection threshold in standard deviations of the background.
+        :parameter min_pixels - The fewest pixels above the threshold which count as a star, to skip hot pixels.
+        :parameter max_stars - The most stars returned, the brightest are kept.
+
+        :return stars - A dictionary of x_px, y_px and flux numpy arrays, brightest first.
+        """
+
+        # scipy is slow to import, so only load it when frames are measured
+        from scipy import ndimage
+
+        sigma = sigma if sigma is not None else Configuration.FRAME_DETECT_SIGMA
+        min_pixels = min_pixels if min_pixels is not None else Configuration.FRAME_MIN_PIXELS
+        max_stars = max_stars if max_stars is not None else Configuration.FRAME_MAX_STARS
+
+        # the median and the median absolute deviation are not pulled up by the stars
+        background = np.median(image)
+        noise = 1.4826 * np.median(np.abs(image - background))
+        signal = image - background
+        labels, n_stars = ndimage.label(signal > sigma * max(noise, 1e-6))
+        if n_stars == 0:
+            return {'x_px': np.zeros(0), 'y_px': np.zeros(0), 'flux': np.zeros(0)}
+
+        index = np.arange(1, n_stars + 1)
+        n_pixels = np.bincount(labels.ravel(), minlength=n_stars + 1)[1:]
+        flux = np.asarray(ndimage.sum_labels(signal, labels, index))
+        rows, cols = np.asarray(ndimage.center_of_mass(np.clip(signal, 0, None), labels, index)).reshape(-1, 2).T
+
+        keep = np.flatnonzero(n_pixels >= min_pixels)
+        keep = keep[np.argsort(-flux[keep], kind='stable')][:max_stars]
+
+        return {'x_px': cols[keep], 'y_px': rows[keep], 'flux': flux[keep]}
+
+    @staticmethod
+    def to_focal(x_px, y_px, shape):
+        """ This function will convert pixel positions to mm from the center of the camera, as the fiber offsets are
+        given, with x increasing with the column and y with the row.
+
+        :parameter x_px, y_px - Numpy arrays of the pixel positions.
+        :parameter shape - The (rows, columns) shape of the frame.
+
+        :return x_mm, y_mm - The positions in mm from the camera center.
+        """
+
+        pixel_mm = Configuration.DFPS_PIXEL_SCALE * Configuration.UM_TO_MM
+
+        return (x_px - (shape[1] - 1) / 2.) * pixel_mm, (y_px - (shape[0] - 1) / 2.) * pixel_mm
+
+    @staticmethod
+    def measure(frame_file, offsets=None):
+        """ This function will measure the stars of one frame, and how far the fiber of its camera is from the
+        nearest of them.
+
+        :parameter frame_file - The fits file of the frame.
+        :parameter offsets - The [[x], [y]] fiber offsets of the cameras in mm, defaults to the configuration.
+
+        :return measurement - A dictionary with the file, camera, time and star positions in pixels and mm, and the
+        distance in mm from the fiber to the nearest star (None without a camera or stars).
+        """
+
+        offsets = offsets if offsets is not None else Configuration.OFFSETS
+
+        with Metrics.timer('frames.load'):
+            image, header = FrameStream.load_frame(frame_file)
+        with Metrics.timer('frames.centroid'):
+            stars = FrameStream.find_stars(image)
+        x_mm, y_mm = FrameStream.to_focal(stars['x_px'], stars['y_px'], image.shape)
+        cam_num = FrameStream.camera_of(frame_file, header)
+
+        fiber_miss_mm = None
+        if cam_num is not None and len(x_mm) > 0:
+            fiber_miss_mm = float(np.min(np.hypot(x_mm - offsets[0][cam_num - 1], y_mm - offsets[1][cam_num - 1])))
+
+        Metrics.count('frames.measured')
+
+        return {'file': os.path.basename(frame_file),
+                'camera': cam_num,
+                'time': header.get('DATE-OBS', os.path.getmtime(frame_file)),
+                'x_px': stars['x_px'], 'y_px': stars['y_px'], 'flux': stars['flux'],
+                'x_mm': x_mm, 'y_mm': y_mm,
+                'fiber_miss_mm': fiber_miss_mm}
+
+    def stream(self, offsets=None, timeout_s=None):
+        """ This function will measure every new frame as it lands, waiting between polls while nothing is new.
+
+        :parameter offsets - The [[x], [y]] fiber offsets of the cameras in mm, such as from pick_n_plot.
+        :parameter timeout_s - Stop after this long without a new frame, None to watch forever.
+
+        :return A generator of the measurements from measure, in the order the frames were taken.
+        """
+
+        self.watch()
+        try:
+            for measurement in self.watch_frames(offsets, timeout_s):
+                yield measurement
+        finally:
+            self.stop()
+
+    def watch_frames(self, offsets, timeout_s):
+        """ This function will measure the frames as they land, see stream.
+
+        :parameter offsets - The [[x], [y]] fiber offsets of the cameras in mm.
+        :parameter timeout_s - Stop after this long without a new frame, None to watch forever.
+
+        :return A generator of the measurements from measure.
+        """
+
+        last_frame = time.monotonic()
+        while True:
+            frames = self.new_frames()
+            for frame_file in frames:
+                try:
+                    yield self.measure(frame_file, offsets)
+                except Exception as error:
+                    # one bad frame should not stop the stream
+                    Utils.log("Could not measure frame " + os.path.basename(frame_file) + ": " + str(error), "error")
+                    Metrics.count('frames.failed')
+
+            if frames:
+                last_frame = time.monotonic()
+            elif timeout_s is not None and time.monotonic() - last_frame > timeout_s:
+                return
+            else:
+                time.sleep(self.poll_s)
+
+
+if __name__ == '__main__':
+    Utils.create_directories(Configuration.DIRECTORIES)
+    frame_directory = sys.argv[1] if len(sys.argv) > 1 else Configuration.FRAME_DIRECTORY
+
+    for measurement in FrameStream(frame_directory).stream():
+        Utils.log(measurement['file'] + " (camera " + str(measurement['camera']) + "): " +
+                  str(len(measurement['x_mm'])) + " stars" +
+                  ("" if measurement['fiber_miss_mm'] is None else
+                   ", the fiber is " + str(round(measurement['fiber_miss_mm'], 3)) + " mm from the nearest"), "info")
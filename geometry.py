@@ -0,0 +1,240 @@
+""" This class holds the vectorized geometry used to place the guide cameras and fibers on the sky."""
+import datetime
+import numpy as np
+from config import Configuration
+
+
+class Geometry:
+
+    # the center of each camera relative to camera 1 in units of the camera spacing, +x is east (+ra) and +y north
+    CAMERA_LAYOUT = np.array([[0., 0.], [1., 0.], [0., -1.], [1., -1.]])
+
+    # the order the corners of a box are drawn in, matching plot_a_box
+    BOX_CORNERS = np.array([[-0.5, -0.5], [-0.5, 0.5], [0.5, 0.5], [0.5, -0.5], [-0.5, -0.5]])
+
+    @staticmethod
+    def deg_to_mm(deg, plate_scale=None):
+        """ This function will convert an angle on the sky to a distance on the focal plane.
+
+        :parameter deg - The angle in degrees.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return The distance in mm.
+        """
+
+        plate_scale = plate_scale if plate_scale is not None else Configuration.OTTO_STRUVE_PLATE_SCALE
+
+        return np.asarray(deg) * 3600. / plate_scale
+
+    @staticmethod
+    def mm_to_deg(mm, plate_scale=None):
+        """ This function will convert a distance on the focal plane to an angle on the sky.
+
+        :parameter mm - The distance in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return The angle in degrees.
+        """
+
+        plate_scale = plate_scale if plate_scale is not None else Configuration.OTTO_STRUVE_PLATE_SCALE
+
+        return np.asarray(mm) * plate_scale / 3600.
+
+    @staticmethod
+    def sky_to_focal(ra, dec, ra0, dec0, plate_scale=None):
+        """ This function will project positions on the sky onto the focal plane with a gnomonic (tangent plane)
+        projection about ra0, dec0. All of the inputs broadcast against each other.
+
+        :parameter ra, dec - The positions to project in degrees.
+        :parameter ra0, dec0 - The tangent point in degrees, which lands on 0, 0 in the focal plane.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return x, y - The focal plane positions in mm, +x is east (+ra) and +y is north (+dec).
+        """
+
+        ra, dec, ra0, dec0 = map(np.radians, (ra, dec, ra0, dec0))
+        d_ra = ra - ra0
+        cos_c = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * np.cos(d_ra)
+        xi = np.cos(dec) * np.sin(d_ra) / cos_c
+        eta = (np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * np.cos(d_ra)) / cos_c
+
+        return (Geometry.deg_to_mm(np.degrees(xi), plate_scale),
+                Geometry.deg_to_mm(np.degrees(eta), plate_scale))
+
+    @staticmethod
+    def focal_to_sky(x, y, ra0, dec0, plate_scale=None):
+        """ This function will project positions on the focal plane back onto the sky, the inverse of sky_to_focal.
+        All of the inputs broadcast against each other.
+
+        :parameter x, y - The focal plane positions in mm.
+        :parameter ra0, dec0 - The tangent point in degrees.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return ra, dec - The positions on the sky in degrees, ra is kept continuous with ra0 rather than wrapped.
+        """
+
+        xi = np.radians(Geometry.mm_to_deg(x, plate_scale))
+        eta = np.radians(Geometry.mm_to_deg(y, plate_scale))
+        ra0, dec0 = np.radians(ra0), np.radians(dec0)
+
+        denom = np.cos(dec0) - eta * np.sin(dec0)
+        ra = ra0 + np.arctan2(xi, denom)
+        dec = np.arctan2(np.sin(dec0) + eta * np.cos(dec0), np.hypot(xi, denom))
+
+        return np.degrees(ra), np.degrees(dec)
+
+    @staticmethod
+    def observation_date(date=None):
+        """ This function will return the night a catalog is propagated to, as one string per day.
+
+        :parameter date - A 'YYYY-MM-DD' string, a date or a datetime, defaults to the configuration or today (UTC).
+
+        :return date - The date as a 'YYYY-MM-DD' string.
+        """
+
+        date = date if date is not None else Configuration.OBSERVATION_DATE
+        if date is None:
+            date = datetime.datetime.now(datetime.timezone.utc).date()
+        if isinstance(date, (datetime.date, datetime.datetime)):
+            date = date.strftime('%Y-%m-%d')
+
+        return date
+
+    @staticmethod
+    def julian_epoch(date=None):
+        """ This function will convert a date to a Julian epoch in years, such as 2000.0 for J2000.
+
+        :parameter date - A 'YYYY-MM-DD' string, a date or a datetime, defaults to the configuration or today (UTC).
+
+        :return epoch - The epoch in years.
+        """
+
+        day = datetime.datetime.strptime(Geometry.observation_date(date), '%Y-%m-%d')
+
+        return 2000.0 + (day - datetime.datetime(2000, 1, 1, 12)).total_seconds() / 86400. / 365.25
+
+    @staticmethod
+    def propagate(ra, dec, pmra, pmdec, epoch, obs_epoch):
+        """ This function will move every star along its proper motion from the epoch of its position to the
+        observation epoch. Each star is moved along the great circle of its motion, so stars near the poles are
+        handled too. Parallax and radial velocity are not known for most TIC stars and are left out.
+
+        :parameter ra, dec - Numpy arrays with the positions in degrees.
+        :parameter pmra, pmdec - Numpy arrays with the proper motions in mas / yr, pmra including the cos(dec) term.
+        :parameter epoch - A numpy array (or scalar) with the epoch of the positions in years.
+        :parameter obs_epoch - The epoch to move the stars to in years.
+
+        :return ra, dec - The positions at the observation epoch in degrees, ra in [0, 360).
+        """
+
+        ra, dec = np.radians(ra), np.radians(dec)
+        dt = obs_epoch - np.asarray(epoch, dtype=np.float64)
+        mu_ra = np.radians(np.asarray(pmra, dtype=np.float64) / 3.6e6) * dt
+        mu_dec = np.radians(np.asarray(pmdec, dtype=np.float64) / 3.6e6) * dt
+
+        # step along the tangent vectors towards east and north, then normalise back onto the sphere
+        sin_ra, cos_ra, sin_dec, cos_dec = np.sin(ra), np.cos(ra), np.sin(dec), np.cos(dec)
+        x = cos_dec * cos_ra - mu_ra * sin_ra - mu_dec * sin_dec * cos_ra
+        y = cos_dec * sin_ra + mu_ra * cos_ra - mu_dec * sin_dec * sin_ra
+        z = sin_dec + mu_dec * cos_dec
+
+        return np.degrees(np.arctan2(y, x)) % 360., np.degrees(np.arctan2(z, np.hypot(x, y)))
+
+    @staticmethod
+    def camera_index(cam_num):
+        """ This function will return the row of a camera in the layout table, checking the camera exists.
+
+        :parameter cam_num - The camera number, from 1 to the number of cameras.
+
+        :return idx - The index of the camera, from 0.
+        """
+
+        if int(cam_num) != cam_num or not 1 <= cam_num <= len(Geometry.CAMERA_LAYOUT):
+            raise ValueError("There is no camera " + str(cam_num) + ", the cameras are numbered 1 to " +
+                             str(len(Geometry.CAMERA_LAYOUT)) + ".")
+
+        return int(cam_num) - 1
+
+    @staticmethod
+    def camera_offsets(cam_num, cam_dist=None):
+        """ This function will return the focal plane position of every camera relative to the given camera.
+
+        :parameter cam_num - The camera (1-4) the offsets are relative to.
+        :parameter cam_dist - The distance between neighbouring cameras in mm.
+
+        :return off_x, off_y - Two (4,) numpy arrays with the camera offsets in mm.
+        """
+
+        cam_dist = cam_dist if cam_dist is not None else Configuration.DFPS_GUIDE_CAMERA_DIST
+        layout = (Geometry.CAMERA_LAYOUT - Geometry.CAMERA_LAYOUT[Geometry.camera_index(cam_num)]) * cam_dist
+
+        return layout[:, 0], layout[:, 1]
+
+    @staticmethod
+    def camera_centers(cam_x, cam_y, cam_num, cam_dist=None, plate_scale=None):
+        """ This function will return the sky position of all four cameras for N placements at once.
+
+        :parameter cam_x, cam_y - (N,) numpy arrays (or scalars) with the sky position of the given camera.
+        :parameter cam_num - The camera (1-4) placed at cam_x, cam_y.
+        :parameter cam_dist - The distance between neighbouring cameras in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return ra, dec - Two (N, 4) numpy arrays with the center of each camera in degrees.
+        """
+
+        off_x, off_y = Geometry.camera_offsets(cam_num, cam_dist)
+        cam_x = np.asarray(cam_x, dtype=np.float64)[..., None]
+        cam_y = np.asarray(cam_y, dtype=np.float64)[..., None]
+
+        return Geometry.focal_to_sky(off_x, off_y, cam_x, cam_y, plate_scale)
+
+    @staticmethod
+    def boxes(cen_x, cen_y, sz_x, sz_y, plate_scale=None):
+        """ This function will return the sky outline of focal plane boxes centered on the given positions.
+
+        :parameter cen_x, cen_y - Numpy arrays (or scalars) with the sky position of each box center in degrees.
+        :parameter sz_x, sz_y - The size of the boxes on the focal plane in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return box_x, box_y - Two (..., 5) numpy arrays with the closed outline of each box in degrees.
+        """
+
+        cen_x = np.asarray(cen_x, dtype=np.float64)[..., None]
+        cen_y = np.asarray(cen_y, dtype=np.float64)[..., None]
+
+        return Geometry.focal_to_sky(Geometry.BOX_CORNERS[:, 0] * sz_x, Geometry.BOX_CORNERS[:, 1] * sz_y,
+                                     cen_x, cen_y, plate_scale)
+
+    @staticmethod
+    def camera_boxes(cam_x, cam_y, cam_num, cam_dist=None, plate_scale=None):
+        """ This function will return the outline of all four guide cameras for N placements at once.
+
+        :parameter cam_x, cam_y - (N,) numpy arrays (or scalars) with the sky position of the given camera.
+        :parameter cam_num - The camera (1-4) placed at cam_x, cam_y.
+        :parameter cam_dist - The distance between neighbouring cameras in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return box_x, box_y - Two (N, 4, 5) numpy arrays with the outline of each camera in degrees.
+        """
+
+        ra, dec = Geometry.camera_centers(cam_x, cam_y, cam_num, cam_dist, plate_scale)
+
+        return Geometry.boxes(ra, dec, Configuration.DFPS_GUIDE_CAMERA_SIZE_X_MM,
+                              Configuration.DFPS_GUIDE_CAMERA_SIZE_Y_MM, plate_scale)
+
+    @staticmethod
+    def fiber_positions(x, y, cam_num, offsets=None, plate_scale=None):
+        """ This function will return the sky position of a fiber from the position of its star in the camera.
+
+        :parameter x, y - Numpy arrays (or scalars) with the sky position of the star in degrees.
+        :parameter cam_num - The camera (1-4) the star is in.
+        :parameter offsets - The [[x], [y]] offsets between each camera center and its fiber in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return fb_x, fb_y - The sky position of the fiber in degrees.
+        """
+
+        offsets = offsets if offsets is not None else Configuration.OFFSETS
+        idx = Geometry.camera_index(cam_num)
+
+        return Geometry.focal_to_sky(offsets[0][idx], offsets[1][idx], x, y, plate_scale)
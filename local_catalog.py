@@ -0,0 +1,235 @@
+""" This class holds the local catalog, a copy of the TIC (or a Gaia subset) on disk which answers cone searches
+without MAST, so fields can be planned with no network. Build it from bulk csv or parquet files with:
+python local_catalog.py <catalog directory> <bulk file> [<bulk file> ...]"""
+import glob
+import json
+import math
+import os
+import shutil
+import sys
+import time
+import numpy as np
+from config import Configuration
+from backends import catalog_columns, frame_columns
+from catalog_cache import CatalogCache
+from utils import Utils
+
+
+class LocalCatalog:
+
+    name = 'local catalog'
+
+    # the column names of TIC and Gaia bulk files, and the catalog column they hold
+    RENAME = {'GAIAmag': 'mag', 'phot_g_mean_mag': 'mag', 'pmRA': 'pmra', 'pmDEC': 'pmdec', 'ref_epoch': 'epoch'}
+
+    def __init__(self, directory=None, zone_deg=None):
+        """ The local catalog splits the sky into declination zones, and stores each zone as one memory mapped
+        .npy file per column sorted on right ascension. A cone search binary searches the right ascension range of
+        each zone it touches, then cuts the few stars found on distance and magnitude.
+
+        :parameter directory - The directory holding the zones, defaults to the configuration.
+        :parameter zone_deg - The height of a zone in degrees, only used when building a new catalog.
+        """
+
+        self.directory = directory if directory is not None else Configuration.LOCAL_CATALOG_DIRECTORY
+        self.header_file = os.path.join(self.directory, 'catalog.json')
+        self.header = None
+        self.zone_deg = zone_deg if zone_deg is not None else Configuration.LOCAL_CATALOG_ZONE_DEG
+        self.zones = {}
+
+        if os.path.isfile(self.header_file):
+            with open(self.header_file, 'r') as f:
+                self.header = json.load(f)
+            self.zone_deg = self.header['zone_deg']
+
+    def zone_of(self, dec):
+        """ This function will return the zone of each declination.
+
+        :parameter dec - A numpy array (or scalar) of declinations in degrees.
+
+        :return zone - The zone number of each declination, starting at the south pole.
+        """
+
+        n_zones = int(math.ceil(180. / self.zone_deg))
+
+        return np.clip(np.floor((np.asarray(dec) + 90.) / self.zone_deg).astype(np.int64), 0, n_zones - 1)
+
+    def zone_directory(self, zone):
+        """ This function will return the directory a zone is stored in.
+
+        :parameter zone - The zone number.
+
+        :return The directory as a string.
+        """
+
+        return os.path.join(self.directory, 'zone_' + str(zone))
+
+    @staticmethod
+    def read_chunks(bulk_file, chunk_rows):
+        """ This function will read a bulk csv or parquet file a chunk at a time, keeping only the columns used.
+
+        :parameter bulk_file - The csv or parquet file.
+        :parameter chunk_rows - The number of rows in each chunk.
+
+        :return A generator of dictionaries with the catalog columns of each chunk.
+        """
+
+        wanted = set(CatalogCache.COLUMNS) | set(LocalCatalog.RENAME)
+
+        if bulk_file.endswith('.parquet'):
+            # pyarrow is only needed to ingest parquet files
+            import pyarrow.parquet as pq
+            parquet = pq.ParquetFile(bulk_file)
+            names = [name for name in parquet.schema_arrow.names if name in wanted]
+            frames = (batch.to_pandas() for batch in parquet.iter_batches(batch_size=chunk_rows, columns=names))
+        else:
+            import pandas as pd
+            frames = pd.read_csv(bulk_file, usecols=lambda name: name in wanted, chunksize=chunk_rows)
+
+        for frame in frames:
+            yield frame_columns(frame.rename(columns=LocalCatalog.RENAME))
+
+    def ingest(self, bulk_files, mag_limit=None, chunk_rows=None):
+        """ This function will build the catalog from bulk files. Each chunk is split into zones and appended to
+        spill files, so only one chunk is in memory while reading, then each zone is sorted on right ascension.
+
+        :parameter bulk_files - A list of csv or parquet files with ra, dec, a magnitude and optionally the proper
+        motions and epoch, named as in the TIC or Gaia.
+        :parameter mag_limit - The faintest star kept, defaults to the magnitude limit of the catalog cache.
+        :parameter chunk_rows - The number of rows read at a time.
+
+        :return n_stars - The number of stars in the catalog.
+        """
+
+        mag_limit = mag_limit if mag_limit is not None else Configuration.CACHE_MAGNITUDE_LIMIT
+        chunk_rows = chunk_rows if chunk_rows is not None else Configuration.MAST_PAGE_SIZE
+        spill_directory = os.path.join(self.directory, 'spill')
+        shutil.rmtree(spill_directory, ignore_errors=True)
+        os.makedirs(spill_directory)
+
+        # the catalog is not valid while it is being built
+        if os.path.isfile(self.header_file):
+            os.remove(self.header_file)
+        self.header = None
+        self.zones = {}
+
+        for bulk_file in bulk_files:
+            Utils.log("Ingesting " + os.path.basename(bulk_file) + " into the local catalog.", "info")
+            for columns in self.read_chunks(bulk_file, chunk_rows):
+                keep = columns['mag'] <= mag_limit
+                zone = self.zone_of(columns['dec'][keep])
+                order = np.argsort(zone, kind='stable')
+                zone = zone[order]
+                bounds = np.flatnonzero(np.diff(zone)) + 1
+                for part in np.split(np.arange(len(zone)), bounds):
+                    if len(part) == 0:
+                        continue
+                    for name, dtype in CatalogCache.COLUMNS.items():
+                        values = columns[name][keep][order[part]].astype(dtype)
+                        with open(os.path.join(spill_directory, str(zone[part[0]]) + '_' + name), 'ab') as f:
+                            f.write(values.tobytes())
+
+        # sort every zone on right ascension and store its columns
+        counts = {}
+        zones = sorted({int(os.path.basename(spill).split('_')[0])
+                        for spill in glob.glob(os.path.join(spill_directory, '*_ra'))})
+        for zone in zones:
+            columns = {name: np.fromfile(os.path.join(spill_directory, str(zone) + '_' + name), dtype=dtype)
+                       for name, dtype in CatalogCache.COLUMNS.items()}
+            order = np.argsort(columns['ra'], kind='stable')
+            zone_directory = self.zone_directory(zone)
+            shutil.rmtree(zone_directory, ignore_errors=True)
+            os.makedirs(zone_directory)
+            for name, values in columns.items():
+                np.save(os.path.join(zone_directory, name + '.npy'), values[order])
+            counts[str(zone)] = int(len(order))
+        shutil.rmtree(spill_directory)
+
+        # the header goes last, so the catalog is only used once every zone is on disk
+        self.header = {'catalog_version': Configuration.CATALOG_VERSION,
+                       'zone_deg': self.zone_deg,
+                       'mag_limit': mag_limit,
+                       'n_stars': counts,
+                       'columns': {name: np.dtype(dtype).str for name, dtype in CatalogCache.COLUMNS.items()},
+                       'sources': [os.path.basename(bulk_file) for bulk_file in bulk_files],
+                       'created': time.time()}
+        with open(self.header_file + '.tmp', 'w') as f:
+            json.dump(self.header, f)
+        os.replace(self.header_file + '.tmp', self.header_file)
+
+        n_stars = sum(counts.values())
+        Utils.log("The local catalog holds " + str(n_stars) + " stars in " + str(len(counts)) + " zones.", "info")
+
+        return n_stars
+
+    def read_zone(self, zone):
+        """ This function will memory map the columns of a zone, once per zone.
+
+        :parameter zone - The zone number.
+
+        :return columns - A dictionary of column arrays sorted on right ascension, or None if the zone is empty.
+        """
+
+        if zone not in self.zones:
+            n_stars = self.header['n_stars'].get(str(zone), 0)
+            self.zones[zone] = None if n_stars == 0 else {
+                name: np.load(os.path.join(self.zone_directory(zone), name + '.npy'), mmap_mode='r')
+                for name in CatalogCache.COLUMNS}
+
+        return self.zones[zone]
+
+    def query(self, ra_deg, dec_deg, radius_deg, mag_cut):
+        """ This function will return all stars in a cone brighter than a magnitude cut-off.
+
+        :parameter ra_deg - The right ascension of the cone center in degrees.
+        :parameter dec_deg - The declination of the cone center in degrees.
+        :parameter radius_deg - The radius of the cone in degrees.
+        :parameter mag_cut - The magnitude cutoff for the stars.
+
+        :return columns - A dictionary of ra, dec, mag, pmra, pmdec and epoch numpy arrays.
+        """
+
+        if self.header is None:
+            raise FileNotFoundError("There is no local catalog in " + self.directory + ", build it first with "
+                                    "python local_catalog.py.")
+        if mag_cut > self.header['mag_limit'] + 1e-9:
+            Utils.log("The local catalog only goes to magnitude " + str(self.header['mag_limit']) + ".", "warning")
+
+        # the right ascension half width of the cone, the whole circle if the cone reaches a pole
+        ra_deg = ra_deg % 360.
+        if abs(dec_deg) + radius_deg >= 90.:
+            ranges = [(0., 360.)]
+        else:
+            half_width = math.degrees(math.asin(min(1., math.sin(math.radians(radius_deg)) /
+                                                    math.cos(math.radians(dec_deg)))))
+            lo, hi = ra_deg - half_width, ra_deg + half_width
+            ranges = [(max(lo, 0.), min(hi, 360.))]
+            if lo < 0.:
+                ranges.append((lo + 360., 360.))
+            if hi > 360.:
+                ranges.append((0., hi - 360.))
+
+        chunks = [catalog_columns([], [], [])]
+        first, last = self.zone_of(max(dec_deg - radius_deg, -90.)), self.zone_of(min(dec_deg + radius_deg, 90.))
+        for zone in range(int(first), int(last) + 1):
+            columns = self.read_zone(zone)
+            if columns is None:
+                continue
+            for lo, hi in ranges:
+                start, stop = np.searchsorted(columns['ra'], [lo, hi], side='left')
+                window = slice(start, stop if hi < 360. else len(columns['ra']))
+                dist = CatalogCache.angular_distance(ra_deg, dec_deg, columns['ra'][window], columns['dec'][window])
+                keep = (dist <= radius_deg) & (columns['mag'][window] < mag_cut)
+                chunks.append({name: np.asarray(values[window][keep]) for name, values in columns.items()})
+
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+
+    Utils.create_directories(Configuration.DIRECTORIES)
+    os.makedirs(sys.argv[1], exist_ok=True)
+    LocalCatalog(sys.argv[1]).ingest(sys.argv[2:])
@@ -3,19 +3,38 @@
 from utils import Utils
 from config import Configuration
 from scripts import Scripts
+from planner import Planner
+from metrics import Metrics
+from prefetch import CatalogPrefetcher
+from session import Session
+import os
 
 # do the necessary prep work such as making the directories
 Utils.create_directories(Configuration.DIRECTORIES)
 
-# search the TIC at the given position for stars
-stars = Scripts.tic_search(Configuration.RA_DEG,
-                           Configuration.DEC_DEG,
-                           Configuration.SEARCH_RADIUS_DEG,
-                           Configuration.MAGNITUDE_CUTOFF)
+# prefetch the catalogs of the night's other fields in the background while this one is set up
+prefetcher = CatalogPrefetcher()
+if os.path.isfile(Configuration.TARGET_LIST_FILE):
+    prefetcher.start(Planner.read_targets(Configuration.TARGET_LIST_FILE))
 
-# generate the figure with the stars and start the position picker to allow the fiber locator
-positions = Scripts.pick_n_plot(stars,
-                                Configuration.OFFSETS,
-                                Configuration.DFPS_PIXEL_SCALE,
-                                Configuration.OTTO_STRUVE_PLATE_SCALE)
+# run the session, under cProfile if profiling is turned on in the configuration
+with Metrics.profile():
+    # search the TIC at the given position for stars
+    stars = Scripts.tic_search(Configuration.RA_DEG,
+                               Configuration.DEC_DEG,
+                               Configuration.SEARCH_RADIUS_DEG,
+                               Configuration.MAGNITUDE_CUTOFF,
+                               prefetcher)
 
+    # pick up where the last session of the field left off, or from the batch plan of the field
+    session = Session.resume(Configuration.FIELD_NAME, Configuration.RA_DEG, Configuration.DEC_DEG)
+
+    # generate the figure with the stars and start the position picker to allow the fiber locator
+    positions = Scripts.pick_n_plot(stars,
+                                    Configuration.OFFSETS,
+                                    Configuration.DFPS_PIXEL_SCALE,
+                                    Configuration.OTTO_STRUVE_PLATE_SCALE,
+                                    session)
+
+# keep the stage timings of the session, so sessions can be compared
+Metrics.write(Configuration.FIELD_NAME)
\ No newline at end of file
@@ -0,0 +1,159 @@
+""" This class holds the timers and counters used to see where the time of a session or a night is spent."""
+import contextlib
+import json
+import os
+import platform
+import threading
+import time
+from config import Configuration
+
+
+class Metrics:
+
+    # the totals of every stage and counter since the last reset, shared by the whole process
+    timers = {}
+    counters = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def add_time(stage, elapsed_s):
+        """ This function will add one timing to a stage.
+
+        :parameter stage - The name of the stage, for example catalog.query.
+        :parameter elapsed_s - The time the stage took in seconds.
+
+        :return - Nothing is returned, but the totals are updated.
+        """
+
+        with Metrics.lock:
+            timer = Metrics.timers.get(stage)
+            if timer is None:
+                Metrics.timers[stage] = {'calls': 1, 'total_s': elapsed_s, 'min_s': elapsed_s, 'max_s': elapsed_s}
+            else:
+                timer['calls'] += 1
+                timer['total_s'] += elapsed_s
+                timer['min_s'] = min(timer['min_s'], elapsed_s)
+                timer['max_s'] = max(timer['max_s'], elapsed_s)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def timer(stage):
+        """ This function will time the block of code inside the with statement.
+
+        :parameter stage - The name of the stage.
+
+        :return - Nothing is returned, but the time is added to the stage, even if the block raises.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            Metrics.add_time(stage, time.perf_counter() - start)
+
+    @staticmethod
+    def count(name, n=1):
+        """ This function will add to a counter, such as the number of cache hits.
+
+        :parameter name - The name of the counter.
+        :parameter n - The amount to add.
+
+        :return - Nothing is returned, but the counter is updated.
+        """
+
+        with Metrics.lock:
+            Metrics.counters[name] = Metrics.counters.get(name, 0) + n
+
+    @staticmethod
+    def snapshot():
+        """ This function will return a copy of the timers and counters, with the mean time of each stage.
+
+        :return metrics - A json friendly dictionary of timers and counters.
+        """
+
+        with Metrics.lock:
+            timers = {stage: dict(timer, mean_s=timer['total_s'] / timer['calls'])
+                      for stage, timer in Metrics.timers.items()}
+            counters = dict(Metrics.counters)
+
+        return {'timers': timers, 'counters': counters}
+
+    @staticmethod
+    def merge(metrics):
+        """ This function will add the timers and counters from another process, such as a batch worker.
+
+        :parameter metrics - A dictionary made by snapshot.
+
+        :return - Nothing is returned, but the totals are updated.
+        """
+
+        with Metrics.lock:
+            for stage, other in metrics['timers'].items():
+                timer = Metrics.timers.get(stage)
+                if timer is None:
+                    Metrics.timers[stage] = {name: other[name] for name in ['calls', 'total_s', 'min_s', 'max_s']}
+                else:
+                    timer['calls'] += other['calls']
+                    timer['total_s'] += other['total_s']
+                    timer['min_s'] = min(timer['min_s'], other['min_s'])
+                    timer['max_s'] = max(timer['max_s'], other['max_s'])
+            for name, n in metrics['counters'].items():
+                Metrics.counters[name] = Metrics.counters.get(name, 0) + n
+
+    @staticmethod
+    def reset():
+        """ This function will clear every timer and counter.
+
+        :return - Nothing is returned.
+        """
+
+        with Metrics.lock:
+            Metrics.timers.clear()
+            Metrics.counters.clear()
+
+    @staticmethod
+    def write(run, output_file=None):
+        """ This function will append the current metrics as one json line, so sessions, nights and deployments can
+        be compared later.
+
+        :parameter run - The name of the run, for example the field name or the target list.
+        :parameter output_file - The json lines file to append to, defaults to the configuration.
+
+        :return metrics - The line written.
+        """
+
+        output_file = output_file if output_file is not None else Configuration.METRICS_FILE
+
+        metrics = dict(Metrics.snapshot(), run=run, time=time.time(), host=platform.node(), pid=os.getpid())
+        with open(output_file, 'a') as f:
+            f.write(json.dumps(metrics) + "\n")
+
+        return metrics
+
+    @staticmethod
+    @contextlib.contextmanager
+    def profile(output_file=None, enabled=None):
+        """ This function will run the block of code inside the with statement under cProfile, if profiling is on.
+
+        :parameter output_file - The file to write the profile to, which can be read with pstats or snakeviz.
+        :parameter enabled - Whether to profile, defaults to the configuration.
+
+        :return - Nothing is returned, but the profile is written when the block finishes.
+        """
+
+        enabled = enabled if enabled is not None else Configuration.PROFILE
+        if not enabled:
+            yield
+            return
+
+        # cProfile is only needed when profiling, so keep it out of the import of the core
+        import cProfile
+
+        output_file = output_file if output_file is not None else Configuration.PROFILE_FILE
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(output_file)
@@ -0,0 +1,316 @@
+""" This class holds the interactive picker used to place the guide cameras and fibers by hand. It is the only
+part of the code which needs matplotlib and a display, so it is only imported when the picker is started."""
+import numpy as np
+from config import Configuration
+from camera_optimizer import CameraOptimizer
+from fiber_assignment import FiberAssigner
+from geometry import Geometry
+from metrics import Metrics
+from session import Session
+from star_index import StarIndex
+from utils import Utils
+import os
+import matplotlib
+# a backend chosen in the environment is kept, such as Agg when the benchmarks draw the picker off screen
+if 'MPLBACKEND' not in os.environ:
+    matplotlib.use('TkAgg')
+import matplotlib.pyplot as plt
+import logging
+logging.getLogger('matplotlib.font_manager').disabled = True
+matplotlib.pyplot.set_loglevel (level = 'warning')
+pil_logger = logging.getLogger('PIL')
+pil_logger.setLevel(logging.INFO)
+
+
+class Picker:
+
+    # the keys which switch between the modes of the picker, and the instructions shown for each mode
+    MODES = {'c': 'camera', 'f': 'fiber', 's': 'star'}
+    KEYS = ['c', 'f', 's', 'a', 'o', '1', '2', '3', '4']
+    INSTRUCTIONS = {'camera': "Camera mode: right click to place camera {active}, 'a' accepts the suggestion",
+                    'fiber': "Fiber mode: right click the guide star in camera {active}",
+                    'star': "Star mode: right click a star for fiber {active}, 'o' moves every fiber"}
+
+    def __init__(self, stars, session):
+        """ The picker keeps one figure open for the whole session. The stars and the telescope field of view are
+        drawn once and cached, everything which changes on a click is an animated artist which is blitted on top.
+
+        :parameter stars - A pandas data frame with the ra, dec, and magnitude of the stars in the field.
+        :parameter session - The session holding the cameras, fibers and moves, which may have been resumed.
+        """
+
+        self.stars = stars
+        self.star_ra = stars.ra.to_numpy()
+        self.star_dec = stars.dec.to_numpy()
+        self.session = session
+        self.mode = 'camera'
+        self.active = 1
+
+        # the picker keys would otherwise also save, zoom or go full screen
+        for keymap in [name for name in plt.rcParams if name.startswith('keymap.')]:
+            plt.rcParams[keymap] = [key for key in plt.rcParams[keymap] if key not in self.KEYS]
+
+        self.fig, self.ax = plt.subplots(figsize=[8, 6])
+        self.background = None
+
+        # the static layer, the stars and telescope are only drawn when the view changes, and only the stars in view
+        # are drawn with the faint ones thinned out, see refine_stars
+        self.star_index = StarIndex(self.star_ra, self.star_dec, stars.mag.to_numpy())
+        self.star_points = self.ax.scatter([], [], marker='*', c='k')
+        self.ax.update_datalim(np.column_stack([self.star_ra, self.star_dec]))
+        fov_mm = Geometry.deg_to_mm(Configuration.OTTO_STRUVE_FIELD_OF_VIEW_DEG)
+        telescope_fov_x, telescope_fov_y = Geometry.boxes(Configuration.RA_DEG, Configuration.DEC_DEG, fov_mm, fov_mm)
+        self.ax.plot(telescope_fov_x, telescope_fov_y, c='g', label='Telescope')
+
+        # overlay the best layout from the optimizer as a suggestion
+        self.suggestion = CameraOptimizer.optimize(stars, Configuration.RA_DEG, Configuration.DEC_DEG, n_best=1)[0]
+        sg_x, sg_y = Geometry.camera_boxes(self.suggestion['center'][0], self.suggestion['center'][1], 1)
+        self.ax.plot(sg_x.T, sg_y.T, c='orange', linestyle='--')
+        self.ax.plot([], [], c='orange', linestyle='--', label='Suggested Cameras')
+
+        # the animated layer, these are only ever updated in place
+        self.camera_lines = [self.ax.plot([], [], c='r', animated=True)[0] for idx in range(4)]
+        self.camera_labels = [self.ax.text(0, 0, 'Guide-' + str(idx + 1), animated=True, visible=False)
+                              for idx in range(4)]
+        self.guide_marker, = self.ax.plot([], [], c='r', marker='.', linestyle='none', animated=True)
+        self.fiber_marker, = self.ax.plot([], [], c='b', marker='o', linestyle='none', animated=True)
+        self.fiber_labels = [self.ax.text(0, 0, 'Fiber-' + str(idx + 1), animated=True, visible=False)
+                             for idx in range(4)]
+        self.move_marker, = self.ax.plot([], [], marker='o', markersize=9, markerfacecolor='none',
+                                         markeredgecolor='gold', linestyle='none', animated=True)
+        self.move_labels = [self.ax.text(0, 0, '', animated=True, visible=False) for idx in range(4)]
+        self.status = self.ax.set_title('', animated=True)
+        self.animated = (self.camera_lines + self.camera_labels + [self.guide_marker, self.fiber_marker] +
+                         self.fiber_labels + [self.move_marker] + self.move_labels + [self.status])
+
+        self.ax.plot([], [], c='r', label='Guide Cameras')
+        self.ax.plot([], [], c='b', marker='o', linestyle='none', label='Fibers')
+        self.ax.legend(loc='upper right')
+        self.ax.set_ylabel('Declination [deg]')
+        self.ax.set_xlabel('Right Ascension [deg]')
+        self.ax.invert_xaxis()
+        self.refine_stars(self.ax)
+        self.update_status()
+        self.update_artists()
+
+        self.ax.callbacks.connect('xlim_changed', self.refine_stars)
+        self.ax.callbacks.connect('ylim_changed', self.refine_stars)
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+        self.fig.canvas.mpl_connect('button_press_event', self.on_click)
+        self.fig.canvas.mpl_connect('key_press_event', self.on_key)
+
+    def refine_stars(self, ax):
+        """ This function will redraw the stars for the current view, so zooming in brings out the faint stars.
+
+        :parameter ax - The axes whose limits changed.
+
+        :return - Nothing is returned, but the stars are updated for the next draw.
+        """
+
+        with Metrics.timer('render.refine_stars'):
+            (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+            extent = ax.get_window_extent()
+            ra, dec, mag = self.star_index.level_of_detail(x0, x1, y0, y1, extent.width, extent.height)
+            self.star_points.set_offsets(np.column_stack([ra, dec]))
+            self.star_points.set_sizes((20 - mag) * 10)
+        Metrics.count('render.stars_drawn', len(ra))
+
+    def on_draw(self, event):
+        """ This function will cache the static layer after a full redraw, such as after a pan or zoom, and put the
+        animated artists back on top of it.
+
+        :parameter event - The matplotlib draw event.
+
+        :return - Nothing is returned, but the background is cached.
+        """
+
+        Metrics.count('render.full_draw')
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        for artist in self.animated:
+            self.ax.draw_artist(artist)
+
+    def blit(self):
+        """ This function will redraw only the animated artists on top of the cached static layer.
+
+        :return - Nothing is returned, but the canvas is updated.
+        """
+
+        if self.background is None:
+            self.fig.canvas.draw_idle()
+            return
+
+        with Metrics.timer('render.blit'):
+            self.fig.canvas.restore_region(self.background)
+            for artist in self.animated:
+                self.ax.draw_artist(artist)
+            self.fig.canvas.blit(self.fig.bbox)
+            self.fig.canvas.flush_events()
+
+    def update_status(self):
+        """ This function will show the current mode and active camera or fiber in the title.
+
+        :return - Nothing is returned, but the title is updated.
+        """
+
+        self.status.set_text(self.INSTRUCTIONS[self.mode].format(active=self.active) +
+                             "\n'c' cameras, 'f' fibers, 's' stars, 1-4 selects")
+
+    def update_artists(self):
+        """ This function will update the animated artists from the session, without drawing them.
+
+        :return - Nothing is returned.
+        """
+
+        session = self.session
+        for idx in range(4):
+            self.camera_lines[idx].set_data(session.camera_x[idx], session.camera_y[idx])
+            self.camera_labels[idx].set_position((session.camera_x[idx][0], session.camera_y[idx][0]))
+            self.camera_labels[idx].set_visible(bool(np.isfinite(session.camera_x[idx][0])))
+
+            self.fiber_labels[idx].set_position((session.fiber_x[idx], session.fiber_y[idx]))
+            self.fiber_labels[idx].set_visible(bool(np.isfinite(session.fiber_x[idx])))
+
+            self.move_labels[idx].set_position((session.move_x[idx], session.move_y[idx]))
+            self.move_labels[idx].set_text('Fiber ' + str(idx + 1) + ' Offset X: ' +
+                                           str(np.around(session.offsets[idx][0], decimals=3)) + "mm Y: " +
+                                           str(np.around(session.offsets[idx][1], decimals=3)) + "mm")
+            self.move_labels[idx].set_visible(bool(np.isfinite(session.move_x[idx])))
+
+        self.guide_marker.set_data(session.guide_x, session.guide_y)
+        self.fiber_marker.set_data(session.fiber_x, session.fiber_y)
+        self.move_marker.set_data(session.move_x, session.move_y)
+
+    def place_cameras(self, x, y, cam):
+        """ This function will place all four guide cameras from the position of one of them.
+
+        :parameter x, y - The sky position of the camera in degrees.
+        :parameter cam - The camera (1-4) placed at x, y.
+
+        :return - Nothing is returned, but the cameras are drawn and stored in the session.
+        """
+
+        self.session.set_cameras(*Geometry.camera_boxes(x, y, cam))
+        self.update_artists()
+
+    def place_fiber(self, x, y, cam):
+        """ This function will place a fiber from the position of the guide star in its camera.
+
+        :parameter x, y - The sky position of the guide star in degrees.
+        :parameter cam - The camera (1-4) the guide star is in.
+
+        :return - Nothing is returned, but the fiber is drawn and stored in the session.
+        """
+
+        fiber_x, fiber_y = Geometry.fiber_positions(x, y, cam)
+        self.session.set_fiber(cam, x, y, fiber_x, fiber_y)
+        self.update_artists()
+
+    def move_fiber(self, fiber, x, y):
+        """ This function will move a fiber to a star and show the offset in mm.
+
+        :parameter fiber - The fiber (1-4) to move.
+        :parameter x, y - The sky position of the star in degrees.
+
+        :return - Nothing is returned, but the move is drawn and stored in the session.
+        """
+
+        idx = fiber - 1
+        if np.isnan(self.session.fiber_x[idx]):
+            Utils.log("Fiber " + str(fiber) + " has not been placed yet, place it in fiber mode first.", "warning")
+            return
+
+        offset_x, offset_y = Geometry.sky_to_focal(x, y, self.session.fiber_x[idx], self.session.fiber_y[idx])
+        self.session.set_move(fiber, x, y, offset_x, offset_y)
+        self.update_artists()
+
+    def move_all_fibers(self):
+        """ This function will move every placed fiber with the least total movement.
+
+        :return - Nothing is returned, but the moves are drawn.
+        """
+
+        placed = np.flatnonzero(np.isfinite(self.session.fiber_x))
+        if len(placed) == 0:
+            Utils.log("No fibers have been placed yet, place them in fiber mode first.", "warning")
+            return
+
+        travel_limits = np.asarray(Configuration.FIBER_TRAVEL_LIMITS_MM)[placed]
+        targets, offset_x, offset_y, total = FiberAssigner.assign(self.session.fiber_x[placed],
+                                                                  self.session.fiber_y[placed],
+                                                                  self.star_ra, self.star_dec, travel_limits)
+        for idx, target in zip(placed, targets):
+            if target >= 0:
+                self.move_fiber(idx + 1, self.star_ra[target], self.star_dec[target])
+            else:
+                Utils.log("Fiber " + str(idx + 1) + " cannot reach a star within its travel limit.", "warning")
+
+    def on_click(self, event):
+        """ This function will handle a right click for the current mode.
+
+        :parameter event - The matplotlib mouse event.
+
+        :return - Nothing is returned, but the picker is updated.
+        """
+
+        if event.button != 3 or event.inaxes is not self.ax:
+            return
+
+        with Metrics.timer('click.' + self.mode):
+            if self.mode == 'camera':
+                self.place_cameras(event.xdata, event.ydata, self.active)
+            elif self.mode == 'fiber':
+                self.place_fiber(event.xdata, event.ydata, self.active)
+            else:
+                self.move_fiber(self.active, event.xdata, event.ydata)
+
+            self.blit()
+
+    def on_key(self, event):
+        """ This function will handle the keys which change the mode, select a camera or fiber, accept the suggested
+        cameras and move every fiber.
+
+        :parameter event - The matplotlib key event.
+
+        :return - Nothing is returned, but the picker is updated.
+        """
+
+        if event.key in self.MODES:
+            self.mode = self.MODES[event.key]
+            self.session.flush()
+        elif event.key in ('1', '2', '3', '4'):
+            self.active = int(event.key)
+        elif event.key == 'a' and self.mode == 'camera':
+            self.place_cameras(self.suggestion['center'][0], self.suggestion['center'][1], 1)
+        elif event.key == 'o' and self.mode == 'star':
+            self.move_all_fibers()
+        else:
+            return
+
+        self.update_status()
+        self.blit()
+
+    @staticmethod
+    def pick_n_plot(stars, offsets, pixel_size, plate_scale, session=None):
+        """ This function will allow you to plot the searched stars on an x/y plot, place the guide cameras,
+        automatically place the fibers, place desired locations, and then return an offset.
+
+        :parameter stars - A pandas data frame with the ra, dec, and magnitude of the stars in the field.
+        :parameter offsets - A numpy array with the offsets between the guide cameras and the sensors.
+        :parameter pixel_size - The pixel size of the guide cameras.
+        :parameter plate_scale - The plate scale of the telescope to convert between image and sky.
+        :parameter session - The session to work in, by default the latest session of the field is resumed.
+
+        :return movements - A (4, 2) np.array with the offset of each fiber in mm, nan for fibers not moved. The
+        session is saved to the plan store.
+        """
+
+        if session is None:
+            session = Session.resume(Configuration.FIELD_NAME, Configuration.RA_DEG, Configuration.DEC_DEG)
+
+        with Metrics.timer('render.setup'):
+            picker = Picker(stars, session)
+        plt.show()
+        plt.close(picker.fig)
+        session.flush()
+
+        return session.offsets
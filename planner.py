@@ -0,0 +1,215 @@
+""" This class holds the headless planner which places the guide cameras and fibers for a list of fields."""
+import csv
+import json
+import os
+import time
+import numpy as np
+from config import Configuration
+from camera_optimizer import CameraOptimizer
+from catalog_cache import CatalogCache
+from fiber_assignment import FiberAssigner
+from geometry import Geometry
+from metrics import Metrics
+from session import PlanStore, Session
+from utils import Utils
+
+
+class Planner:
+
+    @staticmethod
+    def read_targets(target_file):
+        """ This function will read a target list for the night.
+
+        :parameter target_file - A csv file with a header of name, ra, dec and optionally mag_cut and date.
+
+        :return targets - A list of dictionaries with the name, ra, dec, mag_cut and date (None for the configured
+        night) of each field.
+        """
+
+        targets = []
+        with open(target_file, 'r', newline='') as f:
+            for row in csv.DictReader(f):
+                mag_cut = row.get('mag_cut') or Configuration.MAGNITUDE_CUTOFF
+                targets.append({'name': row['name'].strip(),
+                                'ra': float(row['ra']),
+                                'dec': float(row['dec']),
+                                'mag_cut': float(mag_cut),
+                                'date': (row.get('date') or '').strip() or None})
+
+        return targets
+
+    @staticmethod
+    def place_cameras(stars, ra_deg, dec_deg, cam_dist=None, plate_scale=None):
+        """ This function will place the four guide cameras at the best layout found by the optimizer.
+
+        :parameter stars - A dictionary of ra, dec and mag arrays.
+        :parameter ra_deg - The right ascension of the field in degrees.
+        :parameter dec_deg - The declination of the field in degrees.
+        :parameter cam_dist - The distance between neighbouring cameras in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+
+        :return cameras - A list with the box, number of stars, number of guide stars and brightest guide star of
+        each camera, counted exactly in the box rather than taken from the optimizer's binned counts.
+        """
+
+        best = CameraOptimizer.optimize(stars, ra_deg, dec_deg, n_best=1, cam_dist=cam_dist,
+                                        plate_scale=plate_scale)[0]
+        cen_x, cen_y = Geometry.camera_centers(best['center'][0], best['center'][1], 1, cam_dist, plate_scale)
+        box_x, box_y = Geometry.boxes(cen_x, cen_y, Configuration.DFPS_GUIDE_CAMERA_SIZE_X_MM,
+                                      Configuration.DFPS_GUIDE_CAMERA_SIZE_Y_MM, plate_scale)
+
+        # project the stars about each camera center to find the ones inside each camera, (4, M)
+        star_x, star_y = Geometry.sky_to_focal(stars['ra'], stars['dec'], cen_x[:, None], cen_y[:, None],
+                                               plate_scale)
+        in_boxes = ((np.abs(star_x) <= Configuration.DFPS_GUIDE_CAMERA_SIZE_X_MM / 2.) &
+                    (np.abs(star_y) <= Configuration.DFPS_GUIDE_CAMERA_SIZE_Y_MM / 2.))
+        guide = np.asarray(stars['mag']) < Configuration.GUIDE_STAR_MAG_LIMIT
+
+        cameras = []
+        for idx in range(0, 4):
+            in_box = np.flatnonzero(in_boxes[idx])
+
+            guide_star = None
+            if len(in_box) > 0:
+                brightest = in_box[np.argmin(stars['mag'][in_box])]
+                guide_star = {'ra': float(stars['ra'][brightest]),
+                              'dec': float(stars['dec'][brightest]),
+                              'mag': float(stars['mag'][brightest])}
+
+            cameras.append({'camera': idx + 1,
+                            'center': [float(cen_x[idx]), float(cen_y[idx])],
+                            'box_x': box_x[idx].tolist(),
+                            'box_y': box_y[idx].tolist(),
+                            'n_stars': int(len(in_box)),
+                            'n_guide_stars': int(np.sum(in_boxes[idx] & guide)),
+                            'guide_star': guide_star})
+
+        return cameras
+
+    @staticmethod
+    def place_fibers(stars, cameras):
+        """ This function will place the fibers from the guide star in each camera, the same way on_click_fibers
+        does, then move the fibers onto the other stars with the least total movement.
+
+        :parameter stars - A dictionary of ra, dec and mag arrays.
+        :parameter cameras - The camera list from place_cameras.
+
+        :return fibers - A list with the position, target star and offset in mm of each fiber.
+        """
+
+        fib_x = np.zeros(len(cameras))
+        fib_y = np.zeros(len(cameras))
+        candidates = np.ones(len(stars['ra']), dtype=bool)
+        for idx, camera in enumerate(cameras):
+            # without a guide star the fiber is placed relative to the camera center
+            if camera['guide_star'] is not None:
+                x, y = camera['guide_star']['ra'], camera['guide_star']['dec']
+                candidates &= (stars['ra'] != x) | (stars['dec'] != y)
+            else:
+                x, y = camera['center']
+
+            fib_x[idx], fib_y[idx] = Geometry.fiber_positions(x, y, idx + 1)
+
+        # the guide stars are never used as targets
+        candidates = np.flatnonzero(candidates)
+        targets, offset_x, offset_y, total = FiberAssigner.assign(fib_x, fib_y,
+                                                                  stars['ra'][candidates], stars['dec'][candidates])
+
+        fibers = []
+        for idx in range(len(cameras)):
+            fiber = {'fiber': idx + 1, 'position': [float(fib_x[idx]), float(fib_y[idx])],
+                     'target': None, 'offset_mm': None}
+            if targets[idx] >= 0:
+                star = candidates[targets[idx]]
+                fiber['target'] = {'ra': float(stars['ra'][star]),
+                                   'dec': float(stars['dec'][star]),
+                                   'mag': float(stars['mag'][star])}
+                fiber['offset_mm'] = [float(offset_x[idx]), float(offset_y[idx])]
+            fibers.append(fiber)
+
+        return fibers
+
+    @staticmethod
+    def plan_field(target):
+        """ This function will plan a single field without any interaction.
+
+        :parameter target - A dictionary with the name, ra, dec and mag_cut of the field.
+
+        :return record - A dictionary with the camera placement and fiber offsets for the field.
+        """
+
+        start = time.time()
+        with Metrics.timer('catalog.cone_search'):
+            stars = CatalogCache().cone_search_epoch(target['ra'], target['dec'], Configuration.SEARCH_RADIUS_DEG,
+                                                     target['mag_cut'], target.get('date'))
+
+        with Metrics.timer('plan.cameras'):
+            cameras = Planner.place_cameras(stars, target['ra'], target['dec'])
+        with Metrics.timer('plan.fibers'):
+            fibers = Planner.place_fibers(stars, cameras)
+
+        return {'name': target['name'],
+                'ra': target['ra'],
+                'dec': target['dec'],
+                'mag_cut': target['mag_cut'],
+                'date': Geometry.observation_date(target.get('date')),
+                'n_stars': int(len(stars['ra'])),
+                'cameras': cameras,
+                'fibers': fibers,
+                'elapsed_s': time.time() - start}
+
+    @staticmethod
+    def plan_field_metrics(target):
+        """ This function will plan a single field in a batch worker and return the worker's metrics with it, as the
+        timers of another process are not otherwise seen.
+
+        :parameter target - A dictionary with the name, ra, dec and mag_cut of the field.
+
+        :return record, metrics - The record from plan_field and the metrics of planning it.
+        """
+
+        Metrics.reset()
+        record = Planner.plan_field(target)
+
+        return record, Metrics.snapshot()
+
+    @staticmethod
+    def plan_night(targets, output_file, workers=None):
+        """ This function will plan every field in the target list in parallel and write one record per field.
+
+        :parameter targets - A list of target dictionaries from read_targets.
+        :parameter output_file - The json lines file to write the records to.
+        :parameter workers - The number of processes to use, defaults to the configuration.
+
+        :return records - The list of records written to the output file, the fields which were planned are also
+        saved to the plan store so they can be opened in the picker.
+        """
+
+        # the process pool is only needed for batch runs, so keep it out of the import of the planner
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = workers if workers is not None else Configuration.BATCH_WORKERS
+
+        records = []
+        with ProcessPoolExecutor(max_workers=workers) as pool, open(output_file, 'w') as f:
+            for target, future in [(target, pool.submit(Planner.plan_field_metrics, target)) for target in targets]:
+                try:
+                    record, metrics = future.result()
+                    Metrics.merge(metrics)
+                except Exception as error:
+                    # one bad field should not stop the rest of the night
+                    Utils.log("Planning failed for field " + target['name'] + ": " + str(error), "error")
+                    record = dict(target, error=str(error))
+                    Metrics.count('plan.failed')
+                f.write(json.dumps(record) + "\n")
+                records.append(record)
+
+        # every planned field goes into the plan store in one transaction
+        store = PlanStore()
+        store.save_many([Session.from_record(record).to_dict() for record in records if 'error' not in record],
+                        'batch')
+        store.close()
+
+        Utils.log("Planned " + str(len(records)) + " fields, written to " + os.path.basename(output_file) + ".", "info")
+
+        return records
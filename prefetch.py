@@ -0,0 +1,145 @@
+""" This class holds the prefetcher which fills the catalog cache for upcoming fields in the background."""
+import asyncio
+import threading
+from config import Configuration
+from catalog_cache import CatalogCache
+from geometry import Geometry
+from utils import Utils
+
+
+class CatalogPrefetcher:
+
+    def __init__(self, cache=None, concurrency=None, wait_s=None, retries=None):
+        """ The prefetcher queries the catalog for a list of targets with a bounded number of queries in flight,
+        stores the tiles in the catalog cache and keeps each field's stars in memory. The catalog backends time out
+        their own requests (CATALOG_TIMEOUT_S), as a search running on a thread cannot be stopped from outside.
+
+        :parameter cache - The catalog cache to fill, its backend is used for the queries.
+        :parameter concurrency - The number of fields to query at once.
+        :parameter wait_s - The longest to wait for one field in seconds, over all of its attempts.
+        :parameter retries - The number of times to start the search of a field which failed or timed out.
+        """
+
+        self.cache = cache if cache is not None else CatalogCache()
+        self.concurrency = concurrency if concurrency is not None else Configuration.PREFETCH_CONCURRENCY
+        self.wait_s = wait_s if wait_s is not None else Configuration.PREFETCH_WAIT_S
+        self.retries = retries if retries is not None else Configuration.PREFETCH_RETRIES
+        self.catalogs = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def field_key(ra_deg, dec_deg, radius_deg, mag_cut, date=None):
+        """ This function will return the key a field's catalog is kept under, so a changed query is never reused.
+
+        :parameter ra_deg, dec_deg - The center of the field in degrees.
+        :parameter radius_deg - The radius of the search area.
+        :parameter mag_cut - The magnitude cutoff for the field.
+        :parameter date - The night the catalog is propagated to, defaults to the configuration or today (UTC).
+
+        :return The key as a tuple.
+        """
+
+        return (round(ra_deg, 7), round(dec_deg, 7), round(radius_deg, 7), round(mag_cut, 3),
+                Geometry.observation_date(date))
+
+    def get(self, ra_deg, dec_deg, radius_deg, mag_cut, date=None):
+        """ This function will return a prefetched catalog if one is in memory.
+
+        :parameter ra_deg, dec_deg - The center of the field in degrees.
+        :parameter radius_deg - The radius of the search area.
+        :parameter mag_cut - The magnitude cutoff for the field.
+        :parameter date - The night the catalog is propagated to, defaults to the configuration or today (UTC).
+
+        :return columns - A dictionary of the catalog columns on the night observed, or None if the field was not
+        prefetched.
+        """
+
+        with self.lock:
+            return self.catalogs.get(self.field_key(ra_deg, dec_deg, radius_deg, mag_cut, date))
+
+    async def fetch(self, target, semaphore, pool):
+        """ This function will fetch the catalog of one target, starting the search again with a back off if it
+        fails, for example when a backend request times out. A search still running when the wait runs out is left
+        to finish in the background, its tiles still land in the cache.
+
+        :parameter target - A dictionary with the name, ra, dec, mag_cut and optionally date of the field.
+        :parameter semaphore - The semaphore bounding the number of queries in flight.
+        :parameter pool - The thread pool the blocking searches run on.
+
+        :return columns - A dictionary of the catalog columns, or None if every attempt failed.
+        """
+
+        loop = asyncio.get_running_loop()
+        key = self.field_key(target['ra'], target['dec'], Configuration.SEARCH_RADIUS_DEG, target['mag_cut'],
+                             target.get('date'))
+
+        async with semaphore:
+            deadline = loop.time() + self.wait_s
+            for attempt in range(1, self.retries + 1):
+                future = loop.run_in_executor(pool, self.cache.cone_search_epoch, target['ra'], target['dec'],
+                                              Configuration.SEARCH_RADIUS_DEG, target['mag_cut'], target.get('date'))
+                try:
+                    columns = await asyncio.wait_for(asyncio.shield(future), timeout=max(deadline - loop.time(), 0.))
+                except Exception as error:
+                    # a backend request which timed out has finished the search, only the wait here leaves it running
+                    if not future.done():
+                        Utils.log("Stopped waiting for field " + target['name'] + " after " + str(self.wait_s) +
+                                  " s, its search carries on in the background.", "warning")
+                        break
+                    Utils.log("Prefetch of field " + target['name'] + " failed on attempt " + str(attempt) + ": " +
+                              (str(error) or type(error).__name__), "warning")
+                    if attempt < self.retries:
+                        await asyncio.sleep(min(2 ** (attempt - 1), max(deadline - loop.time(), 0.)))
+                    continue
+
+                with self.lock:
+                    self.catalogs[key] = columns
+                Utils.log("Prefetched " + str(len(columns['ra'])) + " stars for field " + target['name'] + ".", "info")
+                return columns
+
+        Utils.log("Giving up on prefetching field " + target['name'] + ".", "error")
+
+        return None
+
+    async def prefetch(self, targets):
+        """ This function will fetch the catalogs of every target with a bounded number of queries in flight.
+
+        :parameter targets - A list of target dictionaries, such as the one from Planner.read_targets.
+
+        :return results - A list with the columns of each target, or None for targets which failed.
+        """
+
+        # the thread pool is only needed while prefetching, so keep it out of the import of the core
+        from concurrent.futures import ThreadPoolExecutor
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='catalog-prefetch')
+        try:
+            return await asyncio.gather(*[self.fetch(target, semaphore, pool) for target in targets])
+        finally:
+            # a search given up on finishes in the background, its tiles still land in the cache
+            pool.shutdown(wait=False)
+
+    def run(self, targets):
+        """ This function will prefetch every target and wait for them to finish.
+
+        :parameter targets - A list of target dictionaries.
+
+        :return results - A list with the columns of each target, or None for targets which failed.
+        """
+
+        return asyncio.run(self.prefetch(targets))
+
+    def start(self, targets):
+        """ This function will prefetch the targets in a background thread, so the session can carry on while the
+        upcoming fields are queried.
+
+        :parameter targets - A list of target dictionaries.
+
+        :return thread - The daemon thread running the prefetch.
+        """
+
+        thread = threading.Thread(target=self.run, args=(targets,), name='catalog-prefetch', daemon=True)
+        thread.start()
+
+        return thread
@@ -0,0 +1,443 @@
+""" This class holds the sky service, one long running process which keeps field catalogs, camera solutions and plans
+warm in memory and answers requests from any number of operator consoles and scripts. Start it with:
+python service.py [port]
+Requests are one json object per line over TCP, such as {"id": 1, "op": "cone_search", "ra": 348.49, "dec": 8.76},
+and each is answered with one line of {"id": 1, "ok": true, "result": ...} or {"id": 1, "ok": false, "error": ...}."""
+import asyncio
+import collections
+import json
+import socket
+import sys
+import threading
+import numpy as np
+from config import Configuration
+from catalog_cache import CatalogCache
+from geometry import Geometry
+from metrics import Metrics
+from prefetch import CatalogPrefetcher
+from utils import Utils
+
+
+class LruCache:
+
+    def __init__(self, name, max_items):
+        """ The cache keeps at most max_items values, dropping the least recently used one when it is full.
+
+        :parameter name - The name the hits and misses are counted under.
+        :parameter max_items - The most values kept.
+        """
+
+        self.name = name
+        self.max_items = max_items
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ This function will return a cached value and mark it as recently used.
+
+        :parameter key - The key of the value.
+
+        :return value - The value, or None if it is not cached.
+        """
+
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+        Metrics.count('service.' + self.name + ('_hit' if value is not None else '_miss'))
+
+        return value
+
+    def put(self, key, value):
+        """ This function will cache a value, dropping the least recently used values over the limit.
+
+        :parameter key - The key of the value.
+        :parameter value - The value.
+
+        :return - Nothing is returned.
+        """
+
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class SkyService:
+
+    # the fields each operation needs in its request, the others have defaults
+    REQUIRED = {'cone_search': ['ra', 'dec'],
+                'optimize': ['ra', 'dec'],
+                'plan': ['ra', 'dec'],
+                'fiber_offsets': ['ra', 'dec'],
+                'correct_offsets': ['ra', 'dec', 'measurements'],
+                'stats': []}
+
+    def __init__(self, cache=None, workers=None):
+        """ The service answers requests on the event loop and runs the numerical work on a pool of threads, so
+        several consoles are served at once. Requests for a field being loaded, or a plan being made, wait for that
+        work rather than starting their own.
+
+        :parameter cache - The catalog cache to search, its backend is used for fields not on disk.
+        :parameter workers - The number of threads doing the numerical work, defaults to the configuration.
+        """
+
+        # the thread pool is only needed by the service, so keep it out of the import of the core
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.cache = cache if cache is not None else CatalogCache()
+        self.pool = ThreadPoolExecutor(max_workers=workers if workers is not None else Configuration.SERVICE_WORKERS)
+        self.fields = LruCache('fields', Configuration.SERVICE_MAX_FIELDS)
+        self.plans = LruCache('plans', Configuration.SERVICE_MAX_PLANS)
+        self.solvers = LruCache('solvers', Configuration.SERVICE_MAX_SOLVERS)
+        self.loading = {}
+        self.planning = {}
+        self.ops = {'cone_search': self.cone_search,
+                    'optimize': self.optimize,
+                    'plan': self.plan,
+                    'fiber_offsets': self.fiber_offsets,
+                    'correct_offsets': self.correct_offsets,
+                    'stats': self.stats}
+
+    async def run(self, function, *args):
+        """ This function will run blocking work on the thread pool.
+
+        :parameter function - The function to run.
+        :parameter args - Its arguments.
+
+        :return The result of the function.
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(self.pool, function, *args)
+
+    @staticmethod
+    def field_request(request):
+        """ This function will read the field of a request, filling in the configured defaults.
+
+        :parameter request - The request dictionary with ra and dec, and optionally mag_cut and date.
+
+        :return target - A dictionary with the ra, dec, mag_cut and date of the field.
+        """
+
+        return {'name': request.get('name', 'service'),
+                'ra': float(request['ra']),
+                'dec': float(request['dec']),
+                'mag_cut': float(request.get('mag_cut', Configuration.MAGNITUDE_CUTOFF)),
+                'date': Geometry.observation_date(request.get('date'))}
+
+    async def field_stars(self, target):
+        """ This function will return the stars of a field on the night observed, from memory when it can.
+
+        :parameter target - The field from field_request.
+
+        :return stars - A dictionary of the catalog columns.
+        """
+
+        key = CatalogPrefetcher.field_key(target['ra'], target['dec'], Configuration.SEARCH_RADIUS_DEG,
+                                          target['mag_cut'], target['date'])
+        stars = self.fields.get(key)
+        if stars is not None:
+            return stars
+
+        # a field already being loaded for another console is waited on rather than loaded twice
+        if key not in self.loading:
+            self.loading[key] = asyncio.ensure_future(self.run(self.cache.cone_search_epoch, target['ra'],
+                                                               target['dec'], Configuration.SEARCH_RADIUS_DEG,
+                                                               target['mag_cut'], target['date']))
+        try:
+            stars = await asyncio.shield(self.loading[key])
+        finally:
+            self.loading.pop(key, None)
+        self.fields.put(key, stars)
+
+        return stars
+
+    async def cone_search(self, request):
+        """ This function will return the stars of a field.
+
+        :parameter request - The field, as read by field_request.
+
+        :return result - A dictionary of ra, dec and mag lists.
+        """
+
+        stars = await self.field_stars(self.field_request(request))
+
+        return {name: stars[name].tolist() for name in ['ra', 'dec', 'mag']}
+
+    async def optimize(self, request):
+        """ This function will return the best guide camera layouts of a field.
+
+        :parameter request - The field, and optionally n_best, the number of layouts to return.
+
+        :return layouts - The layouts from CameraOptimizer.optimize.
+        """
+
+        # the optimizer pulls in the camera geometry, which the service only needs once it is asked for
+        from camera_optimizer import CameraOptimizer
+
+        target = self.field_request(request)
+        stars = await self.field_stars(target)
+
+        return await self.run(CameraOptimizer.optimize, stars, target['ra'], target['dec'],
+                              int(request.get('n_best', 5)))
+
+    async def plan(self, request):
+        """ This function will plan a field, placing the cameras and moving the fibers, as the batch planner does.
+
+        :parameter request - The field, as read by field_request.
+
+        :return plan - A dictionary with the cameras and fibers of the field.
+        """
+
+        target = self.field_request(request)
+        key = (target['ra'], target['dec'], target['mag_cut'], target['date'])
+        plan = self.plans.get(key)
+        if plan is not None:
+            return plan
+
+        # a plan already being made for another console is waited on rather than made twice
+        if key not in self.planning:
+            self.planning[key] = asyncio.ensure_future(self.make_plan(target))
+        try:
+            plan = await asyncio.shield(self.planning[key])
+        finally:
+            self.planning.pop(key, None)
+        self.plans.put(key, plan)
+
+        return plan
+
+    async def make_plan(self, target):
+        """ This function will place the cameras and move the fibers of a field.
+
+        :parameter target - The field from field_request.
+
+        :return plan - A dictionary with the cameras and fibers of the field.
+        """
+
+        from planner import Planner
+
+        stars = await self.field_stars(target)
+
+        def place():
+            cameras = Planner.place_cameras(stars, target['ra'], target['dec'])
+            return {'cameras': cameras, 'fibers': Planner.place_fibers(stars, cameras)}
+
+        with Metrics.timer('service.plan'):
+            return dict(await self.run(place), date=target['date'], n_stars=int(len(stars['ra'])))
+
+    async def fiber_offsets(self, request):
+        """ This function will return the move of each fiber of a field.
+
+        :parameter request - The field, as read by field_request.
+
+        :return offsets - A list with the [x, y] move of each fiber in mm, None for fibers without a target.
+        """
+
+        plan = await self.plan(request)
+
+        return [fiber['offset_mm'] for fiber in plan['fibers']]
+
+    async def correct_offsets(self, request):
+        """ This function will solve the pointing from the stars measured on the guide cameras, and correct the fiber
+        moves of the field's plan for it.
+
+        :parameter request - The field, and measurements, a list of {camera, x_mm, y_mm} from the frame stream.
+
+        :return result - The pointing solution and the corrected [x, y] move of each fiber in mm.
+        """
+
+        from astrometry import Astrometry
+
+        target = self.field_request(request)
+        plan = await self.plan(request)
+        center = plan['cameras'][0]['center']
+
+        # the solver of a field is built once and kept, each frame set is then only a few tree queries
+        key = (target['ra'], target['dec'], target['mag_cut'], target['date'])
+        solver = self.solvers.get(key)
+        if solver is None:
+            stars = await self.field_stars(target)
+            solver = await self.run(Astrometry, stars, center[0], center[1])
+            self.solvers.put(key, solver)
+
+        fibers = plan['fibers']
+        target_ra = np.array([np.nan if fiber['target'] is None else fiber['target']['ra'] for fiber in fibers])
+        target_dec = np.array([np.nan if fiber['target'] is None else fiber['target']['dec'] for fiber in fibers])
+        offsets = np.array([[np.nan, np.nan] if fiber['offset_mm'] is None else fiber['offset_mm']
+                            for fiber in fibers])
+
+        def solve():
+            solution = solver.solve(request['measurements'])
+            return solution, solver.corrected_offsets(solution, target_ra, target_dec, offsets)
+
+        solution, corrected = await self.run(solve)
+
+        return {'solved': solution['solved'],
+                'pointing_arcsec': solution['pointing_arcsec'],
+                'rotation_deg': solution['rotation_deg'],
+                'n_matched': solution['n_matched'],
+                'rms_mm': solution['rms_mm'],
+                'offsets_mm': np.where(np.isnan(corrected), None, corrected).tolist()}
+
+    async def stats(self, request):
+        """ This function will return the metrics of the service and the size of its caches.
+
+        :parameter request - Not used.
+
+        :return stats - A dictionary of the timers, counters and cache sizes.
+        """
+
+        return dict(Metrics.snapshot(), fields=len(self.fields), plans=len(self.plans), solvers=len(self.solvers))
+
+    async def handle(self, request):
+        """ This function will answer one request.
+
+        :parameter request - The decoded request, which should be a dictionary with the name of the operation in op.
+
+        :return response - The response dictionary.
+        """
+
+        if not isinstance(request, dict):
+            return {'id': None, 'ok': False, 'error': "A request must be a json object, not " +
+                    type(request).__name__ + "."}
+
+        response = {'id': request.get('id')}
+        op = self.ops.get(request.get('op')) if isinstance(request.get('op'), str) else None
+        if op is None:
+            return dict(response, ok=False, error="Unknown op " + str(request.get('op')) + ", expected one of " +
+                        ', '.join(self.ops) + ".")
+
+        missing = [name for name in self.REQUIRED[request['op']] if name not in request]
+        if missing:
+            return dict(response, ok=False, error="The " + request['op'] + " request is missing " +
+                        ', '.join(missing) + ".")
+
+        try:
+            with Metrics.timer('service.' + request['op']):
+                result = await op(request)
+        except Exception as error:
+            # a bad request only fails itself, the service keeps answering the others
+            Utils.log("Service request " + request['op'] + " failed: " + str(error), "error")
+            return dict(response, ok=False, error=str(error))
+
+        return dict(response, ok=True, result=result)
+
+    async def serve_client(self, reader, writer):
+        """ This function will answer the requests of one connection in order, until it is closed.
+
+        :parameter reader, writer - The asyncio streams of the connection.
+
+        :return - Nothing is returned.
+        """
+
+        skipping = False
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as error:
+                    # the connection was closed, perhaps after a last request without a newline
+                    line = error.partial
+                except asyncio.LimitOverrunError as error:
+                    # drop what has arrived of a request over the limit and skip the rest of it, so the answers stay
+                    # in step with the requests
+                    await reader.readexactly(error.consumed)
+                    if not skipping:
+                        response = {'id': None, 'ok': False, 'error': "The request is longer than " +
+                                    str(Configuration.SERVICE_MAX_REQUEST) + " bytes."}
+                        writer.write((json.dumps(response) + "\n").encode())
+                        await writer.drain()
+                    skipping = True
+                    continue
+
+                if not line:
+                    break
+                if skipping:
+                    skipping = False
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    response = {'id': None, 'ok': False, 'error': "Bad json: " + str(error)}
+                else:
+                    response = await self.handle(request)
+                writer.write((json.dumps(response, default=SkyService.to_json) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def to_json(value):
+        """ This function will convert the numpy values in a response to json.
+
+        :parameter value - A numpy array or scalar.
+
+        :return A list or python number.
+        """
+
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+
+        raise TypeError("Cannot send " + type(value).__name__ + " as json.")
+
+    async def serve(self, host=None, port=None):
+        """ This function will answer requests until the process is stopped.
+
+        :parameter host - The address to listen on, defaults to the configuration (this machine only).
+        :parameter port - The port to listen on, defaults to the configuration.
+
+        :return - Nothing is returned.
+        """
+
+        host = host if host is not None else Configuration.SERVICE_HOST
+        port = port if port is not None else Configuration.SERVICE_PORT
+
+        server = await asyncio.start_server(self.serve_client, host, port, limit=Configuration.SERVICE_MAX_REQUEST)
+        Utils.log("Sky service listening on " + host + ":" + str(port) + ".", "info")
+        async with server:
+            await server.serve_forever()
+
+    @staticmethod
+    def request(op, host=None, port=None, timeout=None, **parameters):
+        """ This function will send one request to a running service and wait for the answer, for scripts which do
+        not run an event loop.
+
+        :parameter op - The operation, such as cone_search or plan.
+        :parameter host, port - The address of the service, defaults to the configuration.
+        :parameter timeout - The time to wait for the answer in seconds.
+        :parameter parameters - The parameters of the request, such as ra, dec and mag_cut.
+
+        :return result - The result of the request, an error from the service is raised as a RuntimeError.
+        """
+
+        host = host if host is not None else Configuration.SERVICE_HOST
+        port = port if port is not None else Configuration.SERVICE_PORT
+        timeout = timeout if timeout is not None else Configuration.CATALOG_TIMEOUT_S
+
+        with socket.create_connection((host, port), timeout=timeout) as connection:
+            connection.sendall((json.dumps(dict(parameters, op=op), default=SkyService.to_json) + "\n").encode())
+            with connection.makefile('rb') as answer:
+                response = json.loads(answer.readline())
+
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+
+        return response['result']
+
+
+if __name__ == '__main__':
+    Utils.create_directories(Configuration.DIRECTORIES)
+    service_port = int(sys.argv[1]) if len(sys.argv) > 1 else Configuration.SERVICE_PORT
+
+    try:
+        asyncio.run(SkyService().serve(port=service_port))
+    except KeyboardInterrupt:
+        Metrics.write('sky service')
@@ -0,0 +1,310 @@
+""" This file holds the session state of a field and the plan store which keeps every field's plans in one place."""
+import json
+import sqlite3
+import time
+import numpy as np
+from config import Configuration
+
+
+class PlanStore:
+
+    def __init__(self, path=None):
+        """ The plan store is a single SQLite database. Every save of a field is kept as a new version, so the full
+        history of a field is available and the latest plan of any number of fields can be read in one query.
+
+        :parameter path - The database file, defaults to the configuration.
+        """
+
+        self.path = path if path is not None else Configuration.PLAN_STORE_FILE
+        self.connection = sqlite3.connect(self.path, timeout=30)
+
+        # write ahead logging lets batch workers and the picker read while another process writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS plans (field TEXT NOT NULL, version INTEGER NOT NULL, "
+                                "created REAL NOT NULL, source TEXT NOT NULL, state TEXT NOT NULL, "
+                                "PRIMARY KEY (field, version))")
+        self.connection.commit()
+
+    def save_many(self, states, source):
+        """ This function will save the state of several fields as one atomic transaction.
+
+        :parameter states - A list of session state dictionaries, each with a field name.
+        :parameter source - Where the plans came from, for example picker or batch.
+
+        :return versions - The version saved for each field.
+        """
+
+        versions = []
+        now = time.time()
+        with self.connection:
+            # take the write lock before reading the versions, so two writers can not pick the same version
+            self.connection.execute("BEGIN IMMEDIATE")
+            for state in states:
+                version = self.connection.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM plans WHERE field = ?",
+                                                  (state['field'],)).fetchone()[0]
+                self.connection.execute("INSERT INTO plans VALUES (?, ?, ?, ?, ?)",
+                                        (state['field'], version, now, source, json.dumps(state)))
+                versions.append(version)
+
+        return versions
+
+    def save(self, state, source):
+        """ This function will save the state of one field as a new version.
+
+        :parameter state - A session state dictionary.
+        :parameter source - Where the plan came from, for example picker or batch.
+
+        :return version - The version saved.
+        """
+
+        return self.save_many([state], source)[0]
+
+    def latest(self, field):
+        """ This function will return the latest plan of a field.
+
+        :parameter field - The field name.
+
+        :return state - The session state dictionary, or None if the field has never been saved.
+        """
+
+        row = self.connection.execute("SELECT state FROM plans WHERE field = ? ORDER BY version DESC LIMIT 1",
+                                      (field,)).fetchone()
+
+        return json.loads(row[0]) if row is not None else None
+
+    def latest_all(self, fields=None):
+        """ This function will return the latest plan of many fields in one query.
+
+        :parameter fields - The field names to return, or None for every field in the store.
+
+        :return plans - A dictionary of session state dictionaries keyed on the field name.
+        """
+
+        query = ("SELECT p.field, p.state FROM plans p JOIN (SELECT field, MAX(version) AS version FROM plans "
+                 "GROUP BY field) latest ON p.field = latest.field AND p.version = latest.version")
+        plans = {field: json.loads(state) for field, state in self.connection.execute(query)}
+
+        if fields is not None:
+            plans = {field: plans[field] for field in fields if field in plans}
+
+        return plans
+
+    def history(self, field):
+        """ This function will return every saved version of a field, oldest first.
+
+        :parameter field - The field name.
+
+        :return history - A list of dictionaries with the version, time, source and state of each save.
+        """
+
+        rows = self.connection.execute("SELECT version, created, source, state FROM plans WHERE field = ? "
+                                       "ORDER BY version", (field,))
+
+        return [{'version': version, 'created': created, 'source': source, 'state': json.loads(state)}
+                for version, created, source, state in rows]
+
+    def close(self):
+        """ This function will close the database.
+
+        :return - Nothing is returned.
+        """
+
+        self.connection.close()
+
+
+class Session:
+
+    def __init__(self, field, ra_deg, dec_deg, store=None):
+        """ The session keeps the cameras, fibers and fiber moves of one field in memory. Changes are batched and
+        written to the plan store as one transaction when the session is flushed.
+
+        :parameter field - The field name.
+        :parameter ra_deg, dec_deg - The center of the field in degrees.
+        :parameter store - The plan store to save to, defaults to the one in the configuration.
+        """
+
+        self.field = field
+        self.ra = ra_deg
+        self.dec = dec_deg
+        self.store = store
+        self.dirty = False
+        self.last_flush = time.time()
+
+        # everything is nan until it is placed
+        self.camera_x = np.full((4, 5), np.nan)
+        self.camera_y = np.full((4, 5), np.nan)
+        self.guide_x = np.full(4, np.nan)
+        self.guide_y = np.full(4, np.nan)
+        self.fiber_x = np.full(4, np.nan)
+        self.fiber_y = np.full(4, np.nan)
+        self.move_x = np.full(4, np.nan)
+        self.move_y = np.full(4, np.nan)
+        self.offsets = np.full((4, 2), np.nan)
+
+    @staticmethod
+    def to_list(values):
+        """ This function will convert an array to a json friendly list, with nan stored as None.
+
+        :parameter values - A numpy array.
+
+        :return A (nested) list.
+        """
+
+        return np.where(np.isnan(values), None, values).tolist()
+
+    @staticmethod
+    def from_list(values):
+        """ This function will convert a list made by to_list back to an array.
+
+        :parameter values - A (nested) list where None is nan.
+
+        :return A numpy array.
+        """
+
+        return np.array(values, dtype=np.float64)
+
+    def to_dict(self):
+        """ This function will return the state of the session as a json friendly dictionary.
+
+        :return state - The session state.
+        """
+
+        return {'field': self.field,
+                'ra': self.ra,
+                'dec': self.dec,
+                'camera_x': self.to_list(self.camera_x),
+                'camera_y': self.to_list(self.camera_y),
+                'guide_x': self.to_list(self.guide_x),
+                'guide_y': self.to_list(self.guide_y),
+                'fiber_x': self.to_list(self.fiber_x),
+                'fiber_y': self.to_list(self.fiber_y),
+                'move_x': self.to_list(self.move_x),
+                'move_y': self.to_list(self.move_y),
+                'offsets': self.to_list(self.offsets)}
+
+    @staticmethod
+    def from_dict(state, store=None):
+        """ This function will rebuild a session from its state.
+
+        :parameter state - The session state, as made by to_dict.
+        :parameter store - The plan store the session saves to.
+
+        :return session - The session.
+        """
+
+        session = Session(state['field'], state['ra'], state['dec'], store)
+        for name in ['camera_x', 'camera_y', 'guide_x', 'guide_y', 'fiber_x', 'fiber_y', 'move_x', 'move_y',
+                     'offsets']:
+            setattr(session, name, Session.from_list(state[name]))
+
+        return session
+
+    @staticmethod
+    def from_record(record, store=None):
+        """ This function will build a session from a record made by the batch planner, so a planned field can be
+        opened and adjusted in the picker.
+
+        :parameter record - The planner record of the field.
+        :parameter store - The plan store the session saves to.
+
+        :return session - The session.
+        """
+
+        session = Session(record['name'], record['ra'], record['dec'], store)
+        for idx, camera in enumerate(record['cameras']):
+            session.camera_x[idx] = camera['box_x']
+            session.camera_y[idx] = camera['box_y']
+            if camera['guide_star'] is not None:
+                session.guide_x[idx] = camera['guide_star']['ra']
+                session.guide_y[idx] = camera['guide_star']['dec']
+        for idx, fiber in enumerate(record['fibers']):
+            session.fiber_x[idx], session.fiber_y[idx] = fiber['position']
+            if fiber['target'] is not None:
+                session.move_x[idx] = fiber['target']['ra']
+                session.move_y[idx] = fiber['target']['dec']
+                session.offsets[idx] = fiber['offset_mm']
+
+        return session
+
+    @staticmethod
+    def resume(field, ra_deg, dec_deg, store=None):
+        """ This function will resume the latest saved session of a field, or start a new one.
+
+        :parameter field - The field name.
+        :parameter ra_deg, dec_deg - The center of the field in degrees.
+        :parameter store - The plan store, defaults to the one in the configuration.
+
+        :return session - The session.
+        """
+
+        store = store if store is not None else PlanStore()
+        state = store.latest(field)
+
+        if state is None:
+            return Session(field, ra_deg, dec_deg, store)
+
+        return Session.from_dict(state, store)
+
+    def set_cameras(self, camera_x, camera_y):
+        """ This function will set the outline of the four guide cameras.
+
+        :parameter camera_x, camera_y - Two (4, 5) numpy arrays with the camera outlines in degrees.
+
+        :return - Nothing is returned.
+        """
+
+        self.camera_x = np.asarray(camera_x, dtype=np.float64)
+        self.camera_y = np.asarray(camera_y, dtype=np.float64)
+        self.changed()
+
+    def set_fiber(self, cam, guide_x, guide_y, fiber_x, fiber_y):
+        """ This function will set the guide star and fiber position of one camera.
+
+        :parameter cam - The camera (1-4).
+        :parameter guide_x, guide_y - The sky position of the guide star in degrees.
+        :parameter fiber_x, fiber_y - The sky position of the fiber in degrees.
+
+        :return - Nothing is returned.
+        """
+
+        self.guide_x[cam - 1], self.guide_y[cam - 1] = guide_x, guide_y
+        self.fiber_x[cam - 1], self.fiber_y[cam - 1] = fiber_x, fiber_y
+        self.changed()
+
+    def set_move(self, fiber, move_x, move_y, offset_x, offset_y):
+        """ This function will set the star a fiber is moved to and its offset.
+
+        :parameter fiber - The fiber (1-4).
+        :parameter move_x, move_y - The sky position of the star in degrees.
+        :parameter offset_x, offset_y - The offset of the move in mm.
+
+        :return - Nothing is returned.
+        """
+
+        self.move_x[fiber - 1], self.move_y[fiber - 1] = move_x, move_y
+        self.offsets[fiber - 1] = offset_x, offset_y
+        self.changed()
+
+    def changed(self):
+        """ This function will mark the session as changed, and flush it if it has not been saved for a while, so
+        a burst of clicks is written as one transaction.
+
+        :return - Nothing is returned.
+        """
+
+        self.dirty = True
+        if time.time() - self.last_flush >= Configuration.SESSION_FLUSH_S:
+            self.flush()
+
+    def flush(self, source='picker'):
+        """ This function will save the session to the plan store as a new version if it has changed.
+
+        :parameter source - Where the changes came from.
+
+        :return - Nothing is returned.
+        """
+
+        if self.dirty and self.store is not None:
+            self.store.save(self.to_dict(), source)
+            self.dirty = False
+        self.last_flush = time.time()
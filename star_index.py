@@ -0,0 +1,107 @@
+""" This class holds the spatial index used to draw only the stars in view, with the faint ones thinned out."""
+import numpy as np
+from config import Configuration
+
+
+class StarIndex:
+
+    def __init__(self, ra, dec, mag, n_cells=None):
+        """ The index splits the bounding box of the stars into a grid of cells and sorts the stars by cell and then
+        by magnitude, so the stars of any cell are one slice of the arrays with the brightest first.
+
+        :parameter ra, dec - Numpy arrays with the position of the stars in degrees.
+        :parameter mag - A numpy array with the magnitude of the stars.
+        :parameter n_cells - The number of cells along each side of the grid.
+        """
+
+        self.n_cells = n_cells if n_cells is not None else Configuration.PICKER_INDEX_CELLS
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.asarray(dec, dtype=np.float64)
+        mag = np.asarray(mag, dtype=np.float64)
+
+        self.x_min, self.y_min = (ra.min(), dec.min()) if len(ra) > 0 else (0., 0.)
+        self.x_size = max(np.ptp(ra) if len(ra) > 0 else 0., 1e-9) / self.n_cells
+        self.y_size = max(np.ptp(dec) if len(dec) > 0 else 0., 1e-9) / self.n_cells
+
+        # sort on the cell first, then the magnitude, so each cell is a contiguous run from brightest to faintest
+        cell = self.cell_of(ra, dec)
+        self.order = np.lexsort((mag, cell))
+        self.ra = ra[self.order]
+        self.dec = dec[self.order]
+        self.mag = mag[self.order]
+        self.cell_start = np.searchsorted(cell[self.order], np.arange(self.n_cells * self.n_cells + 1))
+
+    def cell_of(self, x, y):
+        """ This function will return the cell of each position, positions off the grid go to the edge cells.
+
+        :parameter x, y - Numpy arrays with the positions in degrees.
+
+        :return cell - The flat cell number of each position.
+        """
+
+        col = np.clip(((x - self.x_min) / self.x_size).astype(np.int64), 0, self.n_cells - 1)
+        row = np.clip(((y - self.y_min) / self.y_size).astype(np.int64), 0, self.n_cells - 1)
+
+        return row * self.n_cells + col
+
+    def query(self, x0, x1, y0, y1):
+        """ This function will return the stars inside a box, only the cells overlapping the box are searched.
+
+        :parameter x0, x1 - The right ascension range of the box in degrees, in either order.
+        :parameter y0, y1 - The declination range of the box in degrees, in either order.
+
+        :return idx - The positions of the stars in the sorted arrays of the index.
+        """
+
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        first = self.cell_of(np.array([x0]), np.array([y0]))[0]
+        last = self.cell_of(np.array([x1]), np.array([y1]))[0]
+        cols = np.arange(first % self.n_cells, last % self.n_cells + 1)
+        rows = np.arange(first // self.n_cells, last // self.n_cells + 1)
+
+        # gather the slices of every overlapping cell, then drop the stars of the edge cells outside the box
+        cells = (rows[:, None] * self.n_cells + cols[None, :]).ravel()
+        starts, stops = self.cell_start[cells], self.cell_start[cells + 1]
+        lengths = stops - starts
+        idx = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        inside = (self.ra[idx] >= x0) & (self.ra[idx] <= x1) & (self.dec[idx] >= y0) & (self.dec[idx] <= y1)
+
+        return idx[inside]
+
+    def level_of_detail(self, x0, x1, y0, y1, width_px, height_px, block_px=None):
+        """ This function will return the stars to draw in a view. The view is split into blocks a few pixels wide
+        and only the brightest star in each block is kept, as a fainter star that close would be drawn under it.
+        Nothing else is cut, so every star which can be seen is drawn, and the number drawn is bounded by the size
+        of the view rather than a fixed cap. Zooming in spreads the stars over more blocks and brings out the faint
+        ones.
+
+        :parameter x0, x1, y0, y1 - The limits of the view in degrees.
+        :parameter width_px, height_px - The size of the view in pixels.
+        :parameter block_px - The size of a block in pixels, defaults to the configuration.
+
+        :return ra, dec, mag - Numpy arrays with the stars to draw, brightest first.
+        """
+
+        block_px = block_px if block_px is not None else Configuration.PICKER_STAR_BLOCK_PX
+
+        idx = self.query(x0, x1, y0, y1)
+        if len(idx) == 0:
+            return self.ra[idx], self.dec[idx], self.mag[idx]
+
+        n_x = max(int(width_px / block_px), 1)
+        n_y = max(int(height_px / block_px), 1)
+        bx = np.clip(((self.ra[idx] - min(x0, x1)) / max(abs(x1 - x0), 1e-12) * n_x).astype(np.int64), 0, n_x - 1)
+        by = np.clip(((self.dec[idx] - min(y0, y1)) / max(abs(y1 - y0), 1e-12) * n_y).astype(np.int64), 0, n_y - 1)
+        block = by * n_x + bx
+
+        # the magnitude of the brightest star in each block, found without sorting the stars in view
+        brightest = np.full(n_x * n_y, np.inf)
+        np.minimum.at(brightest, block, self.mag[idx])
+        keep = np.flatnonzero(self.mag[idx] == brightest[block])
+
+        # stars of the same magnitude in one block are drawn once
+        keep = keep[np.unique(block[keep], return_index=True)[1]]
+        idx = idx[keep[np.argsort(self.mag[idx][keep], kind='stable')]]
+
+        return self.ra[idx], self.dec[idx], self.mag[idx]
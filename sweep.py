@@ -0,0 +1,272 @@
+""" This class holds the what-if sweep which scores many instrument configurations against a night's target list,
+so the fiber offsets, camera spacing and plate scale of the next instrument revision can be chosen from real fields.
+Run it from the repository directory with: python sweep.py targets.csv [offsets.json]"""
+import csv
+import itertools
+import json
+import os
+import sys
+import numpy as np
+from config import Configuration
+from catalog_cache import CatalogCache
+from fiber_assignment import FiberAssigner
+from geometry import Geometry
+from metrics import Metrics
+from planner import Planner
+from utils import Utils
+
+
+class Sweep:
+
+    @staticmethod
+    def offset_grid(offsets=None, shifts=None):
+        """ This function will make candidate offset layouts by shifting every fiber of a layout by the same amount
+        on a grid, which is a quick way to see which way the fibers should move.
+
+        :parameter offsets - The [[x], [y]] offsets of the starting layout in mm, defaults to the configuration.
+        :parameter shifts - The shifts to apply along each axis in mm.
+
+        :return layouts - A list of [[x], [y]] offset layouts in mm.
+        """
+
+        offsets = np.asarray(offsets if offsets is not None else Configuration.OFFSETS, dtype=np.float64)
+        shifts = shifts if shifts is not None else Configuration.SWEEP_SHIFTS_MM
+
+        return [(offsets + np.array([[dx], [dy]])).tolist() for dx, dy in itertools.product(shifts, shifts)]
+
+    @staticmethod
+    def configurations(layouts, cam_dists=None, plate_scales=None):
+        """ This function will make every combination of offset layout, camera spacing and plate scale. The layouts
+        vary fastest, so the layouts sharing a camera spacing and plate scale can be scored together.
+
+        :parameter layouts - A list of [[x], [y]] offset layouts in mm.
+        :parameter cam_dists - The distances between neighbouring cameras to try in mm.
+        :parameter plate_scales - The plate scales to try in arcsec / mm.
+
+        :return configurations - A list of dictionaries with the number, offsets, cam_dist and plate_scale.
+        """
+
+        cam_dists = cam_dists if cam_dists is not None else Configuration.SWEEP_CAMERA_DISTS
+        plate_scales = plate_scales if plate_scales is not None else Configuration.SWEEP_PLATE_SCALES
+
+        return [{'configuration': idx, 'offsets': offsets, 'cam_dist': cam_dist, 'plate_scale': plate_scale}
+                for idx, (cam_dist, plate_scale, offsets) in
+                enumerate(itertools.product(cam_dists, plate_scales, layouts))]
+
+    @staticmethod
+    def score_offsets(stars, cameras, offsets, plate_scale, travel_limits=None):
+        """ This function will score many offset layouts against one camera placement at once.
+
+        :parameter stars - A dictionary of ra, dec and mag arrays.
+        :parameter cameras - The camera list from Planner.place_cameras.
+        :parameter offsets - A (C, 2, 4) numpy array of offset layouts in mm.
+        :parameter plate_scale - The plate scale of the telescope in arcsec / mm.
+        :parameter travel_limits - An (F,) array with the furthest each fiber can move in mm.
+
+        :return reachable, assigned, total - A (C, 4) array of the targets each fiber can reach, a (C,) array of the
+        fibers which can be moved onto a target at the same time, and a (C,) array of their total movement in mm.
+        """
+
+        # the fibers are placed from the guide star of each camera, or its center without one, as the planner does
+        base = np.array([[camera['guide_star']['ra'], camera['guide_star']['dec']] if camera['guide_star'] is not None
+                         else camera['center'] for camera in cameras])
+        fib_x, fib_y = Geometry.focal_to_sky(offsets[:, 0, :], offsets[:, 1, :], base[:, 0], base[:, 1], plate_scale)
+
+        # the guide stars are never used as targets
+        targets = np.ones(len(stars['ra']), dtype=bool)
+        for camera in cameras:
+            if camera['guide_star'] is not None:
+                targets &= (stars['ra'] != camera['guide_star']['ra']) | (stars['dec'] != camera['guide_star']['dec'])
+        star_ra, star_dec = stars['ra'][targets], stars['dec'][targets]
+
+        reachable = np.zeros(fib_x.shape, dtype=np.int64)
+        assigned = np.zeros(len(offsets), dtype=np.int64)
+        total = np.zeros(len(offsets))
+
+        # the costs are (C, F, M), so only a chunk of the layouts is held in memory at once
+        for chunk in range(0, len(offsets), Configuration.SWEEP_CHUNK):
+            part = slice(chunk, chunk + Configuration.SWEEP_CHUNK)
+            stars_idx, _, _, total[part], cost = FiberAssigner.assign(fib_x[part], fib_y[part], star_ra, star_dec,
+                                                                      travel_limits, plate_scale, return_cost=True)
+            reachable[part] = np.isfinite(cost).sum(axis=-1)
+            assigned[part] = (stars_idx >= 0).sum(axis=-1)
+
+        return reachable, assigned, total
+
+    @staticmethod
+    def evaluate_field(target, configurations):
+        """ This function will score every configuration on one field.
+
+        :parameter target - A dictionary with the name, ra, dec and mag_cut of the field.
+        :parameter configurations - The configuration list from configurations.
+
+        :return records - One dictionary per configuration with the guide stars and reachable targets.
+        """
+
+        with Metrics.timer('catalog.cone_search'):
+            stars = CatalogCache().cone_search_epoch(target['ra'], target['dec'], Configuration.SEARCH_RADIUS_DEG,
+                                                     target['mag_cut'], target.get('date'))
+
+        records = []
+        groups = itertools.groupby(configurations, key=lambda configuration: (configuration['cam_dist'],
+                                                                              configuration['plate_scale']))
+        for (cam_dist, plate_scale), group in groups:
+            group = list(group)
+
+            # the cameras only depend on the spacing and plate scale, the fibers are then scored for every layout
+            with Metrics.timer('sweep.cameras'):
+                cameras = Planner.place_cameras(stars, target['ra'], target['dec'], cam_dist, plate_scale)
+            with Metrics.timer('sweep.fibers'):
+                offsets = np.array([configuration['offsets'] for configuration in group], dtype=np.float64)
+                reachable, assigned, total = Sweep.score_offsets(stars, cameras, offsets, plate_scale)
+
+            # the guide stars are counted exactly in each placed camera, the optimizer's binned counts only rank the
+            # layouts, so a camera with one guide star is never taken for one without
+            guide_stars = [camera['n_guide_stars'] for camera in cameras]
+            for idx, configuration in enumerate(group):
+                records.append({'name': target['name'],
+                                'configuration': configuration['configuration'],
+                                'guide_stars': guide_stars,
+                                'all_cameras_guided': all(n > 0 for n in guide_stars),
+                                'reachable': reachable[idx].tolist(),
+                                'fibers_assigned': int(assigned[idx]),
+                                'total_mm': float(total[idx])})
+
+        return records
+
+    @staticmethod
+    def evaluate_field_metrics(target, configurations):
+        """ This function will score a field in a worker and return the worker's metrics with it.
+
+        :parameter target - A dictionary with the name, ra, dec and mag_cut of the field.
+        :parameter configurations - The configuration list from configurations.
+
+        :return records, metrics - The records from evaluate_field and the metrics of scoring them.
+        """
+
+        Metrics.reset()
+        records = Sweep.evaluate_field(target, configurations)
+
+        return records, Metrics.snapshot()
+
+    @staticmethod
+    def summarize(configurations, records):
+        """ This function will combine the records of every field into one row per configuration.
+
+        :parameter configurations - The configuration list from configurations.
+        :parameter records - The records of every field.
+
+        :return summary - A list of dictionaries, best configuration first.
+        """
+
+        by_configuration = {}
+        for record in records:
+            by_configuration.setdefault(record['configuration'], []).append(record)
+
+        summary = []
+        for configuration in configurations:
+            rows = by_configuration.get(configuration['configuration'], [])
+            if len(rows) == 0:
+                continue
+            summary.append({'configuration': configuration['configuration'],
+                            'cam_dist': configuration['cam_dist'],
+                            'plate_scale': configuration['plate_scale'],
+                            'offsets': json.dumps(configuration['offsets']),
+                            'n_fields': len(rows),
+                            'guided_fraction': float(np.mean([row['all_cameras_guided'] for row in rows])),
+                            'mean_guide_stars': float(np.mean([sum(row['guide_stars']) for row in rows])),
+                            'mean_reachable': float(np.mean([sum(row['reachable']) for row in rows])),
+                            'mean_fibers_assigned': float(np.mean([row['fibers_assigned'] for row in rows])),
+                            'mean_total_mm': float(np.mean([row['total_mm'] for row in rows]))})
+
+        # the layouts which guide and fill the most fibers on the most fields come first
+        summary.sort(key=lambda row: (-row['guided_fraction'], -row['mean_fibers_assigned'], -row['mean_reachable'],
+                                      row['mean_total_mm']))
+
+        return summary
+
+    @staticmethod
+    def run(targets, configurations, output_file, workers=None):
+        """ This function will score every configuration on every field in parallel, one field per worker.
+
+        :parameter targets - A list of target dictionaries from Planner.read_targets.
+        :parameter configurations - The configuration list from configurations.
+        :parameter output_file - The json lines file to write one record per field and configuration to.
+        :parameter workers - The number of processes to use, defaults to the configuration.
+
+        :return summary - The summary from summarize.
+        """
+
+        # the process pool is only needed for sweeps, so keep it out of the import of the sweep
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = workers if workers is not None else Configuration.BATCH_WORKERS
+
+        records = []
+        with ProcessPoolExecutor(max_workers=workers) as pool, open(output_file, 'w') as f:
+            futures = [(target, pool.submit(Sweep.evaluate_field_metrics, target, configurations))
+                       for target in targets]
+            for target, future in futures:
+                try:
+                    field_records, metrics = future.result()
+                    Metrics.merge(metrics)
+                except Exception as error:
+                    # one bad field should not stop the rest of the sweep
+                    Utils.log("Sweep failed for field " + target['name'] + ": " + str(error), "error")
+                    Metrics.count('sweep.failed')
+                    continue
+                for record in field_records:
+                    f.write(json.dumps(record) + "\n")
+                records.extend(field_records)
+
+        Utils.log("Scored " + str(len(configurations)) + " configurations on " + str(len(targets)) + " fields.",
+                  "info")
+
+        return Sweep.summarize(configurations, records)
+
+    @staticmethod
+    def write_summary(summary, output_file):
+        """ This function will write the summary as a csv file.
+
+        :parameter summary - The summary from summarize.
+        :parameter output_file - The csv file to write.
+
+        :return - Nothing is returned, but the file is written.
+        """
+
+        if len(summary) == 0:
+            return
+
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(summary[0].keys()))
+            writer.writeheader()
+            writer.writerows(summary)
+
+
+if __name__ == '__main__':
+    # do the necessary prep work such as making the directories
+    Utils.create_directories(Configuration.DIRECTORIES)
+
+    # the target list is required, the offset layouts can be given as a json list of [[x], [y]] layouts
+    target_file = sys.argv[1] if len(sys.argv) > 1 else Configuration.TARGET_LIST_FILE
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as layout_file:
+            layouts = json.load(layout_file)
+    else:
+        layouts = Sweep.offset_grid()
+
+    targets = Planner.read_targets(target_file)
+    configurations = Sweep.configurations(layouts)
+
+    with Metrics.profile():
+        base_name = Configuration.ANALYSIS_DIRECTORY + os.path.splitext(os.path.basename(target_file))[0]
+        summary = Sweep.run(targets, configurations, base_name + '_sweep.jsonl')
+        Sweep.write_summary(summary, base_name + '_sweep_summary.csv')
+
+    Metrics.write(os.path.basename(target_file) + ' sweep')
+
+    for row in summary[:10]:
+        Utils.log("Configuration " + str(row['configuration']) + " (cam_dist " + str(row['cam_dist']) +
+                  ", plate scale " + str(row['plate_scale']) + "): guided on " +
+                  str(round(100. * row['guided_fraction'])) + "% of fields, " +
+                  str(round(row['mean_fibers_assigned'], 2)) + " fibers assigned on average.", "info")
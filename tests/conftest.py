@@ -0,0 +1,122 @@
+""" This file holds the shared fixtures of the tests. Run the tests from the repository directory with:
+python -m pytest tests"""
+import os
+import sys
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+
+import numpy as np
+import pytest
+from backends import catalog_columns
+
+# the cones the catalog tests search, across the ra wrap, both poles and the equator, with a radius in degrees
+CONES = [(0.05, 10., 1.), (359.95, -30., 0.6), (120., 89.9, 1.), (250., -89.8, 0.5), (180., 0., 0.3),
+         (348.4948229, 8.7612697, 0.0833)]
+
+
+def cap(rng, n_stars, ra_deg, dec_deg, radius_deg):
+    """ This function will spread stars uniformly over a cap on the sky.
+
+    :parameter rng - The numpy random generator.
+    :parameter n_stars - The number of stars.
+    :parameter ra_deg, dec_deg - The center of the cap in degrees.
+    :parameter radius_deg - The radius of the cap in degrees.
+
+    :return ra, dec - The positions of the stars in degrees, ra in [0, 360).
+    """
+
+    # uniform about the pole of a local frame, then turned so the pole lands on the center of the cap
+    z = rng.uniform(np.cos(np.radians(radius_deg)), 1., n_stars)
+    phi = rng.uniform(0., 2. * np.pi, n_stars)
+    r = np.sqrt(1. - z ** 2)
+
+    ra0, dec0 = np.radians(ra_deg), np.radians(dec_deg)
+    center = np.array([np.cos(dec0) * np.cos(ra0), np.cos(dec0) * np.sin(ra0), np.sin(dec0)])
+    east = np.array([-np.sin(ra0), np.cos(ra0), 0.])
+    north = np.cross(center, east)
+    vectors = (r * np.cos(phi))[:, None] * east + (r * np.sin(phi))[:, None] * north + z[:, None] * center
+
+    return (np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0])) % 360.,
+            np.degrees(np.arcsin(np.clip(vectors[:, 2], -1., 1.))))
+
+
+def brute_force_cone(columns, ra_deg, dec_deg, radius_deg, mag_cut):
+    """ This function will cut a catalog to a cone by checking every star, with the distance taken between unit
+    vectors, so it does not share any code with the searches it checks.
+
+    :parameter columns - A dictionary of the catalog columns.
+    :parameter ra_deg, dec_deg - The center of the cone in degrees.
+    :parameter radius_deg - The radius of the cone in degrees.
+    :parameter mag_cut - The magnitude cutoff for the stars.
+
+    :return keep, edge - Boolean arrays of the stars in the cone, and of the stars so close to its edge that
+    rounding may put them on either side.
+    """
+
+    ra, dec = np.radians(columns['ra']), np.radians(columns['dec'])
+    ra0, dec0 = np.radians(ra_deg), np.radians(dec_deg)
+    vectors = np.column_stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)])
+    center = np.array([np.cos(dec0) * np.cos(ra0), np.cos(dec0) * np.sin(ra0), np.sin(dec0)])
+    dist = np.degrees(np.arctan2(np.linalg.norm(np.cross(vectors, center), axis=1), vectors @ center))
+
+    bright = columns['mag'] < mag_cut
+
+    return (dist <= radius_deg) & bright, (np.abs(dist - radius_deg) < 1e-9) & bright
+
+
+def assert_same_stars(found, columns, ra_deg, dec_deg, radius_deg, mag_cut):
+    """ This function will check a cone search returned exactly the stars a brute force search finds.
+
+    :parameter found - The columns returned by the search.
+    :parameter columns - The full catalog.
+    :parameter ra_deg, dec_deg, radius_deg, mag_cut - The cone searched.
+
+    :return - Nothing is returned, the test fails if the stars differ.
+    """
+
+    keep, edge = brute_force_cone(columns, ra_deg, dec_deg, radius_deg, mag_cut)
+    assert keep.sum() > 0
+
+    # the stars are told apart by their position, rounded as the csv files can change the last digit
+    def positions(ra, dec):
+        return list(zip(np.round(ra, 8), np.round(dec, 8)))
+
+    expected = set(positions(columns['ra'][keep & ~edge], columns['dec'][keep & ~edge]))
+    allowed = expected | set(positions(columns['ra'][edge], columns['dec'][edge]))
+    returned = positions(found['ra'], found['dec'])
+
+    assert len(returned) == len(set(returned))
+    assert expected <= set(returned) <= allowed
+    assert np.all(found['mag'] < mag_cut)
+
+
+@pytest.fixture(scope='session')
+def sky_catalog():
+    """ A catalog with a few thousand stars about each of the test cones, with magnitudes on both sides of the cut.
+
+    :return columns - A dictionary of the catalog columns, as a backend returns them.
+    """
+
+    rng = np.random.default_rng(12)
+    positions = [cap(rng, 4000, ra_deg, dec_deg, 1.5 * radius_deg) for ra_deg, dec_deg, radius_deg in CONES]
+    ra = np.concatenate([position[0] for position in positions])
+    dec = np.concatenate([position[1] for position in positions])
+
+    return catalog_columns(ra, dec, rng.uniform(6., 17., len(ra)))
+
+
+@pytest.fixture
+def catalog_csv(tmp_path, sky_catalog):
+    """ The sky catalog written as a TIC style csv file.
+
+    :return csv_file - The path of the csv file.
+    """
+
+    import pandas as pd
+
+    csv_file = tmp_path / 'tic.csv'
+    pd.DataFrame({'ra': sky_catalog['ra'], 'dec': sky_catalog['dec'],
+                  'GAIAmag': sky_catalog['mag']}).to_csv(csv_file, index=False, float_format='%.17g')
+
+    return csv_file
@@ -0,0 +1,80 @@
+""" These tests check the astrometric solver recovers a pointing error and rotation put into a synthetic frame set."""
+import numpy as np
+import pytest
+from astrometry import Astrometry
+from config import Configuration
+from geometry import Geometry
+
+CAM_RA, CAM_DEC = 348.49, 8.76
+
+
+def field(rng):
+    """ This function will place bright stars on every camera and fainter ones around them, which the cameras do
+    not measure.
+
+    :parameter rng - The numpy random generator.
+
+    :return stars, star_x, star_y - The catalog of the field, and the focal plane position about camera 1 in mm of
+    the stars the cameras measure.
+    """
+
+    cen_x, cen_y = Geometry.camera_offsets(1)
+    half_x, half_y = Configuration.DFPS_GUIDE_CAMERA_SIZE_X_MM / 2., Configuration.DFPS_GUIDE_CAMERA_SIZE_Y_MM / 2.
+    star_x = np.concatenate([x + rng.uniform(-half_x, half_x, 8) for x in cen_x])
+    star_y = np.concatenate([y + rng.uniform(-half_y, half_y, 8) for y in cen_y])
+    faint_x, faint_y = rng.uniform(-80., 80., (2, 200))
+
+    ra, dec = Geometry.focal_to_sky(np.concatenate([star_x, faint_x]), np.concatenate([star_y, faint_y]),
+                                    CAM_RA, CAM_DEC)
+    mag = np.concatenate([np.full(len(star_x), 10.), np.full(len(faint_x), Configuration.GUIDE_STAR_MAG_LIMIT + 1.)])
+
+    return {'ra': ra % 360., 'dec': dec, 'mag': mag}, star_x, star_y
+
+
+def measure(star_x, star_y, shift, angle_deg, noise_mm, rng):
+    """ This function will measure the stars as the cameras would see them with the telescope off by a shift and
+    rotation, the solver should find catalog ~ measured @ rotation.T + shift.
+
+    :parameter star_x, star_y - The catalog positions of the stars in mm about camera 1.
+    :parameter shift - The (2,) pointing error in mm.
+    :parameter angle_deg - The rotation in degrees.
+    :parameter noise_mm - The centroid error in mm.
+    :parameter rng - The numpy random generator.
+
+    :return measurements - One measurement per camera, with the positions in mm from the camera center.
+    """
+
+    angle = np.radians(angle_deg)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    points = (np.column_stack([star_x, star_y]) - shift) @ rotation + rng.normal(0., noise_mm, (len(star_x), 2))
+
+    cen_x, cen_y = Geometry.camera_offsets(1)
+    return [{'camera': cam + 1,
+             'x_mm': points[cam * 8:(cam + 1) * 8, 0] - cen_x[cam],
+             'y_mm': points[cam * 8:(cam + 1) * 8, 1] - cen_y[cam]} for cam in range(4)]
+
+
+@pytest.mark.parametrize('shift, angle_deg', [((0., 0.), 0.), ((0.3, -0.5), 0.2), ((-1.2, 0.8), -0.3)])
+def test_solve_recovers_shift_and_rotation(shift, angle_deg):
+    rng = np.random.default_rng(7)
+    stars, star_x, star_y = field(rng)
+    astrometry = Astrometry(stars, CAM_RA, CAM_DEC)
+
+    solution = astrometry.solve(measure(star_x, star_y, np.array(shift), angle_deg, 0.002, rng))
+
+    assert solution['solved']
+    assert solution['n_matched'] == len(star_x)
+    np.testing.assert_allclose(solution['shift_mm'], shift, atol=0.005)
+    assert solution['rotation_deg'] == pytest.approx(angle_deg, abs=0.01)
+    assert solution['rms_mm'] < 0.01
+
+
+def test_solve_without_stars():
+    rng = np.random.default_rng(8)
+    stars, _, _ = field(rng)
+
+    solution = Astrometry(stars, CAM_RA, CAM_DEC).solve([])
+
+    assert not solution['solved']
+    np.testing.assert_array_equal(solution['rotation'], np.eye(2))
+    np.testing.assert_array_equal(solution['shift_mm'], np.zeros(2))
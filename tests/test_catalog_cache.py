@@ -0,0 +1,27 @@
+""" These tests check the tiles of the catalog cache cover every cone, across the ra wrap and the poles."""
+import pytest
+from backends import DirectoryBackend
+from catalog_cache import CatalogCache
+from conftest import CONES, assert_same_stars
+
+
+@pytest.mark.parametrize('ra_deg, dec_deg, radius_deg', CONES)
+def test_cone_search_matches_brute_force(tmp_path, sky_catalog, catalog_csv, ra_deg, dec_deg, radius_deg):
+    cache_directory = tmp_path / 'cache'
+    cache_directory.mkdir()
+    cache = CatalogCache(str(cache_directory), backend=DirectoryBackend(str(catalog_csv.parent)))
+
+    # the first search queries every tile, the second reads them back from disk
+    for _ in range(2):
+        found = cache.cone_search_columns(ra_deg, dec_deg, radius_deg, 16.)
+        assert_same_stars(found, sky_catalog, ra_deg, dec_deg, radius_deg, 16.)
+
+
+def test_tiles_cover_the_pole(tmp_path):
+    cache = CatalogCache(str(tmp_path), backend=DirectoryBackend(str(tmp_path)))
+
+    # a cone over the pole needs every cell of the zones it reaches
+    tiles = cache.tiles_for_cone(10., 89.95, 0.1)
+    zones = set(zone for zone, _ in tiles)
+    assert zones == set(range(cache.n_zones - 1, cache.n_zones))
+    assert len(tiles) == sum(cache.n_cells(zone) for zone in zones)
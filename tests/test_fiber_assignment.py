@@ -0,0 +1,59 @@
+""" These tests check the fiber assignment finds the best moves, by trying every way of assigning four fibers."""
+import itertools
+import numpy as np
+import pytest
+from fiber_assignment import FiberAssigner
+
+
+def brute_force(cost):
+    """ This function will try every assignment of the fibers to distinct stars, or to none.
+
+    :parameter cost - An (F, M) numpy array of costs, infinite where a fiber can not reach a star.
+
+    :return assigned, total - The most fibers which can be assigned at once, and the least total cost doing so.
+    """
+
+    n_fibers, n_stars = cost.shape
+    best = (0, 0.)
+    for choice in itertools.product(range(-1, n_stars), repeat=n_fibers):
+        used = [star for star in choice if star >= 0]
+        if len(used) != len(set(used)):
+            continue
+        moves = [cost[fiber, star] for fiber, star in enumerate(choice) if star >= 0]
+        if not np.all(np.isfinite(moves)):
+            continue
+        if (len(moves), -sum(moves)) > (best[0], -best[1]):
+            best = (len(moves), sum(moves))
+
+    return best
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_assign_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n_stars = rng.integers(1, 8)
+    fib_x, fib_y = 120. + rng.uniform(-0.03, 0.03, (2, 4))
+    star_x, star_y = 120. + rng.uniform(-0.05, 0.05, (2, n_stars))
+    travel_limits = np.full(4, 15.)
+
+    stars, move_x, move_y, total = FiberAssigner.assign(fib_x, fib_y, star_x, star_y, travel_limits, 7.23)
+    cost = FiberAssigner.cost_matrix(fib_x, fib_y, star_x, star_y, travel_limits, 7.23)
+    assigned, best_total = brute_force(cost)
+
+    used = stars[stars >= 0]
+    assert len(used) == len(set(used))
+    assert np.all(np.isfinite(cost[np.flatnonzero(stars >= 0), used]))
+    assert len(used) == assigned
+    assert total == pytest.approx(best_total, abs=1e-9)
+
+    # the offsets are the moves the total is made of, and nan for the fibers left where they are
+    assert np.all(np.isnan(move_x[stars < 0]))
+    assert np.nansum(np.hypot(move_x, move_y)) == pytest.approx(total, abs=1e-9)
+
+
+def test_assign_without_stars():
+    stars, move_x, move_y, total = FiberAssigner.assign(np.zeros(4), np.zeros(4), np.zeros(0), np.zeros(0))
+
+    assert np.all(stars == -1)
+    assert np.all(np.isnan(move_x)) and np.all(np.isnan(move_y))
+    assert total == 0.
@@ -0,0 +1,38 @@
+""" These tests check the gnomonic projection of the focal plane and its inverse."""
+import numpy as np
+import pytest
+from conftest import cap
+from geometry import Geometry
+
+
+@pytest.mark.parametrize('ra0, dec0', [(0., 0.), (359.99, 45.), (0.01, -60.), (180., 89.99), (42., -89.99)])
+def test_focal_to_sky_round_trip(ra0, dec0):
+    rng = np.random.default_rng(3)
+    x, y = rng.uniform(-60., 60., (2, 1000))
+
+    ra, dec = Geometry.focal_to_sky(x, y, ra0, dec0)
+    x_back, y_back = Geometry.sky_to_focal(ra, dec, ra0, dec0)
+
+    np.testing.assert_allclose(x_back, x, atol=1e-9)
+    np.testing.assert_allclose(y_back, y, atol=1e-9)
+
+
+@pytest.mark.parametrize('ra0, dec0', [(0., 0.), (359.99, 45.), (0.01, -60.), (180., 89.99), (42., -89.99)])
+def test_sky_to_focal_round_trip(ra0, dec0):
+    ra, dec = cap(np.random.default_rng(4), 1000, ra0, dec0, 0.1)
+
+    x, y = Geometry.sky_to_focal(ra, dec, ra0, dec0)
+    ra_back, dec_back = Geometry.focal_to_sky(x, y, ra0, dec0)
+
+    # ra is returned continuous with ra0, so compare it across the wrap, as a distance on the sky
+    d_ra = (ra_back - ra + 180.) % 360. - 180.
+    np.testing.assert_allclose(d_ra * np.cos(np.radians(dec)), 0., atol=1e-9)
+    np.testing.assert_allclose(dec_back, dec, atol=1e-9)
+
+
+def test_focal_plane_scale():
+    # one mm east and north of the tangent point on the equator is one plate scale on the sky
+    ra, dec = Geometry.focal_to_sky(np.array([1., 0.]), np.array([0., 1.]), 10., 0., 7.23)
+
+    np.testing.assert_allclose((ra - 10.) * 3600., [7.23, 0.], atol=1e-6)
+    np.testing.assert_allclose(dec * 3600., [0., 7.23], atol=1e-6)
@@ -0,0 +1,30 @@
+""" These tests check the cone searches of the local catalog against a brute force search of the bulk file."""
+import pytest
+from conftest import CONES, assert_same_stars
+from local_catalog import LocalCatalog
+
+
+@pytest.fixture
+def local_catalog(tmp_path, catalog_csv):
+    """ A local catalog built from the sky catalog, read in small chunks so the zones are spilled several times.
+
+    :return catalog - The local catalog.
+    """
+
+    directory = tmp_path / 'local_catalog'
+    directory.mkdir()
+    LocalCatalog(str(directory)).ingest([str(catalog_csv)], chunk_rows=5000)
+
+    return LocalCatalog(str(directory))
+
+
+@pytest.mark.parametrize('ra_deg, dec_deg, radius_deg', CONES)
+def test_query_matches_brute_force(local_catalog, sky_catalog, ra_deg, dec_deg, radius_deg):
+    found = local_catalog.query(ra_deg, dec_deg, radius_deg, 16.)
+
+    assert_same_stars(found, sky_catalog, ra_deg, dec_deg, radius_deg, 16.)
+
+
+def test_query_without_catalog(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        LocalCatalog(str(tmp_path)).query(10., 10., 0.1, 16.)
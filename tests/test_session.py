@@ -0,0 +1,45 @@
+""" These tests check a session saved to the plan store is resumed as it was left."""
+import numpy as np
+from session import PlanStore, Session
+
+
+def test_save_and_resume(tmp_path):
+    path = str(tmp_path / 'plans.sqlite')
+    store = PlanStore(path)
+
+    session = Session('WASP-52', 348.49, 8.76, store)
+    session.set_cameras(np.arange(20.).reshape(4, 5), np.arange(20., 40.).reshape(4, 5))
+    session.set_fiber(2, 348.5, 8.7, 348.51, 8.71)
+    session.set_move(3, 348.52, 8.72, 1.5, -2.5)
+    session.flush('test')
+
+    # a later change is a new version, and resuming gives the latest one
+    session.set_move(4, 348.53, 8.73, 0.5, 0.25)
+    session.flush('test')
+    store.close()
+
+    store = PlanStore(path)
+    resumed = Session.resume('WASP-52', 0., 0., store)
+
+    assert [entry['version'] for entry in store.history('WASP-52')] == [1, 2]
+    assert (resumed.field, resumed.ra, resumed.dec) == ('WASP-52', 348.49, 8.76)
+    for name in ['camera_x', 'camera_y', 'guide_x', 'guide_y', 'fiber_x', 'fiber_y', 'move_x', 'move_y', 'offsets']:
+        np.testing.assert_array_equal(getattr(resumed, name), getattr(session, name))
+    assert np.isnan(resumed.guide_x[0]) and resumed.guide_x[1] == 348.5
+    np.testing.assert_array_equal(resumed.offsets[2:], [[1.5, -2.5], [0.5, 0.25]])
+    store.close()
+
+
+def test_resume_new_field(tmp_path):
+    store = PlanStore(str(tmp_path / 'plans.sqlite'))
+
+    session = Session.resume('new field', 10., 20., store)
+
+    assert (session.field, session.ra, session.dec) == ('new field', 10., 20.)
+    assert np.all(np.isnan(session.camera_x)) and np.all(np.isnan(session.offsets))
+    assert store.latest('new field') is None
+
+    # nothing is saved until the session changes
+    session.flush('test')
+    assert store.history('new field') == []
+    store.close()
@@ -2,55 +2,66 @@
 from config import Configuration
 import logging
 import os
+import re
+import threading
 
 
 class Utils:
 
-    @staticmethod
-    def log(statement, level):
-        """ The logger function to log all activity from the program to both the screen, and a file.
+    # the program logger, set up on the first call to log, and its log file once the log directory exists
+    logger = None
+    file_handler = None
+    logger_lock = threading.Lock()
 
-        :argument statement: A string which shows want needs to be logged
-        :argument level:- The type of statement: info, debug, etc
+    # the levels log dispatches on, any other level is logged as info
+    LEVELS = ('debug', 'info', 'warning', 'error', 'critical')
 
-        :return - Nothing is returned, but the log is updated and possibly the log is printed to the screen
+    @staticmethod
+    def get_logger():
+        """ This function will set up the logger the first time it is needed, writing to both the screen and a file.
+
+        :return logger - The program logger.
         """
 
-        # create the logger
-        logging.basicConfig(format="%(asctime)s - %(levelname)s: %(message)s",
-                            filename=Configuration.LOG_DIRECTORY + "dfps.log",
-                            filemode='a')
-        logger = logging.getLogger()
+        if Utils.logger is not None and Utils.file_handler is not None:
+            return Utils.logger
+
+        # threads such as the prefetcher log too, so only one of them adds each handler
+        with Utils.logger_lock:
+            if Utils.logger is None:
+                formatter = logging.Formatter("%(asctime)s - %(levelname)s: %(message)s")
+                logger = logging.getLogger('dfps')
+                logger.setLevel(logging.DEBUG)
+                logger.propagate = False
+
+                # the console
+                ch = logging.StreamHandler()
+                ch.setLevel(logging.DEBUG)
+                ch.setFormatter(formatter)
+                logger.addHandler(ch)
 
-        if not getattr(logger, 'handler_set', None):
-            logger.setLevel(logging.DEBUG)
+                Utils.logger = logger
 
-            # create console handler and set level to debug
-            ch = logging.StreamHandler()
-            ch.setLevel(logging.DEBUG)
+            # the log file, as soon as the log directory has been made
+            if Utils.file_handler is None and os.path.isdir(Configuration.LOG_DIRECTORY):
+                file_handler = logging.FileHandler(Configuration.LOG_DIRECTORY + "dfps.log", mode='a')
+                file_handler.setFormatter(Utils.logger.handlers[0].formatter)
+                Utils.logger.addHandler(file_handler)
+                Utils.file_handler = file_handler
 
-            # create the formatter
-            formatter = logging.Formatter("%(asctime)s - %(levelname)s: %(message)s")
+        return Utils.logger
 
-            # add formatter to ch
-            ch.setFormatter(formatter)
+    @staticmethod
+    def log(statement, level):
+        """ The logger function to log all activity from the program to both the screen, and a file.
 
-            # add ch to logger
-            logger.addHandler(ch)
+        :argument statement: A string which shows want needs to be logged
+        :argument level:- The type of statement: info, debug, etc, anything else is logged as info
 
-            # 'set' Handler
-            logger.handler_set = True
+        :return - Nothing is returned, but the log is updated and possibly the log is printed to the screen
+        """
 
-        if level == 'info':
-            logger.info(statement)
-        if level == 'debug':
-            logger.debug(statement)
-        if level == 'warning':
-            logger.warning(statement)
-        if level == 'error':
-            logger.error(statement)
-        if level == 'critical':
-            logger.critical(statement)
+        getattr(Utils.get_logger(), level if level in Utils.LEVELS else 'info')(statement)
 
     @staticmethod
     def get_file_list(path, file_ext):
@@ -64,10 +75,23 @@ class Utils:
         file_list = [f for f in os.listdir(path) if f.endswith(file_ext)]
 
         # sort based on the number of the image, first taken image will be first
-        file_list.sort(key=len)
+        file_list.sort(key=Utils.natural_key)
 
         return file_list
 
+    @staticmethod
+    def natural_key(file_name):
+        """ This function will return a sort key which orders the numbers in a file name by value, so image_10 comes
+        after image_9 and frames from different nights or cameras keep their own order.
+
+        :parameter file_name - The file name.
+
+        :return key - A tuple of the text and number parts of the name.
+        """
+
+        return tuple((0, int(part), '') if part.isdigit() else (1, 0, part.lower())
+                     for part in re.split(r'(\d+)', file_name) if part != '')
+
     @staticmethod
     def create_directories(directory_list):
         """ This function will check for each directory in directory list, and create it if it doesn't already exist
@@ -77,8 +101,13 @@ class Utils:
         :return - Nothing is returned but directories are created if necessary
         """
 
+        # make every directory before logging, so the log directory exists for the first line of the log file
+        created = []
         for path in directory_list:
             # if the path does not exist then create it!
             if os.path.exists(path) is False:
                 os.mkdir(path)
-                Utils.log(path + ' created.', 'info')
\ No newline at end of file
+                created.append(path)
+
+        for path in created:
+            Utils.log(path + ' created.', 'info')
\ No newline at end of file